@@ -10,7 +10,9 @@ from timeseries import \
 from soundfile import \
     MetaData, AudioMetaData, AudioMetaDataEncoder, OggVorbis, \
     OggVorbisDecoder, OggVorbisEncoder, OggVorbisFeature, OggVorbisWrapper, \
-    AudioStream, Resampler, ChunkSizeBytes
+    OggVorbisIndex, OggVorbisIndexFeature, AudioStream, AudioByteStream, \
+    Resampler, ChunkSizeBytes, AudioCodec, AudioCodecFeature, \
+    SoundFileWrapper, Pcm16Wrapper
 
 from spectral import \
     SlidingWindow, OggVorbisWindowingFunc, WindowingFunc, \
@@ -52,7 +54,8 @@ from ui import \
 
 from index import \
     SearchResults, HammingDb, HammingIndex, BruteForceSearch, \
-    HammingDistanceBruteForceSearch
+    HammingDistanceBruteForceSearch, IVFPQSearch, ShardedHammingDb, \
+    ShardedHammingIndex
 
 from basic import \
     Slice, Sum, Max, Pooled, process_dir, stft, audio_graph, with_onsets, \
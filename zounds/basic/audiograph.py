@@ -1,8 +1,9 @@
 import numpy as np
-from featureflow import BaseModel, JSONFeature, ByteStream, ByteStreamFeature
+from featureflow import BaseModel, JSONFeature, ByteStreamFeature
 from zounds.soundfile import \
     MetaData, AudioMetaDataEncoder, OggVorbis, OggVorbisFeature, AudioStream, \
-    Resampler, ChunkSizeBytes
+    AudioByteStream, OggVorbisIndex, OggVorbisIndexFeature, Resampler, \
+    ChunkSizeBytes, AudioCodec, AudioCodecFeature
 from zounds.segment import \
     ComplexDomain, MovingAveragePeakPicker, TimeSliceFeature
 from zounds.persistence import ArrayWithUnitsFeature, AudioSamplesFeature, \
@@ -19,10 +20,39 @@ DEFAULT_CHUNK_SIZE = ChunkSizeBytes(
     channels=2)
 
 
+def _playback_feature(raw, codec='vorbis', background_encode=False):
+    """
+    Produce the stored feature that holds a compact, playable copy of the
+    incoming audio.  Graphs always name this feature `ogg`, even when it holds
+    FLAC or PCM16 data, so that code reading it back needn't know which codec
+    was chosen
+
+    :param raw: The feature producing the raw, encoded byte stream
+    :param codec: `vorbis`, or one of the codecs supported by
+    :class:`~zounds.soundfile.AudioCodec`
+    :param background_encode: Encode ogg vorbis audio in a worker thread
+    :return: The playback feature
+    """
+    if codec == 'vorbis':
+        return OggVorbisFeature(
+            OggVorbis,
+            background=background_encode,
+            needs=raw,
+            store=True)
+
+    return AudioCodecFeature(
+        AudioCodec,
+        codec=codec,
+        needs=raw,
+        store=True)
+
+
 def resampled(
         chunksize_bytes=DEFAULT_CHUNK_SIZE,
         resample_to=SR44100(),
-        store_resampled=False):
+        store_resampled=False,
+        background_encode=False,
+        codec='vorbis'):
     """
     Create a basic processing pipeline that can resample all incoming audio
     to a normalized sampling rate for downstream processing, and store a
@@ -31,6 +61,11 @@ def resampled(
     :param chunksize_bytes: The number of bytes from the raw stream to process
     at once
     :param resample_to: The new, normalized sampling rate
+    :param background_encode: Encode the ogg vorbis version in a worker thread,
+    overlapping with the rest of the pipeline
+    :param codec: The codec used to store audio for playback; `vorbis`, or
+    one of the codecs supported by :class:`~zounds.soundfile.AudioCodec`,
+    which trade disk space for cheaper decoding
     :return: A simple processing pipeline
     """
 
@@ -41,15 +76,18 @@ def resampled(
             encoder=AudioMetaDataEncoder)
 
         raw = ByteStreamFeature(
-            ByteStream,
+            AudioByteStream,
             chunksize=chunksize_bytes,
             needs=meta,
             store=False)
 
-        ogg = OggVorbisFeature(
-            OggVorbis,
-            needs=raw,
-            store=True)
+        ogg = _playback_feature(raw, codec, background_encode)
+
+        if codec == 'vorbis':
+            ogg_index = OggVorbisIndexFeature(
+                OggVorbisIndex,
+                needs=ogg,
+                store=True)
 
         pcm = AudioSamplesFeature(
             AudioStream,
@@ -71,12 +109,16 @@ def windowed(
         resample_to=SR44100(),
         store_resampled=True,
         store_windowed=False,
-        wfunc=None):
+        wfunc=None,
+        background_encode=False,
+        codec='vorbis'):
 
     rs = resampled(
         chunksize_bytes=chunksize_bytes,
         resample_to=resample_to,
-        store_resampled=store_resampled)
+        store_resampled=store_resampled,
+        background_encode=background_encode,
+        codec=codec)
 
     class Sound(rs):
         windowed = ArrayWithUnitsFeature(
@@ -96,8 +138,15 @@ def frequency_adaptive(
         check_scale_overlap_ratio=False,
         chunksize_bytes=DEFAULT_CHUNK_SIZE,
         resample_to=SR44100(),
-        store_resampled=False):
-    BaseModel = resampled(chunksize_bytes, resample_to, store_resampled)
+        store_resampled=False,
+        background_encode=False,
+        codec='vorbis'):
+    BaseModel = resampled(
+        chunksize_bytes,
+        resample_to,
+        store_resampled,
+        background_encode,
+        codec)
 
     class FrequencyAdaptive(BaseModel):
         long_windowed = ArrayWithUnitsFeature(
@@ -131,7 +180,9 @@ def stft(
         store_fft=False,
         fft_padding_samples=None,
         store_windowed=False,
-        store_resampled=False):
+        store_resampled=False,
+        background_encode=False,
+        codec='vorbis'):
     class ShortTimeFourierTransform(BaseModel):
         meta = JSONFeature(
             MetaData,
@@ -139,15 +190,18 @@ def stft(
             encoder=AudioMetaDataEncoder)
 
         raw = ByteStreamFeature(
-            ByteStream,
+            AudioByteStream,
             chunksize=chunksize_bytes,
             needs=meta,
             store=False)
 
-        ogg = OggVorbisFeature(
-            OggVorbis,
-            needs=raw,
-            store=True)
+        ogg = _playback_feature(raw, codec, background_encode)
+
+        if codec == 'vorbis':
+            ogg_index = OggVorbisIndexFeature(
+                OggVorbisIndex,
+                needs=ogg,
+                store=True)
 
         pcm = AudioSamplesFeature(
             AudioStream,
@@ -179,13 +233,18 @@ def stft(
 def audio_graph(
         chunksize_bytes=DEFAULT_CHUNK_SIZE,
         resample_to=SR44100(),
-        store_fft=False):
+        store_fft=False,
+        background_encode=False,
+        codec='vorbis'):
     """
     Produce a base class suitable as a starting point for many audio processing
     pipelines.  This class resamples all audio to a common sampling rate, and
     produces a bark band spectrogram from overlapping short-time fourier
     transform frames.  It also compresses the audio into ogg vorbis format for
-    compact storage.
+    compact storage, optionally in a background thread
+    (`background_encode=True`) that overlaps with feature extraction.  Passing
+    a different `codec` (e.g. `flac` or `pcm16`) stores the audio in a format
+    that is cheaper to decode, at the cost of more disk space.
     """
 
     band = FrequencyBand(20, resample_to.nyquist)
@@ -197,15 +256,18 @@ def audio_graph(
             encoder=AudioMetaDataEncoder)
 
         raw = ByteStreamFeature(
-            ByteStream,
+            AudioByteStream,
             chunksize=chunksize_bytes,
             needs=meta,
             store=False)
 
-        ogg = OggVorbisFeature(
-            OggVorbis,
-            needs=raw,
-            store=True)
+        ogg = _playback_feature(raw, codec, background_encode)
+
+        if codec == 'vorbis':
+            ogg_index = OggVorbisIndexFeature(
+                OggVorbisIndex,
+                needs=ogg,
+                store=True)
 
         pcm = AudioSamplesFeature(
             AudioStream,
@@ -7,6 +7,7 @@ from zounds.util.persistence import simple_in_memory_settings
 from zounds.persistence import ArrayWithUnitsFeature
 from zounds.synthesize.synthesize import NoiseSynthesizer, SineSynthesizer
 from zounds.spectral import GeometricScale, FrequencyAdaptive
+from zounds.soundfile import Pcm16Wrapper
 import zipfile
 from io import BytesIO
 import featureflow
@@ -59,6 +60,21 @@ class ResampledTests(unittest2.TestCase):
         self.assertEqual(new_sample_rate, doc.resampled.samplerate)
         self.assertEqual(len(samples) // 2, len(doc.resampled))
 
+    def test_can_store_audio_with_another_codec(self):
+        rs = resampled(resample_to=SR11025(), codec='pcm16')
+
+        @simple_in_memory_settings
+        class Document(rs):
+            pass
+
+        self.assertFalse(hasattr(Document, 'ogg_index'))
+        synth = NoiseSynthesizer(SR11025())
+        samples = synth.synthesize(Seconds(3))
+        _id = Document.process(meta=samples.encode())
+        doc = Document(_id)
+        self.assertIsInstance(doc.ogg, Pcm16Wrapper)
+        self.assertEqual(3, doc.ogg.duration_seconds)
+
 
 class StftTests(unittest2.TestCase):
 
@@ -5,7 +5,7 @@ import numpy as np
 from predownload import PreDownload
 from util import ensure_local_file
 from zounds.soundfile import AudioMetaData
-from zounds.timeseries import SR44100, AudioSamples
+from zounds.timeseries import SR44100
 import os
 
 
@@ -43,8 +43,10 @@ class MusicNet(object):
                 'https://homes.cs.washington.edu/~thickstn/media/{_id}'\
                     .format(**locals())
             meta = metadata[_id]
-            samples = AudioSamples.from_file(full_path)
-            uri = PreDownload(samples.encode().read(), url)
+            # the files are already wav-encoded, so there's no need to decode
+            # and re-encode them
+            with open(full_path, 'rb') as f:
+                uri = PreDownload(f.read(), url)
             yield AudioMetaData(
                 uri=uri,
                 samplerate=int(self._samplerate),
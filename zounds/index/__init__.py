@@ -3,3 +3,7 @@ from index import SearchResults, HammingIndex
 from hammingdb import HammingDb
 
 from brute_force import BruteForceSearch, HammingDistanceBruteForceSearch
+
+from ivfpq import IVFPQSearch
+
+from sharded import ShardedHammingDb, ShardedHammingIndex
@@ -0,0 +1,277 @@
+"""
+Measure the latency, throughput, startup time and memory usage of
+:class:`HammingDb` searches over synthetic, uniformly random codes, and
+report the results as JSON, so that regressions in the search hot path are
+easy to spot and to compare across runs.
+
+Usage:
+    python -m zounds.index.benchmark \\
+        --n-codes 100000 1000000 \\
+        --code-sizes 64 256 1024 \\
+        --threads 1 4 \\
+        --batch-sizes 16 64 \\
+        --output results.json
+"""
+
+from __future__ import division
+import argparse
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+from multiprocessing import cpu_count
+from hammingdb import HammingDb
+
+
+def _rss_mb():
+    """
+    The current resident set size of this process, in megabytes
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * resource.getpagesize() / (1024 ** 2)
+    except IOError:
+        # fall back to the peak resident set size, which linux reports in
+        # kilobytes, and OS X in bytes
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        scale = 1024 ** 2 if sys.platform == 'darwin' else 1024
+        return peak / scale
+
+
+def _random_codes(n_codes, code_size):
+    return np.random.randint(0, 256, (n_codes, code_size)) \
+        .astype(np.uint8).tostring()
+
+
+def build_db(path, n_codes, code_size_bits, chunksize=100000):
+    """
+    Build a database of `n_codes` random codes, returning the time taken, in
+    seconds
+    """
+    code_size = code_size_bits // 8
+    start = time.time()
+    with HammingDb(path, code_size=code_size) as db:
+        for i in xrange(0, n_codes, chunksize):
+            n = min(chunksize, n_codes - i)
+            block = _random_codes(n, code_size)
+            codes = [block[j: j + code_size] for j in
+                     xrange(0, len(block), code_size)]
+            db.append_many(codes, [''] * n)
+    return time.time() - start
+
+
+def open_db(path, threads=None):
+    """
+    Open an existing database, returning it along with the time taken, in
+    seconds
+    """
+    start = time.time()
+    db = HammingDb(path, code_size=None, n_threads=threads)
+    db.refresh()
+    elapsed = time.time() - start
+    return db, elapsed
+
+
+def _summarize(latencies, n_queries, elapsed):
+    latencies = np.array(latencies) * 1000
+    return dict(
+        p50_ms=float(np.percentile(latencies, 50)),
+        p99_ms=float(np.percentile(latencies, 99)),
+        mean_ms=float(latencies.mean()),
+        qps=n_queries / elapsed)
+
+
+def time_search(db, queries, n_results, multithreaded, sort):
+    latencies = []
+    start = time.time()
+    for query in queries:
+        query_start = time.time()
+        list(db.search(query, n_results, multithreaded, sort=sort))
+        latencies.append(time.time() - query_start)
+    return _summarize(latencies, len(queries), time.time() - start)
+
+
+def time_search_many(db, queries, n_results, batch_size):
+    latencies = []
+    start = time.time()
+    for i in xrange(0, len(queries), batch_size):
+        batch_start = time.time()
+        db.search_many(queries[i: i + batch_size], n_results)
+        latencies.append(time.time() - batch_start)
+    return _summarize(latencies, len(queries), time.time() - start)
+
+
+def run(
+        n_codes=(100000,),
+        code_sizes=(64, 256, 1024),
+        threads=(1,),
+        sorts=(False, True),
+        batch_sizes=(),
+        n_queries=100,
+        n_results=10,
+        path=None):
+    """
+    Run every combination of the given settings, returning a list of result
+    dictionaries.
+
+    Single queries are timed with :meth:`HammingDb.search`, once for each
+    combination of thread count and `sort`, and batches of queries are
+    timed with :meth:`HammingDb.search_many`, once for each batch size.
+
+    Args:
+        n_codes (iterable): database sizes
+        code_sizes (iterable): code sizes, in bits, each a multiple of 64
+        threads (iterable): thread counts.  One means single-threaded
+        sorts (iterable): values of `sort` passed to `search`
+        batch_sizes (iterable): batch sizes passed to `search_many`
+        n_queries (int): the number of queries timed for each combination
+        n_results (int): the number of results requested per query
+        path (str): a directory in which databases are built and then
+            removed.  Defaults to a new temporary directory
+    """
+    root = path or tempfile.mkdtemp()
+    results = []
+
+    try:
+        for size in n_codes:
+            for code_size_bits in code_sizes:
+                db_path = os.path.join(
+                    root, 'bench_{size}_{code_size_bits}'.format(**locals()))
+                build_seconds = build_db(db_path, size, code_size_bits)
+                block = _random_codes(n_queries, code_size_bits // 8)
+                queries = [
+                    block[i: i + code_size_bits // 8] for i in
+                    xrange(0, len(block), code_size_bits // 8)]
+
+                common = dict(
+                    n_codes=size,
+                    code_size_bits=code_size_bits,
+                    n_results=n_results,
+                    n_queries=n_queries,
+                    build_s=build_seconds)
+
+                for n_threads in threads:
+                    db, startup = open_db(db_path, n_threads)
+                    for sort in sorts:
+                        timing = time_search(
+                            db, queries, n_results, n_threads > 1, sort)
+                        results.append(dict(
+                            common,
+                            mode='search',
+                            threads=n_threads,
+                            sort=sort,
+                            batch_size=1,
+                            startup_ms=startup * 1000,
+                            rss_mb=_rss_mb(),
+                            **timing))
+                    db.close()
+
+                for batch_size in batch_sizes:
+                    db, startup = open_db(db_path)
+                    timing = time_search_many(
+                        db, queries, n_results, batch_size)
+                    results.append(dict(
+                        common,
+                        mode='search_many',
+                        threads=1,
+                        sort=True,
+                        batch_size=batch_size,
+                        startup_ms=startup * 1000,
+                        rss_mb=_rss_mb(),
+                        **timing))
+                    db.close()
+
+                shutil.rmtree(db_path, ignore_errors=True)
+    finally:
+        if path is None:
+            shutil.rmtree(root, ignore_errors=True)
+
+    return results
+
+
+def environment():
+    return dict(
+        cpu_count=cpu_count(),
+        numpy_version=np.__version__,
+        python_version=sys.version.split()[0],
+        platform=sys.platform)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark HammingDb search latency and throughput')
+    parser.add_argument(
+        '--n-codes',
+        help='database sizes',
+        type=int,
+        nargs='+',
+        default=[100000])
+    parser.add_argument(
+        '--code-sizes',
+        help='code sizes, in bits',
+        type=int,
+        nargs='+',
+        default=[64, 256, 1024])
+    parser.add_argument(
+        '--threads',
+        help='thread counts for single-query search',
+        type=int,
+        nargs='+',
+        default=[1])
+    parser.add_argument(
+        '--no-sort',
+        help='only time unsorted searches',
+        action='store_true')
+    parser.add_argument(
+        '--batch-sizes',
+        help='batch sizes for search_many',
+        type=int,
+        nargs='*',
+        default=[])
+    parser.add_argument(
+        '--n-queries',
+        help='queries timed per combination of settings',
+        type=int,
+        default=100)
+    parser.add_argument(
+        '--n-results',
+        help='results requested per query',
+        type=int,
+        default=10)
+    parser.add_argument(
+        '--path',
+        help='directory in which to build databases')
+    parser.add_argument(
+        '--output',
+        help='file to which results are written.  Defaults to stdout')
+    args = parser.parse_args(argv)
+
+    results = run(
+        n_codes=args.n_codes,
+        code_sizes=args.code_sizes,
+        threads=args.threads,
+        sorts=(False,) if args.no_sort else (False, True),
+        batch_sizes=args.batch_sizes,
+        n_queries=args.n_queries,
+        n_results=args.n_results,
+        path=args.path)
+
+    output = json.dumps(
+        dict(environment=environment(), results=results),
+        indent=2,
+        sort_keys=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print output
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    A bounded mapping that evicts its least recently used entry once it holds
+    more than `max_size` entries, and counts hits and misses
+
+    Args:
+        max_size (int): the maximum number of entries to hold
+    """
+
+    def __init__(self, max_size):
+        super(LRUCache, self).__init__()
+        if max_size < 1:
+            raise ValueError('max_size must be at least one')
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+
+            # re-inserting moves the entry to the most recently used end
+            self._entries[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
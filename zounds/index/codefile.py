@@ -0,0 +1,109 @@
+import numpy as np
+import os
+
+
+class CodeFile(object):
+    """
+    An append-only file of fixed-width records, e.g. `(id, code)` pairs, that
+    is memory-mapped for reading.
+
+    Opening a `CodeFile` only maps the file into the address space, so it's
+    fast regardless of how many records the file contains, and pages are
+    loaded lazily by the operating system as they're touched.
+
+    `CodeFile` exposes the `logical_data` and `logical_size` properties of
+    :class:`zounds.nputil.Growable`, so it can stand in for one, but only the
+    first `logical_size` records (as set by :meth:`map`) are ever visible.
+    This allows readers to ignore records that writers have appended to the
+    file but not yet committed elsewhere.
+    """
+
+    def __init__(self, path, dtype):
+        super(CodeFile, self).__init__()
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        if not os.path.exists(self.path):
+            open(self.path, 'ab').close()
+        self._data = np.zeros(0, dtype=self.dtype)
+
+    def __len__(self):
+        """
+        The number of complete records currently on disk, which may be more
+        than are currently mapped
+        """
+        return os.path.getsize(self.path) // self.dtype.itemsize
+
+    @property
+    def logical_size(self):
+        return len(self._data)
+
+    @property
+    def logical_data(self):
+        return self._data
+
+    def unmap(self):
+        """
+        Discard the current mapping, e.g. because the file has been replaced
+        """
+        self._data = np.zeros(0, dtype=self.dtype)
+
+    def map(self, size):
+        """
+        Memory-map the first `size` records of the file.
+
+        The file is opened once, and its size checked through that handle, so
+        the mapping always agrees with the check, even if the file is replaced
+        (see :meth:`rewrite`) in the meantime
+
+        :return: `False`, leaving the current mapping alone, if the file \
+        holds fewer than `size` records, and `True` otherwise
+        """
+        if size == self.logical_size:
+            return True
+
+        if not size:
+            self.unmap()
+            return True
+
+        with open(self.path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size < size * self.dtype.itemsize:
+                return False
+            self._data = np.memmap(
+                f, dtype=self.dtype, mode='r', shape=(size,))
+        return True
+
+    def append(self, records):
+        """
+        Append one or more records to the end of the file
+        """
+        records = np.asarray(records, dtype=self.dtype)
+        with open(self.path, 'ab') as f:
+            f.write(records.tostring())
+
+    def record(self, index):
+        """
+        Read a single record directly from disk, whether or not it's mapped
+        """
+        with open(self.path, 'rb') as f:
+            f.seek(index * self.dtype.itemsize)
+            return np.frombuffer(
+                f.read(self.dtype.itemsize), dtype=self.dtype)[0]
+
+    def truncate(self, size):
+        """
+        Discard all but the first `size` records on disk
+        """
+        with open(self.path, 'r+b') as f:
+            f.truncate(size * self.dtype.itemsize)
+
+    def rewrite(self, chunks):
+        """
+        Atomically replace the contents of the file with records from an
+        iterable of record arrays
+        """
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            for chunk in chunks:
+                f.write(np.asarray(chunk, dtype=self.dtype).tostring())
+        os.rename(tmp_path, self.path)
+        self.unmap()
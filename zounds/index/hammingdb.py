@@ -1,17 +1,35 @@
 import lmdb
-from zounds.nputil import Growable, packed_hamming_distance
+from scipy.spatial.distance import cdist
+from zounds.nputil import \
+    packed_hamming_distance, packed_hamming_distance_matrix, \
+    packed_hamming_distance_within, weighted_hamming_tables, \
+    weighted_hamming_distance
 import numpy as np
 from multiprocessing.dummy import Pool as ThreadPool
 from multiprocessing import cpu_count
 import os
 import binascii
+from multiindex import MultiIndex
+from codefile import CodeFile
 
 
 class HammingDb(object):
-    def __init__(self, path, map_size=1000000000, code_size=8, writeonly=False):
+    def __init__(
+            self,
+            path,
+            map_size=1000000000,
+            code_size=8,
+            writeonly=False,
+            n_substrings=None,
+            compaction_ratio=0.25,
+            n_threads=None):
+
         super(HammingDb, self).__init__()
 
         self.writeonly = writeonly
+        self.compaction_ratio = compaction_ratio
+        self._compaction = None
+        self._thread_pool = None
 
         if not os.path.exists(path):
             os.makedirs(path)
@@ -44,21 +62,60 @@ class HammingDb(object):
             self.code_size = code_size
 
         self.index = self.env.open_db('index')
-        self._append_buffer = self._recarray(1)
+        self.vectors = self.env.open_db('vectors')
+        self.keys = self.env.open_db('keys')
+        self.tombstones = self.env.open_db('tombstones')
+
+        # databases created before ids were assigned from a monotonically
+        # increasing sequence have random ids, which carry no ordering
+        if self.get_metadata('sequential') is None and not len(self):
+            self.set_metadata('sequential', '1')
+        self._sequential = self.get_metadata('sequential') == '1'
+
         self._code_bytearray = bytearray('a' * self.code_size)
         self._code_buffer = np.frombuffer(self._code_bytearray, dtype=np.uint64)
         self._codes = None
-        self._ids = set()
-        self._catch_up_on_in_memory_store()
+        self._code_file = CodeFile(
+            os.path.join(self.path, 'codes.dat'), self._recarray(0).dtype)
+        self._generation = self.get_metadata('generation')
+        self._dead = None
+        self._n_dead = 0
+        self._tombstone_state = None
+        self._multi_index = None
+        if n_substrings and not self.writeonly:
+            self._multi_index = MultiIndex(self.code_size, n_substrings)
+        self._catch_up_code_file()
+        self._initialize_in_memory_store()
 
-        self._thread_count = cpu_count()
-        self._pool = ThreadPool(processes=self._thread_count)
+        self._tile_bytes = 2 ** 20
+        self._query_block_size = 64
+
+        self._thread_count = n_threads or cpu_count()
+
+    @property
+    def _pool(self):
+        # most instances never search with more than one thread, so don't
+        # start any until they're needed
+        if self._thread_pool is None:
+            self._thread_pool = ThreadPool(processes=self._thread_count)
+        return self._thread_pool
 
     def close(self):
+        self._shutdown()
+        if self._thread_pool is not None:
+            self._thread_pool.join()
+
+    def _shutdown(self):
+        if self._compaction is not None:
+            self._compaction.wait()
+        if self._thread_pool is not None:
+            self._thread_pool.terminate()
         self.env.close()
 
     def __del__(self):
-        self.close()
+        # this may run on one of the pool's own threads, which can't be
+        # joined from within
+        self._shutdown()
 
     def __enter__(self):
         return self
@@ -74,17 +131,91 @@ class HammingDb(object):
         with self.env.begin() as txn:
             return txn.get(key, db=self.metadata)
 
-    def _catch_up_on_in_memory_store(self):
-        self._initialize_in_memory_store()
+    def _iter_code_chunks(self, txn, start_after=None, chunksize=10000):
+        chunk = self._recarray(chunksize)
+        i = 0
+        cursor = txn.cursor(db=self.index)
+
+        if start_after is None:
+            positioned = cursor.first()
+        else:
+            positioned = cursor.set_range(start_after)
+            if positioned and cursor.key() == start_after:
+                positioned = cursor.next()
+
+        if not positioned:
+            return
+
+        for _id, value in cursor.iternext(keys=True, values=True):
+            chunk[i]['id'] = _id
+            chunk[i]['code'] = self._np_code(value[:self.code_size])
+            i += 1
+            if i == chunksize:
+                yield chunk
+                i = 0
+        yield chunk[:i]
+
+    def _catch_up_code_file(self):
+        """
+        Ensure that the memory-mapped code file agrees with the lmdb index.
+
+        When ids are sequential, and the file is simply missing the most
+        recent entries, only entries following the last id in the file are
+        read from lmdb.  Otherwise, e.g. because the file contains records
+        from an interrupted write, it is rebuilt from scratch
+        """
         with self.env.begin() as txn:
-            cursor = txn.cursor(db=self.index)
-            for i, bundle in enumerate(cursor.iternext(keys=True, values=True)):
-                _id, value = bundle
-                if _id in self._ids:
-                    continue
+            if len(self._code_file) == self._n_expected(txn):
+                return
+
+        # hold the write lock, so no other writer can append while the file
+        # is being caught up
+        with self.env.begin(write=True) as txn:
+            n_records = len(self._code_file)
+            n_expected = self._n_expected(txn)
+
+            if n_records == n_expected:
+                return
+
+            start_after = \
+                self._code_file.record(n_records - 1)['id'] \
+                    if n_records else None
+
+            # deleted entries are no longer in lmdb, so the file can only be
+            # caught up incrementally if none of them were missing from it
+            with txn.cursor(db=self.tombstones) as cursor:
+                last_tombstone = cursor.key() if cursor.last() else None
+
+            if self._sequential \
+                    and n_records < n_expected \
+                    and (last_tombstone is None
+                         or (start_after and last_tombstone <= start_after)):
+                for chunk in self._iter_code_chunks(txn, start_after):
+                    self._code_file.append(chunk)
+            else:
+                self._code_file.rewrite(self._iter_code_chunks(txn))
+                self._clear_tombstones(txn)
 
-                code = value[:self.code_size]
-                self._add_code(_id, code)
+    def _n_expected(self, txn):
+        # the code file holds a record for every live entry, as well as for
+        # every deleted entry that hasn't yet been compacted away
+        return txn.stat(self.index)['entries'] \
+               + txn.stat(self.tombstones)['entries']
+
+    def _clear_tombstones(self, txn):
+        # the code file has been rewritten, so row numbers have changed, and
+        # readers must map it from scratch
+        txn.drop(self.tombstones, delete=False)
+        generation = int(txn.get('generation', db=self.metadata) or 0) + 1
+        txn.put('generation', str(generation), db=self.metadata)
+
+    @property
+    def version(self):
+        """
+        An opaque token that changes whenever any writer, in any process,
+        commits a transaction, e.g. to invalidate cached search results
+        """
+        return self.env.info()['last_txnid']
 
     def __len__(self):
         with self.env.begin() as txn:
@@ -107,8 +238,8 @@ class HammingDb(object):
 
         if self._codes is not None:
             return
-        initial_size = max(int(1e6), len(self))
-        self._codes = Growable(self._recarray(initial_size))
+        self._codes = self._code_file
+        self._check_for_external_modifications()
 
     def _np_code(self, code):
         self._code_bytearray[:] = code
@@ -121,75 +252,379 @@ class HammingDb(object):
                     ({self.code_size}), but was {code_len}'''
             raise ValueError(fmt.format(**locals()))
 
-    def _add_code(self, _id, code):
-        if self.writeonly:
+    def refresh(self):
+        """
+        Pick up codes written, deleted or compacted by other processes, and
+        map the code file, as the next search would otherwise do
+        """
+        self._check_for_external_modifications()
+
+    def _check_for_external_modifications(self):
+        with self.env.begin() as txn:
+            generation = txn.get('generation', db=self.metadata)
+            if generation != self._generation:
+                # the code file was compacted, so any existing mapping, and
+                # any row numbers derived from it, are stale
+                self._codes.unmap()
+                if self._multi_index is not None:
+                    self._multi_index.reset()
+                self._tombstone_state = None
+                self._generation = generation
+
+            # writers append to the code file before their lmdb transaction
+            # commits, so as long as the number of entries is read first, the
+            # file should never contain fewer records.  Never map records
+            # whose lmdb transaction hasn't yet committed. Since ids are
+            # ordered, a new reader only ever needs to map the records
+            # appended since the last one it knew about
+            mapped = self._codes.map(self._n_expected(txn))
+            if mapped and not self._mapping_is_current(txn):
+                # a compaction replaced the file after this transaction
+                # began, and further codes have since been appended to it
+                self._codes.unmap()
+                mapped = False
+            if mapped:
+                self._update_tombstones(txn)
+                return
+
+        self._catch_up_code_file()
+        self._check_for_external_modifications()
+
+    def _mapping_is_current(self, txn):
+        """
+        Compaction only ever removes records, preserving the order of the
+        rest, and codes are only ever appended, so the mapped file is the one
+        `txn` describes as long as its last record is known to `txn`
+        """
+        if not self._codes.logical_size:
+            return True
+        _id = self._codes.logical_data['id'][-1]
+        return \
+            txn.get(_id, db=self.index) is not None \
+            or txn.get(_id, db=self.tombstones) is not None
+
+    def _update_tombstones(self, txn):
+        n_tombstones = txn.stat(self.tombstones)['entries']
+        state = (n_tombstones, self._codes.logical_size)
+        if state == self._tombstone_state:
             return
+        self._tombstone_state = state
 
-        arr = self._append_buffer
-        arr[0]['id'] = _id
-        arr[0]['code'] = self._np_code(code)
-        self._codes.append(arr)
-        self._ids.add(_id)
+        if not n_tombstones:
+            self._dead = None
+            self._n_dead = 0
+            return
 
-    def _check_for_external_modifications(self):
-        if self.__len__() != self._codes.logical_size:
-            self._catch_up_on_in_memory_store()
+        with txn.cursor(db=self.tombstones) as cursor:
+            dead_ids = np.array(
+                list(cursor.iternext(keys=True, values=False)), dtype='S32')
+
+        ids = self._codes.logical_data['id']
+        if self._sequential:
+            # ids are sorted, so each tombstone can be located directly
+            positions = np.searchsorted(ids, dead_ids)
+            in_range = positions < len(ids)
+            positions = positions[in_range]
+            positions = positions[ids[positions] == dead_ids[in_range]]
+        else:
+            positions = np.nonzero(np.in1d(ids, dead_ids))[0]
+
+        self._dead = np.zeros(len(ids), dtype=np.bool)
+        self._dead[positions] = True
+        self._n_dead = len(positions)
+
+    def _live(self, indices):
+        if self._dead is None:
+            return indices
+        return indices[~self._dead[indices]]
 
     def _new_id(self):
         return binascii.hexlify(os.urandom(16))
 
+    def _next_ids(self, txn, n_ids):
+        if not self._sequential:
+            return [self._new_id() for _ in xrange(n_ids)]
+
+        # reserve a contiguous block of the sequence for this transaction
+        start = int(txn.get('sequence', db=self.metadata) or 0)
+        stop = start + n_ids
+        txn.put('sequence', str(stop), db=self.metadata)
+        return ['{i:032x}'.format(i=i) for i in xrange(start, stop)]
+
     def append(self, code, data):
-        self._validate_code_size(code)
+        self.append_many([code], [data])
+
+    def append_many(
+            self, codes, datas, metadata=None, vectors=None, key=None):
+        """
+        Append many codes and their associated data in a single transaction
+
+        :param codes: an iterable of binary codes, each of length `code_size`
+
+        :param datas: an iterable of binary strings, one for each code
+
+        :param metadata: an optional dictionary of metadata keys and values \
+        to set in the same transaction
+
+        :param vectors: an optional two-dimensional array with one row per \
+        code, usually the real-valued features the codes were derived from, \
+        which will be stored as `float32` and used by :meth:`rerank_search`
+
+        :param key: an optional key, e.g. a document id, under which the \
+        codes are grouped, so they can later be removed with :meth:`delete`. \
+        Any codes previously appended with the same key are deleted in the \
+        same transaction
+        """
+        codes = list(codes)
+        datas = list(datas)
+
+        if len(codes) != len(datas):
+            raise ValueError(
+                'codes and datas must have the same length, but had lengths '
+                '{len_codes} and {len_datas}'
+                    .format(len_codes=len(codes), len_datas=len(datas)))
+
+        if vectors is not None:
+            vectors = np.asarray(vectors, dtype=np.float32) \
+                .reshape((len(codes), -1))
+
+        records = self._recarray(len(codes))
+        # single-word codes are stored as a scalar, rather than a subarray
+        records['code'] = \
+            self._np_codes(codes).reshape(records['code'].shape)
         self._initialize_in_memory_store()
 
         with self.env.begin(write=True) as txn:
-            _id = self._new_id()
-            txn.put(_id, code + data, db=self.index)
-            self._add_code(_id, code)
+            n_records = len(self._code_file)
+            try:
+                records['id'] = self._next_ids(txn, len(codes))
+                with txn.cursor(db=self.index) as cursor:
+                    _, added = cursor.putmulti(
+                        ((_id, code + data) for _id, code, data
+                         in zip(records['id'], codes, datas)),
+                        append=self._sequential)
+                if added != len(codes):
+                    raise RuntimeError(
+                        'Only {added} of {n_codes} codes could be written'
+                            .format(added=added, n_codes=len(codes)))
+                if vectors is not None:
+                    for _id, vector in zip(records['id'], vectors):
+                        txn.put(_id, vector.tostring(), db=self.vectors)
+                for k, v in (metadata or {}).iteritems():
+                    txn.put(k, v, db=self.metadata)
+                if key is not None:
+                    n_deleted = self._delete(txn, key)
+                    txn.put(
+                        self._encode_key(key),
+                        ''.join(records['id']),
+                        db=self.keys)
+                self._code_file.append(records)
+            except:
+                self._code_file.truncate(n_records)
+                raise
 
-    def _random_code(self):
+        if key is not None and n_deleted:
+            self._maybe_compact()
+
+    def _encode_key(self, key):
+        # document ids are often unicode, but lmdb keys must be bytes
+        if isinstance(key, unicode):
+            return key.encode('utf-8')
+        return key
+
+    def _delete(self, txn, key):
+        key = self._encode_key(key)
+        ids = txn.get(key, db=self.keys)
+        if ids is None:
+            return 0
+
+        ids = [ids[i: i + 32] for i in xrange(0, len(ids), 32)]
+        for _id in ids:
+            txn.delete(_id, db=self.index)
+            txn.delete(_id, db=self.vectors)
+            txn.put(_id, '', db=self.tombstones)
+        txn.delete(key, db=self.keys)
+        return len(ids)
+
+    def delete(self, key, metadata_keys=None):
+        """
+        Delete all codes appended with `key`.  Deleted codes are excluded
+        from searches immediately, but their records remain in the code file,
+        marked by tombstones, until :meth:`compact` is called, which happens
+        automatically, in the background, once more than `compaction_ratio`
+        of all records are dead
+
+        :param key: the key passed to :meth:`append_many`
+
+        :param metadata_keys: an optional iterable of metadata keys, e.g. \
+        those written alongside the codes by :meth:`append_many`, to delete \
+        in the same transaction
+
+        :return: the number of codes deleted
+        """
+        with self.env.begin(write=True) as txn:
+            n_deleted = self._delete(txn, key)
+            for k in (metadata_keys or []):
+                txn.delete(k, db=self.metadata)
+
+        if n_deleted:
+            self._maybe_compact()
+
+        return n_deleted
+
+    def _maybe_compact(self):
         with self.env.begin() as txn:
-            with txn.cursor(self.index) as cursor:
-                code = None
-                while not code:
-                    if cursor.set_range(self._new_id()):
-                        return txn.get(
-                            cursor.key(), db=self.index)[:self.code_size]
-                    continue
+            n_tombstones = txn.stat(self.tombstones)['entries']
+            n_records = self._n_expected(txn)
 
-    def random_search(self, n_results, multithreaded=False, sort=False):
-        code = self._random_code()
-        return code, self.search(code, n_results, multithreaded, sort=sort)
+        if n_tombstones <= self.compaction_ratio * n_records:
+            return
 
-    def search(self, code, n_results, multithreaded=False, sort=False):
+        if self._compaction is not None and not self._compaction.ready():
+            return
+
+        self._compaction = self._pool.apply_async(self.compact)
 
+    def compact(self, chunksize=100000):
+        """
+        Rewrite the code file without the records of deleted codes, so that
+        scan cost and memory usage track the number of live codes.  Writers
+        are blocked while the file is rewritten, but readers are not.  The
+        new file replaces the old one atomically, so readers keep scanning
+        their existing mapping of the old file, and map the new one on their
+        next search, once the generation has changed
+        """
+        with self.env.begin(write=True) as txn:
+            if not txn.stat(self.tombstones)['entries']:
+                return
+
+            with txn.cursor(db=self.tombstones) as cursor:
+                dead_ids = np.array(
+                    list(cursor.iternext(keys=True, values=False)),
+                    dtype='S32')
+
+            # the live mapping is never touched here, since searches may be
+            # running against it in other threads
+            snapshot = CodeFile(self._code_file.path, self._code_file.dtype)
+            snapshot.map(self._n_expected(txn))
+            records = snapshot.logical_data
+            live = ~np.in1d(records['id'], dead_ids)
+
+            snapshot.rewrite(
+                records[i: i + chunksize][live[i: i + chunksize]]
+                for i in xrange(0, len(records), chunksize))
+            self._clear_tombstones(txn)
+
+    def _random_code(self):
         if self.writeonly:
             error_msg = 'searches may not be performed in writeonly mode'
             raise RuntimeError(error_msg)
 
-        self._validate_code_size(code)
         self._check_for_external_modifications()
-        query = self._np_code(code)
+        n_codes = self._codes.logical_size
 
-        codes = self._codes.logical_data['code']
+        if n_codes == self._n_dead:
+            raise ValueError('cannot select a random code from an empty db')
 
-        if codes.ndim == 1:
-            codes = codes[..., None]
+        # every code is already mapped, so a row can be chosen uniformly,
+        # without a round trip to lmdb.  Dead rows are a small fraction of
+        # the total, since they're compacted away, so few draws are needed
+        row = np.random.randint(0, n_codes)
+        while self._dead is not None and self._dead[row]:
+            row = np.random.randint(0, n_codes)
+
+        return self._codes.logical_data['code'][row].tostring()
+
+    def random_search(self, n_results, multithreaded=False, sort=False):
+        code = self._random_code()
+        return code, self.search(code, n_results, multithreaded, sort=sort)
+
+    def _hamming_scorer(self, query):
+        def score(block, out):
+            return packed_hamming_distance(query, block, out=out)
+
+        return score
+
+    def _local_top_k(
+            self, score, codes, start, stop, n_results, dtype=np.int):
+        """
+        Find the `n_results` nearest codes between rows `start` and `stop`,
+        scoring one tile at a time into a reused buffer, so that memory use
+        is bounded by the tile size, rather than the number of rows.
+
+        `score(block, out)` computes the distance from the query to each
+        code in `block`, writing the results into `out`, which has `dtype`
+        """
+        tile_size = max(n_results, self._tile_bytes // self.code_size)
+        buf = np.empty(tile_size, dtype=dtype)
+        if np.issubdtype(dtype, np.floating):
+            max_score = np.inf
+        else:
+            max_score = self.code_size * 8 + 1
+        best_indices = np.zeros(0, dtype=np.int)
+        best_scores = np.zeros(0, dtype=dtype)
+
+        for i in xrange(start, stop, tile_size):
+            j = min(i + tile_size, stop)
+            scores = score(codes[i: j], buf)
+            if self._dead is not None:
+                scores[self._dead[i: j]] = max_score
+
+            if n_results and len(best_scores) == n_results:
+                # only rows closer than the current worst candidate matter
+                closer = np.nonzero(scores < best_scores.max())[0]
+                indices = closer + i
+                scores = scores[closer]
+            else:
+                indices = np.arange(i, j)
+
+            indices = np.concatenate([best_indices, indices])
+            scores = np.concatenate([best_scores, scores])
+            if len(scores) > n_results:
+                keep = np.argpartition(scores, n_results)[:n_results]
+                indices = indices[keep]
+                scores = scores[keep]
+            best_indices = indices
+            best_scores = scores
+
+        return best_indices, best_scores
+
+    def _brute_force_search(
+            self, score, codes, n_results, multithreaded, sort, dtype=np.int):
+
+        n_codes = len(codes)
 
         if not multithreaded:
-            scores = packed_hamming_distance(query, codes)
+            local = [self._local_top_k(
+                score, codes, 0, n_codes, n_results, dtype)]
+        else:
+            # each thread keeps only its own chunk's nearest codes, and
+            # releases the GIL while scoring, so the main thread only ever
+            # merges n_results candidates per thread
+            chunksize = max(1, -(-n_codes // self._thread_count))
+            local = self._pool.map(
+                lambda i: self._local_top_k(
+                    score,
+                    codes,
+                    i,
+                    min(i + chunksize, n_codes),
+                    n_results,
+                    dtype),
+                xrange(0, n_codes, chunksize))
+
+        if local:
+            candidates, scores = map(np.concatenate, zip(*local))
         else:
-            n_codes = len(codes)
-            chunksize = max(1, n_codes // self._thread_count)
-            scores = np.concatenate(self._pool.map(
-                lambda x: packed_hamming_distance(query, x),
-                (codes[i: i + chunksize] for i in
-                 xrange(0, n_codes, chunksize))))
+            candidates = scores = np.zeros(0, dtype=np.int)
 
         # argpartition will ensure that the lowest scores will all be
         # withing the first n_results elements, but makes no guarantees
         # about the ordering *within* n_results
-        partitioned_indices = np.argpartition(scores, n_results)[:n_results]
+        if n_results < len(scores):
+            partitioned_indices = \
+                np.argpartition(scores, n_results)[:n_results]
+        else:
+            partitioned_indices = np.arange(len(scores))
 
         if sort:
             # since argpartition doesn't guarantee that the results are
@@ -203,8 +638,452 @@ class HammingDb(object):
             # particular order
             indices = partitioned_indices
 
+        return self._live(candidates[indices])
+
+    def _search_indices(self, code, n_results, multithreaded, sort):
+        if self.writeonly:
+            error_msg = 'searches may not be performed in writeonly mode'
+            raise RuntimeError(error_msg)
+
+        self._validate_code_size(code)
+        self._check_for_external_modifications()
+        query = self._np_code(code)
+
+        codes = self._codes.logical_data['code']
+
+        if codes.ndim == 1:
+            codes = codes[..., None]
+
+        if self._multi_index is not None:
+            # multi-index hashing always returns results in sorted order
+            return self._multi_index.search(
+                query, codes, n_results, dead=self._dead)
+
+        return self._brute_force_search(
+            self._hamming_scorer(query), codes, n_results, multithreaded, sort)
+
+    def search(self, code, n_results, multithreaded=False, sort=False):
+        indices = self._search_indices(code, n_results, multithreaded, sort)
         nearest = self._codes.logical_data[indices]['id']
 
         with self.env.begin() as txn:
             for _id in nearest:
                 yield txn.get(_id, db=self.index)[self.code_size:]
+
+    def _range_search_indices(self, code, radius, limit):
+        if self.writeonly:
+            error_msg = 'searches may not be performed in writeonly mode'
+            raise RuntimeError(error_msg)
+
+        self._validate_code_size(code)
+        self._check_for_external_modifications()
+        query = self._np_code(code)
+
+        codes = self._codes.logical_data['code']
+
+        if codes.ndim == 1:
+            codes = codes[..., None]
+
+        if self._multi_index is not None:
+            rows, distances = \
+                self._multi_index.range_search(query, codes, radius)
+            if self._dead is not None:
+                live = ~self._dead[rows]
+                rows, distances = rows[live], distances[live]
+            return rows[:limit], distances[:limit]
+
+        chunksize = max(1, self._tile_bytes // self.code_size)
+        found_rows = []
+        found_distances = []
+        n_found = 0
+
+        for start in xrange(0, len(codes), chunksize):
+            rows, distances = packed_hamming_distance_within(
+                query, codes[start: start + chunksize], radius)
+            rows += start
+            if self._dead is not None:
+                live = ~self._dead[rows]
+                rows, distances = rows[live], distances[live]
+            found_rows.append(rows)
+            found_distances.append(distances)
+            n_found += len(rows)
+            if limit is not None and n_found >= limit:
+                break
+
+        if not found_rows:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int)
+
+        rows = np.concatenate(found_rows)[:limit]
+        distances = np.concatenate(found_distances)[:limit]
+        order = np.argsort(distances, kind='mergesort')
+        return rows[order], distances[order]
+
+    def scored_range_search(self, code, radius, limit=None):
+        """
+        Like :meth:`range_search`, but returns a list of `(distance, data)`
+        pairs
+        """
+        rows, distances = self._range_search_indices(code, radius, limit)
+        ids = self._codes.logical_data['id'][rows]
+
+        with self.env.begin() as txn:
+            return [
+                (int(distance), txn.get(_id, db=self.index)[self.code_size:])
+                for distance, _id in zip(distances, ids)]
+
+    def range_search(self, code, radius, limit=None):
+        """
+        Find every code within hamming distance `radius` of `code`
+
+        Codes are scanned in blocks, and each code's distance is accumulated
+        one 64-bit word at a time, so it's abandoned as soon as it's known to
+        lie outside the radius.  Scanning stops early once `limit` matches
+        have been found
+
+        :param code: a binary code of length `code_size`
+
+        :param radius: the maximum hamming distance, inclusive
+
+        :param limit: the maximum number of results to return.  When the \
+        limit is reached, the results are the first matches found, not \
+        necessarily the nearest
+
+        :return: a list of data, in ascending order of distance
+        """
+        return [
+            data for _, data in self.scored_range_search(code, radius, limit)]
+
+    def rerank_search(
+            self,
+            code,
+            vector,
+            n_results,
+            n_candidates,
+            distance_metric='euclidean',
+            multithreaded=False):
+        """
+        Find `n_candidates` codes nearest to `code` in hamming space, and then
+        re-rank them by the exact distance between `vector` and the
+        real-valued vectors stored alongside them, returning the `n_results`
+        best, in ascending order of distance
+
+        :param code: a binary code of length `code_size`
+
+        :param vector: the real-valued vector from which `code` was derived
+
+        :param n_results: the number of results to return
+
+        :param n_candidates: the number of hamming-space candidates to re-rank
+
+        :param distance_metric: any metric understood by \
+        `scipy.spatial.distance.cdist`
+        """
+        return [data for _, data in self.scored_rerank_search(
+            code,
+            vector,
+            n_results,
+            n_candidates,
+            distance_metric=distance_metric,
+            multithreaded=multithreaded)]
+
+    def scored_rerank_search(
+            self,
+            code,
+            vector,
+            n_results,
+            n_candidates,
+            distance_metric='euclidean',
+            multithreaded=False):
+        """
+        Like :meth:`rerank_search`, but returns a list of `(distance, data)`
+        pairs, in ascending order of exact distance
+        """
+        indices = self._search_indices(
+            code, max(n_results, n_candidates), multithreaded, sort=False)
+        candidates = self._codes.logical_data[indices]['id']
+
+        with self.env.begin() as txn:
+            raw_vectors = [txn.get(_id, db=self.vectors) for _id in candidates]
+
+            if any(v is None for v in raw_vectors):
+                raise ValueError(
+                    'Some candidates have no vectors. Vectors must be '
+                    'supplied to append_many for re-ranking to work')
+
+            vectors = np.frombuffer(''.join(raw_vectors), dtype=np.float32) \
+                .reshape((len(raw_vectors), -1))
+            vector = np.asarray(vector, dtype=np.float32).reshape((1, -1))
+            distances = cdist(vector, vectors, metric=distance_metric)[0]
+            order = np.argsort(distances, kind='mergesort')[:n_results]
+            return [
+                (float(distances[i]),
+                 txn.get(candidates[i], db=self.index)[self.code_size:])
+                for i in order]
+
+    def _weighted_tables(self, projections, weights):
+        tables = weighted_hamming_tables(projections, weights)
+        if len(tables) != self.code_size:
+            raise ValueError(
+                'projections must have one element per bit ({n_bits}), '
+                'but had {n}'.format(
+                    n_bits=self.code_size * 8, n=len(tables) * 8))
+        return tables
+
+    def _weighted_search_indices(
+            self, tables, n_results, multithreaded, sort):
+
+        if self.writeonly:
+            error_msg = 'searches may not be performed in writeonly mode'
+            raise RuntimeError(error_msg)
+
+        self._check_for_external_modifications()
+
+        codes = self._codes.logical_data['code']
+
+        if codes.ndim == 1:
+            codes = codes[..., None]
+
+        def score(block, out):
+            return weighted_hamming_distance(tables, block, out=out)
+
+        # weighted distances can't be bounded by substring distances, so
+        # multi-index hashing doesn't apply, and every code is scored
+        return self._brute_force_search(
+            score, codes, n_results, multithreaded, sort, dtype=np.float32)
+
+    def weighted_search(
+            self,
+            projections,
+            n_results,
+            multithreaded=False,
+            sort=False,
+            weights=None):
+        """
+        Find the `n_results` codes nearest to a query, where disagreeing with
+        each of the query's bits costs that bit's weight, rather than one.
+
+        The query is described by its real-valued `projections`, e.g., the
+        dot products with the hyperplanes used to compute a simhash, so its
+        bits are the signs of `projections` and, by default, each bit's
+        weight is the magnitude of its projection.  Bits the query is unsure
+        of, whose projections lie close to a hyperplane, therefore count for
+        little.
+
+        A table of weighted distances for every value of every byte is
+        computed once per query, so each code is scored with one lookup per
+        byte, instead of one per bit
+
+        :param projections: one real value per bit, in the order in which \
+        bits are packed into codes
+
+        :param n_results: the number of results to return
+
+        :param multithreaded: score the codes using a pool of threads
+
+        :param sort: return results in ascending order of weighted distance
+
+        :param weights: optional, non-negative per-bit weights to use in \
+        place of the magnitudes of `projections`
+        """
+        tables = self._weighted_tables(projections, weights)
+        indices = self._weighted_search_indices(
+            tables, n_results, multithreaded, sort)
+        nearest = self._codes.logical_data[indices]['id']
+
+        with self.env.begin() as txn:
+            for _id in nearest:
+                yield txn.get(_id, db=self.index)[self.code_size:]
+
+    def scored_weighted_search(
+            self, projections, n_results, multithreaded=False, weights=None):
+        """
+        Like :meth:`weighted_search`, but returns a list of
+        `(distance, data)` pairs, in ascending order of weighted distance
+        """
+        tables = self._weighted_tables(projections, weights)
+        indices = self._weighted_search_indices(
+            tables, n_results, multithreaded, sort=False)
+        db_codes = self._codes.logical_data['code']
+
+        if db_codes.ndim == 1:
+            db_codes = db_codes[..., None]
+
+        ids = self._codes.logical_data['id'][indices]
+        scores = weighted_hamming_distance(tables, db_codes[indices])
+        order = np.argsort(scores, kind='mergesort')
+
+        with self.env.begin() as txn:
+            return [
+                (float(scores[i]),
+                 txn.get(ids[i], db=self.index)[self.code_size:])
+                for i in order]
+
+    def _np_codes(self, codes):
+        for code in codes:
+            self._validate_code_size(code)
+        return np.frombuffer(''.join(codes), dtype=np.uint64) \
+            .reshape((len(codes), self.code_size // 8))
+
+    def _top_k_per_query(self, query_indices, scores, indices, n_results):
+        # order candidates by query, and then by ascending distance, so that
+        # the first n_results candidates for each query are the best ones
+        order = np.lexsort((indices, scores, query_indices))
+        query_indices = query_indices[order]
+        scores = scores[order]
+        indices = indices[order]
+        starts = np.searchsorted(query_indices, query_indices, side='left')
+        rank = np.arange(len(query_indices)) - starts
+        keep = rank < n_results
+        return query_indices[keep], scores[keep], indices[keep], rank[keep]
+
+    def _tiled_search(self, queries, codes, n_results):
+        n_queries = len(queries)
+        n_codes = len(codes)
+        n_results = min(n_results, n_codes)
+
+        # a candidate is only worth keeping if it's closer than the current
+        # n_results-th best candidate for its query
+        thresholds = np.zeros(n_queries, dtype=np.int64)
+        thresholds[:] = (self.code_size * 8) + 1
+
+        pool = [
+            np.zeros(0, dtype=np.int64),
+            np.zeros(0, dtype=np.int64),
+            np.zeros(0, dtype=np.int64)]
+        pool_size = 0
+        max_pool_size = max(4 * n_queries * n_results, int(1e5))
+
+        query_block_size = min(self._query_block_size, n_queries)
+        code_block_size = max(
+            1, self._tile_bytes // (query_block_size * self.code_size))
+
+        # each block of codes is read from memory once, and scored against
+        # every query while it is (hopefully) still in cache
+        scores_buffer = np.empty(
+            (query_block_size, code_block_size), dtype=np.int)
+
+        for i in xrange(0, n_codes, code_block_size):
+            block = codes[i: i + code_block_size]
+
+            for j in xrange(0, n_queries, query_block_size):
+                query_block = queries[j: j + query_block_size]
+                scores = packed_hamming_distance_matrix(
+                    query_block, block, out=scores_buffer)
+                if self._dead is not None:
+                    # deleted codes can never beat a threshold
+                    scores[:, self._dead[i: i + code_block_size]] = \
+                        self.code_size * 8 + 1
+                rows, cols = np.nonzero(
+                    scores < thresholds[j: j + query_block_size, None])
+                if not len(rows):
+                    continue
+                pool[0] = np.concatenate([pool[0], rows + j])
+                pool[1] = np.concatenate([pool[1], scores[rows, cols]])
+                pool[2] = np.concatenate([pool[2], cols + i])
+                pool_size += len(rows)
+
+            if pool_size > max_pool_size:
+                query_indices, scores, indices, rank = \
+                    self._top_k_per_query(*(pool + [n_results]))
+                pool = [query_indices, scores, indices]
+                pool_size = len(query_indices)
+                full = rank == n_results - 1
+                thresholds[query_indices[full]] = scores[full]
+
+        query_indices, _, indices, _ = \
+            self._top_k_per_query(*(pool + [n_results]))
+        bounds = np.searchsorted(query_indices, np.arange(n_queries + 1))
+        return [indices[start: stop] for start, stop in zip(bounds, bounds[1:])]
+
+    def search_many(self, codes, n_results, sort=False):
+        """
+        Find the `n_results` nearest neighbors for each code in `codes`.
+
+        Rather than scanning the whole database once per query, blocks of
+        queries are scored against blocks of the database, so memory bandwidth
+        is amortized across queries.  Each query keeps only candidates closer
+        than its current `n_results`-th best match, so no full score vector
+        is ever materialized
+
+        :param codes: an iterable of binary codes, each of length `code_size`
+
+        :param n_results: the number of results to return for each query
+
+        :param sort: accepted for symmetry with `search`.  Results for each \
+        query are always in ascending order of distance
+
+        :return: a list with one list of results per query
+        """
+
+        queries, db_codes, indices = self._search_many_indices(codes, n_results)
+        ids = self._codes.logical_data['id']
+
+        with self.env.begin() as txn:
+            return [
+                [txn.get(_id, db=self.index)[self.code_size:]
+                 for _id in ids[i]]
+                for i in indices]
+
+    def _search_many_indices(self, codes, n_results):
+        if self.writeonly:
+            error_msg = 'searches may not be performed in writeonly mode'
+            raise RuntimeError(error_msg)
+
+        codes = list(codes)
+        queries = self._np_codes(codes)
+        self._check_for_external_modifications()
+
+        db_codes = self._codes.logical_data['code']
+
+        if db_codes.ndim == 1:
+            db_codes = db_codes[..., None]
+
+        if not len(queries):
+            return queries, db_codes, []
+
+        if self._multi_index is not None:
+            indices = [
+                self._multi_index.search(
+                    query, db_codes, n_results, dead=self._dead)
+                for query in queries]
+        else:
+            indices = self._tiled_search(queries, db_codes, n_results)
+
+        return queries, db_codes, indices
+
+    def _scored_results(self, txn, query, db_codes, indices):
+        ids = self._codes.logical_data['id'][indices]
+        scores = packed_hamming_distance(query, db_codes[indices])
+        order = np.argsort(scores, kind='mergesort')
+        return [
+            (int(scores[i]), txn.get(ids[i], db=self.index)[self.code_size:])
+            for i in order]
+
+    def scored_search(self, code, n_results, multithreaded=False):
+        """
+        Like :meth:`search`, but returns a list of `(distance, data)` pairs,
+        in ascending order of hamming distance, so that results from many
+        databases can be merged
+        """
+        indices = self._search_indices(
+            code, n_results, multithreaded, sort=False)
+        db_codes = self._codes.logical_data['code']
+
+        if db_codes.ndim == 1:
+            db_codes = db_codes[..., None]
+
+        with self.env.begin() as txn:
+            return self._scored_results(
+                txn, self._np_code(code), db_codes, indices)
+
+    def scored_search_many(self, codes, n_results):
+        """
+        Like :meth:`search_many`, but each query's results are a list of
+        `(distance, data)` pairs, in ascending order of hamming distance
+        """
+        queries, db_codes, indices = self._search_many_indices(codes, n_results)
+
+        with self.env.begin() as txn:
+            return [
+                self._scored_results(txn, query, db_codes, i)
+                for query, i in zip(queries, indices)]
@@ -1,13 +1,48 @@
 import ujson as json
 import os
+import hashlib
 import threading
 import numpy as np
+from itertools import imap, izip
+from multiprocessing.pool import Pool, cpu_count
 from hammingdb import HammingDb
+from cache import LRUCache
 from zounds.persistence import TimeSliceEncoder, TimeSliceDecoder
 from zounds.timeseries import ConstantRateTimeSeries
 from zounds.timeseries import TimeSlice
 
 
+_binary_record_dtype = np.dtype([
+    ('doc', '<u8'),
+    ('start', '<i8'),
+    ('duration', '<i8')])
+
+
+def _picoseconds(td):
+    return np.timedelta64(td, 'ps').astype(np.int64)
+
+
+def _doc_key(doc_ref):
+    return 'doc:{doc_ref:016x}'.format(doc_ref=int(doc_ref))
+
+
+_checkpoint_key = 'addall.checkpoint'
+
+# the index being built by add_all.  Worker processes inherit it when the
+# pool forks, so the index itself, which holds an lmdb environment and,
+# possibly, unpicklable extra_data functions, is never pickled
+_encoding_index = None
+
+
+def _init_encoder(index):
+    global _encoding_index
+    _encoding_index = index
+
+
+def _encode_document(_id):
+    return _encoding_index._encode(_id)
+
+
 class SearchResults(object):
     def __init__(self, query, results):
         super(SearchResults, self).__init__()
@@ -29,6 +64,12 @@ class HammingIndex(object):
             db_size_bytes=1000000000,
             listen=False,
             writeonly=False,
+            n_substrings=None,
+            rerank_feature=None,
+            rerank_factor=10,
+            rerank_metric='euclidean',
+            binary_records=False,
+            cache_size=0,
             **extra_data):
 
         super(HammingIndex, self).__init__()
@@ -38,6 +79,15 @@ class HammingIndex(object):
         self.path = path
         self.extra_data = extra_data
         self.writeonly = writeonly
+        self.n_substrings = n_substrings
+        self.rerank_feature = rerank_feature
+        self.rerank_factor = rerank_factor
+        self.rerank_metric = rerank_metric
+        self.binary_records = binary_records
+        self._binary = None
+        self._doc_ids = dict()
+        self.cache = LRUCache(cache_size) if cache_size else None
+        self._cache_version = None
 
         version = version or self.feature.version
 
@@ -51,8 +101,7 @@ class HammingIndex(object):
             self.event_log = None
 
         try:
-            self.hamming_db = HammingDb(
-                self.hamming_db_path, code_size=None, writeonly=self.writeonly)
+            self.hamming_db = self._open_hamming_db(code_size=None)
         except ValueError:
             self.hamming_db = None
 
@@ -100,27 +149,138 @@ class HammingIndex(object):
         if self.hamming_db is not None:
             return
         code_size = len(code) if code else None
-        self.hamming_db = HammingDb(
-            self.hamming_db_path, code_size=code_size, writeonly=self.writeonly)
+        self.hamming_db = self._open_hamming_db(code_size)
+
+    def _open_hamming_db(self, code_size):
+        return HammingDb(
+            self.hamming_db_path,
+            code_size=code_size,
+            writeonly=self.writeonly,
+            n_substrings=self.n_substrings)
+
+    def _append(self, _id, codes, datas, metadata=None, vectors=None):
+        self._init_hamming_db(codes[0])
+        self.hamming_db.append_many(
+            codes, datas, metadata=metadata, vectors=vectors, key=_id)
+
+    def remove_document(self, _id):
+        """
+        Remove every frame of the document with `_id` from the index,
+        returning the number of frames removed
+        """
+        try:
+            self._init_hamming_db()
+        except ValueError:
+            # nothing has been indexed yet
+            return 0
+
+        # the document's interned id is only needed by its own records
+        metadata_keys = [_doc_key(self._doc_ref(_id))] \
+            if self._uses_binary_records() else None
+        return self.hamming_db.delete(_id, metadata_keys=metadata_keys)
 
     def _synchronously_process_events(self):
         self._listen(raise_when_empty=True)
 
-    def add_all(self):
-        for doc in self.document:
-            self.add(doc._id)
+    def add_all(self, multi_process=False, cores=None, resume=True):
+        """
+        Add every document to the index.
+
+        Documents are written in order, and the position of the last one
+        written is checkpointed in the same transaction as its codes, so an
+        interrupted build can resume where it stopped.
+
+        Args:
+            multi_process (bool): when `True`, features are loaded and encoded
+                by a pool of worker processes, while this process writes their
+                codes, in order, as they arrive
+            cores (int): the number of worker processes, defaulting to the
+                number of cpus
+            resume (bool): when `True`, skip documents up to and including the
+                last one written by a previous, interrupted call
+        """
+        _ids = [doc._id for doc in self.document]
+
+        checkpoint = self._add_all_checkpoint() if resume else None
+        start = _ids.index(checkpoint) + 1 if checkpoint in _ids else 0
+
+        pool = None
+        if multi_process:
+            pool = Pool(
+                cores or cpu_count(),
+                initializer=_init_encoder,
+                initargs=(self,))
+            encoded = pool.imap(_encode_document, _ids[start:])
+        else:
+            encoded = imap(self._encode, _ids[start:])
+
+        try:
+            for i, (_id, result) in enumerate(izip(_ids[start:], encoded)):
+                if result is None:
+                    continue
+                position = '{i:016x}:{_id}'.format(i=start + i, _id=_id)
+                self._write(
+                    _id, result, {_checkpoint_key: position.encode('utf-8')})
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+        if self.hamming_db is not None:
+            self.hamming_db.set_metadata(_checkpoint_key, '')
 
-    def _collect_extra_data(self, _id, ts):
+    def _add_all_checkpoint(self):
+        if self.hamming_db is None:
+            return None
+        # positions are zero-padded, so the greatest is the most recent, even
+        # when checkpoints are spread across shards
+        checkpoint = self.hamming_db.get_metadata(_checkpoint_key)
+        if not checkpoint:
+            return None
+        return checkpoint.decode('utf-8').split(':', 1)[1]
+
+    def _collect_extra_data(self, doc, ts):
         if not self.extra_data:
             return None
 
-        doc = self.document(_id)
         return dict(
             ((key, func(doc, ts)) for key, func in self.extra_data.iteritems()))
 
     def add(self, _id, timestamp=''):
-        # load the feature from the feature database
+        encoded = self._encode(_id)
+        if encoded is None:
+            return
+        self._write(_id, encoded, dict(timestamp=bytes(timestamp)))
+
+    def _encode_codes(self, frames):
+        """
+        Encode every frame at once, rather than calling `encode_query` for
+        each one
+        """
+        raw = np.asarray(frames)
+
+        if not len(raw):
+            return []
+
+        if raw.dtype == np.uint64:
+            packed = np.ascontiguousarray(raw) \
+                .reshape((len(raw), -1)).view(np.uint8)
+        elif raw.dtype == np.uint8 or raw.dtype == np.bool:
+            packed = np.packbits(raw.reshape((len(raw), -1)), axis=-1)
+        else:
+            return [self.encode_query(frame) for frame in frames]
+
+        block = packed.tostring()
+        size = packed.shape[1]
+        return [block[i: i + size] for i in xrange(0, len(block), size)]
+
+    def _encode(self, _id):
+        """
+        Load a document's feature and compute everything needed to index it,
+        without touching the hamming database
+        """
         feature = self.feature(_id=_id, persistence=self.document)
+        doc = self.document(_id) if self.extra_data else None
 
         try:
             arr = ConstantRateTimeSeries(feature)
@@ -128,17 +288,92 @@ class HammingIndex(object):
             arr = feature
 
         # extract codes and timeslices from the feature
+        slices = []
+        frames = []
         for ts, data in arr.iter_slices():
-            code = self.encode_query(data)
-            encoded_ts = dict(
-                _id=_id,
-                **self.encoder.dict(ts))
-            extra_data = self._collect_extra_data(_id, ts)
-            if extra_data:
-                encoded_ts['extra_data'] = extra_data
-            self._init_hamming_db(code)
-            self.hamming_db.append(code, json.dumps(encoded_ts))
-            self.hamming_db.set_metadata('timestamp', bytes(timestamp))
+            slices.append(ts)
+            frames.append(data)
+
+        if not slices:
+            return None
+
+        codes = self._encode_codes(frames)
+        extra_datas = [self._collect_extra_data(doc, ts) for ts in slices]
+        vectors = self._rerank_vectors(_id, len(codes))
+        return codes, slices, extra_datas, vectors
+
+    def _write(self, _id, encoded, metadata):
+        codes, slices, extra_datas, vectors = encoded
+        self._init_hamming_db(codes[0])
+
+        if self._uses_binary_records():
+            datas = self._binary_datas(_id, slices, extra_datas, metadata)
+        else:
+            datas = [
+                self._json_data(_id, ts, extra_data)
+                for ts, extra_data in zip(slices, extra_datas)]
+
+        # write all the document's codes in a single transaction
+        self._append(_id, codes, datas, metadata=metadata, vectors=vectors)
+
+    def _json_data(self, _id, ts, extra_data):
+        encoded_ts = dict(_id=_id, **self.encoder.dict(ts))
+        if extra_data:
+            encoded_ts['extra_data'] = extra_data
+        return json.dumps(encoded_ts)
+
+    def _doc_ref(self, _id):
+        # documents are interned as a hash of their id, rather than a
+        # counter, so that references are unique across shards and processes
+        if isinstance(_id, unicode):
+            _id = _id.encode('utf-8')
+        return int(hashlib.md5(_id).hexdigest()[:16], 16)
+
+    def _binary_datas(self, _id, slices, extra_datas, metadata):
+        doc_ref = self._doc_ref(_id)
+        records = np.zeros(len(slices), dtype=_binary_record_dtype)
+        records['doc'] = doc_ref
+        records['start'] = [_picoseconds(ts.start) for ts in slices]
+        records['duration'] = [_picoseconds(ts.duration) for ts in slices]
+
+        # the document's id is written to the table in the same transaction
+        # as the records that refer to it
+        metadata[_doc_key(doc_ref)] = \
+            _id.encode('utf-8') if isinstance(_id, unicode) else _id
+        metadata['recordformat'] = 'binary'
+
+        return [
+            record.tostring() + (json.dumps(extra_data) if extra_data else '')
+            for record, extra_data in zip(records, extra_datas)]
+
+    def _uses_binary_records(self):
+        """
+        The format of an existing index always takes precedence over the
+        `binary_records` argument, so records are never mixed
+        """
+        if self._binary is not None:
+            return self._binary
+
+        stored = self.hamming_db.get_metadata('recordformat')
+        if stored is None and not len(self.hamming_db):
+            # nothing has been written yet, so the choice is still open
+            return self.binary_records
+
+        self._binary = stored == 'binary'
+        return self._binary
+
+    def _rerank_vectors(self, _id, n_codes):
+        if self.rerank_feature is None:
+            return None
+
+        vectors = self.rerank_feature(_id=_id, persistence=self.document)
+        vectors = np.asarray(vectors).reshape((len(vectors), -1))
+        if len(vectors) != n_codes:
+            raise ValueError(
+                '{self.rerank_feature.key} has {n_vectors} frames, but '
+                '{self.feature.key} has {n_codes}'
+                    .format(n_vectors=len(vectors), **locals()))
+        return vectors
 
     def _listen(self, raise_when_empty=False):
 
@@ -167,6 +402,45 @@ class HammingIndex(object):
 
             self.add(_id, timestamp)
 
+    def _doc_id(self, doc_ref):
+        try:
+            return self._doc_ids[doc_ref]
+        except KeyError:
+            _id = self.hamming_db.get_metadata(_doc_key(doc_ref))
+            _id = _id.decode('utf-8')
+            self._doc_ids[doc_ref] = _id
+            return _id
+
+    def _parse_binary_results(self, raw_results):
+        raw_results = list(raw_results)
+        if not raw_results:
+            return []
+
+        # decode the fixed-width portion of every record in a single step
+        size = _binary_record_dtype.itemsize
+        records = np.frombuffer(
+            ''.join(r[:size] for r in raw_results),
+            dtype=_binary_record_dtype)
+        ids = [self._doc_id(doc_ref) for doc_ref in records['doc']]
+        starts = records['start'].astype('timedelta64[ps]')
+        durations = records['duration'].astype('timedelta64[ps]')
+        slices = [
+            TimeSlice(duration=duration, start=start)
+            for start, duration in zip(starts, durations)]
+
+        if not self.extra_data:
+            return zip(ids, slices)
+
+        extra_datas = [
+            json.loads(r[size:]) if len(r) > size else None
+            for r in raw_results]
+        return zip(ids, slices, extra_datas)
+
+    def _parse_results(self, raw_results):
+        if self._uses_binary_records():
+            return self._parse_binary_results(raw_results)
+        return (self._parse_result(r) for r in raw_results)
+
     def _parse_result(self, result):
         d = json.loads(result)
         ts = TimeSlice(**self.decoder.kwargs(d))
@@ -196,13 +470,98 @@ class HammingIndex(object):
         self._init_hamming_db()
         code, raw_results = self.hamming_db.random_search(
             n_results, multithreaded, sort=sort)
-        parsed_results = (self._parse_result(r) for r in raw_results)
+        parsed_results = self._parse_results(raw_results)
+        return SearchResults(code, parsed_results)
+
+    def search(
+            self,
+            feature,
+            n_results,
+            multithreaded=False,
+            sort=False,
+            query_vector=None):
+
+        self._init_hamming_db()
+        code = self.encode_query(feature)
+
+        if query_vector is None and self.cache is not None:
+            return SearchResults(
+                code, self._cached_search(code, n_results, multithreaded, sort))
+
+        if query_vector is None:
+            raw_results = self.hamming_db.search(
+                code, n_results, multithreaded, sort=sort)
+        else:
+            # gather extra candidates in hamming space, and then re-rank them
+            # by their exact distance from the real-valued query
+            raw_results = self.hamming_db.rerank_search(
+                code,
+                query_vector,
+                n_results,
+                n_results * self.rerank_factor,
+                distance_metric=self.rerank_metric,
+                multithreaded=multithreaded)
+
+        parsed_results = self._parse_results(raw_results)
         return SearchResults(code, parsed_results)
 
-    def search(self, feature, n_results, multithreaded=False, sort=False):
+    def _cached_search(self, code, n_results, multithreaded, sort):
+        # any write, from any process, makes every cached result suspect
+        version = self.hamming_db.version
+        if version != self._cache_version:
+            self.cache.clear()
+            self._cache_version = version
+
+        key = (code, n_results, sort)
+        results = self.cache.get(key)
+        if results is None:
+            results = list(self._parse_results(self.hamming_db.search(
+                code, n_results, multithreaded, sort=sort)))
+            self.cache.put(key, results)
+        return results
+
+    def range_search(self, feature, radius, limit=None):
+        """
+        Find every indexed frame within hamming distance `radius` of
+        `feature`, e.g., to detect near-duplicates
+
+        See Also:
+            :meth:`HammingDb.range_search`
+        """
         self._init_hamming_db()
         code = self.encode_query(feature)
-        raw_results = self.hamming_db.search(
-            code, n_results, multithreaded, sort=sort)
-        parsed_results = (self._parse_result(r) for r in raw_results)
+        raw_results = self.hamming_db.range_search(code, radius, limit=limit)
+        parsed_results = self._parse_results(raw_results)
         return SearchResults(code, parsed_results)
+
+    def weighted_search(
+            self,
+            projections,
+            n_results,
+            multithreaded=False,
+            sort=False,
+            weights=None):
+        """
+        Search using a query's real-valued projections, rather than its
+        binary code, so that bits the query is unsure of count for less.
+        The query code is the sign of each projection
+
+        See Also:
+            :meth:`HammingDb.weighted_search`
+            :func:`zounds.learn.simhash_projections`
+        """
+        self._init_hamming_db()
+        projections = np.asarray(projections).reshape(-1)
+        code = self.encode_query(projections > 0)
+        raw_results = self.hamming_db.weighted_search(
+            projections, n_results, multithreaded, sort=sort, weights=weights)
+        parsed_results = self._parse_results(raw_results)
+        return SearchResults(code, parsed_results)
+
+    def search_many(self, features, n_results, sort=False):
+        self._init_hamming_db()
+        codes = [self.encode_query(feature) for feature in features]
+        raw_results = self.hamming_db.search_many(codes, n_results, sort=sort)
+        return [
+            SearchResults(code, self._parse_results(results))
+            for code, results in zip(codes, raw_results)]
@@ -0,0 +1,257 @@
+from __future__ import division
+import warnings
+import cPickle as pickle
+import numpy as np
+from random import randint
+from scipy.cluster.vq import kmeans2
+from scipy.spatial.distance import cdist
+from index import SearchResults
+from zounds.timeseries import ConstantRateTimeSeries
+
+
+class IVFPQSearch(object):
+    """
+    An approximate nearest neighbor index over real-valued features, using an
+    inverted file with product quantization (IVF-PQ), as described in "Product
+    Quantization for Nearest Neighbor Search" (Jegou, Douze & Schmid).
+
+    A coarse k-means quantizer partitions the feature space into
+    `n_centroids` cells, and each feature is stored only as the index of its
+    cell, along with a product-quantized, `n_subquantizers`-byte encoding of
+    its residual from the cell's centroid.  At query time, only the `nprobe`
+    cells nearest to the query are scanned, and distances to their members are
+    approximated with per-subquantizer lookup tables.
+
+    Args:
+        gen (iterable): an optional iterable of `(_id, feature)` pairs, where
+            each feature is a two-dimensional time series.  If supplied, the
+            index is trained on a random sample of at most `training_size`
+            rows from all features, and every feature is then added
+        n_centroids (int): the number of cells in the coarse quantizer
+        n_subquantizers (int): the number of sub-vectors each residual is split
+            into.  This must evenly divide the feature's dimension
+        n_bits (int): bits used to encode each sub-vector, at most eight
+        nprobe (int): the default number of cells scanned per query.  Larger
+            values trade latency for recall
+        distance_metric (str): either `euclidean` or `cosine`
+        training_size (int): the maximum number of rows used for training when
+            `gen` is supplied
+        n_iterations (int): the number of k-means iterations used in training
+
+    See Also:
+        :class:`BruteForceSearch`
+    """
+
+    def __init__(
+            self,
+            gen=None,
+            n_centroids=256,
+            n_subquantizers=8,
+            n_bits=8,
+            nprobe=8,
+            distance_metric='euclidean',
+            training_size=int(1e5),
+            n_iterations=20):
+
+        super(IVFPQSearch, self).__init__()
+
+        if n_bits > 8:
+            raise ValueError('n_bits must be eight or less')
+
+        if distance_metric not in ('euclidean', 'cosine'):
+            raise ValueError(
+                'distance_metric must be one of euclidean or cosine, '
+                'but was {distance_metric}'.format(**locals()))
+
+        self.n_centroids = n_centroids
+        self.n_subquantizers = n_subquantizers
+        self.n_bits = n_bits
+        self.nprobe = nprobe
+        self.distance_metric = distance_metric
+        self.n_iterations = n_iterations
+
+        self.centroids = None
+        self.subquantizers = None
+
+        self._ids = []
+        self._assignments = np.zeros(0, dtype=np.int64)
+        self._codes = np.zeros((0, n_subquantizers), dtype=np.uint8)
+        self._order = None
+        self._offsets = None
+
+        if gen is None:
+            return
+
+        examples = list(gen)
+        data = np.concatenate([example for _, example in examples])
+        n_samples = min(training_size, len(data))
+        sample = data[np.random.permutation(len(data))[:n_samples]]
+        self.train(sample)
+        self.add(examples)
+
+    def __len__(self):
+        return len(self._ids)
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    def _preprocess(self, x):
+        x = np.asarray(x, dtype=np.float32)
+        if self.distance_metric == 'cosine':
+            norms = np.linalg.norm(x, axis=-1, keepdims=True)
+            norms[norms == 0] = 1
+            x = x / norms
+        return x
+
+    def _kmeans(self, data, k):
+        k = min(k, len(data))
+        with warnings.catch_warnings():
+            # kmeans2 warns when a cluster ends up empty
+            warnings.simplefilter('ignore')
+            centroids, _ = kmeans2(
+                data.astype(np.float64), k, iter=self.n_iterations,
+                minit='points')
+        return centroids.astype(np.float32)
+
+    def _subspaces(self, dim):
+        width = dim // self.n_subquantizers
+        return [
+            slice(i * width, (i + 1) * width)
+            for i in xrange(self.n_subquantizers)]
+
+    def _nearest(self, data, centroids, chunksize=10000):
+        return np.concatenate([
+            cdist(data[i: i + chunksize], centroids, 'sqeuclidean')
+                .argmin(axis=1)
+            for i in xrange(0, len(data), chunksize)])
+
+    def train(self, sample):
+        """
+        Learn the coarse quantizer and subquantizers from a representative
+        sample of features
+
+        Args:
+            sample (np.ndarray): a two-dimensional array of features
+        """
+        sample = self._preprocess(sample)
+        dim = sample.shape[1]
+
+        if dim % self.n_subquantizers:
+            raise ValueError(
+                'n_subquantizers ({self.n_subquantizers}) must evenly divide '
+                'the feature dimension ({dim})'.format(**locals()))
+
+        self.centroids = self._kmeans(sample, self.n_centroids)
+        residuals = sample - self.centroids[
+            self._nearest(sample, self.centroids)]
+        self.subquantizers = [
+            self._kmeans(residuals[:, sl], 2 ** self.n_bits)
+            for sl in self._subspaces(dim)]
+
+    def _encode(self, data):
+        assignments = self._nearest(data, self.centroids)
+        residuals = data - self.centroids[assignments]
+        codes = np.column_stack([
+            self._nearest(residuals[:, sl], subquantizer)
+            for sl, subquantizer in
+            zip(self._subspaces(data.shape[1]), self.subquantizers)])
+        return assignments, codes.astype(np.uint8)
+
+    def add(self, gen):
+        """
+        Add features to a trained index
+
+        Args:
+            gen (iterable): an iterable of `(_id, feature)` pairs
+        """
+        if not self.is_trained:
+            raise RuntimeError('the index must be trained before adding data')
+
+        assignments = [self._assignments]
+        codes = [self._codes]
+
+        for _id, example in gen:
+            crts = ConstantRateTimeSeries(example)
+            for ts, _ in crts.iter_slices():
+                self._ids.append((_id, ts))
+            a, c = self._encode(self._preprocess(example))
+            assignments.append(a)
+            codes.append(c)
+
+        self._assignments = np.concatenate(assignments)
+        self._codes = np.concatenate(codes)
+        self._order = None
+
+    def _inverted_lists(self):
+        if self._order is None:
+            self._order = np.argsort(self._assignments, kind='mergesort')
+            self._offsets = np.searchsorted(
+                self._assignments[self._order],
+                np.arange(len(self.centroids) + 1))
+        return self._order, self._offsets
+
+    def reconstruct(self, index):
+        """
+        Approximately reconstruct the feature stored at `index`
+        """
+        centroid = self.centroids[self._assignments[index]]
+        residual = np.concatenate([
+            subquantizer[code] for subquantizer, code in
+            zip(self.subquantizers, self._codes[index])])
+        return centroid + residual
+
+    def search(self, query, n_results=10, nprobe=None):
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        order, offsets = self._inverted_lists()
+        q = self._preprocess(query)
+
+        coarse = ((self.centroids - q) ** 2).sum(axis=1)
+        cells = np.argpartition(coarse, nprobe - 1)[:nprobe]
+
+        indices = []
+        distances = []
+        subspaces = self._subspaces(len(q))
+        rows = np.arange(self.n_subquantizers)
+
+        for cell in cells:
+            members = order[offsets[cell]: offsets[cell + 1]]
+            if not len(members):
+                continue
+
+            # the distance from the query's residual to every subquantizer
+            # centroid, for each subspace
+            residual = q - self.centroids[cell]
+            tables = np.array([
+                ((subquantizer - residual[sl]) ** 2).sum(axis=1)
+                for sl, subquantizer in zip(subspaces, self.subquantizers)])
+
+            indices.append(members)
+            distances.append(
+                tables[rows, self._codes[members]].sum(axis=1))
+
+        if not indices:
+            return SearchResults(query, iter([]))
+
+        indices = np.concatenate(indices)
+        distances = np.concatenate(distances)
+
+        if n_results < len(distances):
+            partitioned = np.argpartition(distances, n_results)[:n_results]
+        else:
+            partitioned = np.arange(len(distances))
+        nearest = indices[partitioned[np.argsort(distances[partitioned])]]
+        return SearchResults(query, (self._ids[i] for i in nearest))
+
+    def random_search(self, n_results=10, nprobe=None):
+        query = self.reconstruct(randint(0, len(self) - 1))
+        return self.search(query, n_results, nprobe=nprobe)
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            pickle.dump(self, f, pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
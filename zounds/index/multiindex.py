@@ -0,0 +1,283 @@
+from __future__ import division
+import numpy as np
+from itertools import combinations
+from zounds.nputil import packed_hamming_distance
+
+
+def _n_combinations(n, k):
+    if k < 0 or k > n:
+        return 0
+    total = 1
+    for i in xrange(min(k, n - k)):
+        total = total * (n - i) // (i + 1)
+    return total
+
+
+def _ranges(starts, stops):
+    """
+    Concatenate np.arange(start, stop) for each start/stop pair, without a
+    python loop
+    """
+    lengths = stops - starts
+    mask = lengths > 0
+    starts = starts[mask]
+    lengths = lengths[mask]
+    if not len(starts):
+        return np.zeros(0, dtype=np.int64)
+    ends = np.cumsum(lengths)
+    steps = np.ones(ends[-1], dtype=np.int64)
+    steps[0] = starts[0]
+    steps[ends[:-1]] = starts[1:] - (starts[:-1] + lengths[:-1]) + 1
+    return np.cumsum(steps)
+
+
+class MultiIndex(object):
+    """
+    A multi-index hashing engine, as described in "Fast Exact Search in
+    Hamming Space with Multi-Index Hashing" (Norouzi, Punjani & Fleet).
+
+    Each packed code is split into `n_substrings` disjoint, byte-aligned
+    substrings, and one table per substring maps substring values to the rows
+    that contain them.  By the pigeonhole principle, any code within hamming
+    distance `r` of the query must match the query within distance
+    `r // n_substrings` in at least one substring, so candidates are
+    enumerated by probing each table with increasingly distant substring
+    values, and then re-checked against the full code.
+
+    Tables are stored as sorted arrays of substring values, rather than
+    python dictionaries, so they can be probed in bulk with `np.searchsorted`.
+    Codes appended since the tables were last built are scanned exhaustively,
+    and the tables are rebuilt once that unindexed tail grows large enough.
+    """
+
+    def __init__(
+            self,
+            code_size,
+            n_substrings,
+            rebuild_ratio=0.1,
+            max_candidate_ratio=0.1):
+        super(MultiIndex, self).__init__()
+
+        if n_substrings < 1:
+            raise ValueError('n_substrings must be at least one')
+
+        if code_size % n_substrings:
+            raise ValueError(
+                'code_size ({code_size}) must be evenly divisible by '
+                'n_substrings ({n_substrings})'.format(**locals()))
+
+        substring_bytes = code_size // n_substrings
+        if substring_bytes > 8:
+            raise ValueError(
+                'substrings may be at most 64 bits, but {code_size} byte codes'
+                ' split into {n_substrings} substrings are {substring_bytes} '
+                'bytes wide'.format(**locals()))
+
+        self.code_size = code_size
+        self.n_substrings = n_substrings
+        self.substring_bytes = substring_bytes
+        self.substring_bits = substring_bytes * 8
+        self.rebuild_ratio = rebuild_ratio
+        self.max_candidate_ratio = max_candidate_ratio
+
+        self._built_size = 0
+        self._sorted_keys = None
+        self._orders = None
+        self._masks = dict()
+
+    def __len__(self):
+        return self._built_size
+
+    def reset(self):
+        """
+        Discard the tables, e.g. because existing rows have been removed or
+        reordered.  They'll be rebuilt by the next search
+        """
+        self._built_size = 0
+        self._sorted_keys = None
+        self._orders = None
+
+    def substrings(self, codes):
+        """
+        Compute the integer value of each substring of each code
+
+        :param codes: a two-dimensional array of packed `uint64` codes
+
+        :return: an array of shape `(len(codes), n_substrings)`
+        """
+        codes = np.ascontiguousarray(codes, dtype=np.uint64)
+        n_codes = len(codes)
+        raw = codes.view(np.uint8).reshape(
+            (n_codes, self.n_substrings, self.substring_bytes))
+        padded = np.zeros((n_codes, self.n_substrings, 8), dtype=np.uint8)
+        padded[..., :self.substring_bytes] = raw
+        return padded.view('<u8')[..., 0]
+
+    def build(self, codes):
+        keys = self.substrings(codes)
+        self._orders = []
+        self._sorted_keys = []
+        for i in xrange(self.n_substrings):
+            order = np.argsort(keys[:, i], kind='mergesort')
+            self._orders.append(order)
+            self._sorted_keys.append(keys[order, i])
+        self._built_size = len(codes)
+
+    def _needs_rebuild(self, codes):
+        tail = len(codes) - self._built_size
+        if tail < 0:
+            return True
+        return tail > max(1024, self.rebuild_ratio * self._built_size)
+
+    def _flip_masks(self, radius):
+        try:
+            return self._masks[radius]
+        except KeyError:
+            masks = np.array(
+                [sum(1 << bit for bit in bits) for bits in
+                 combinations(xrange(self.substring_bits), radius)],
+                dtype=np.uint64)
+            self._masks[radius] = masks
+            return masks
+
+    def _probe(self, table, values):
+        sorted_keys = self._sorted_keys[table]
+        starts = np.searchsorted(sorted_keys, values, side='left')
+        stops = np.searchsorted(sorted_keys, values, side='right')
+        return self._orders[table][_ranges(starts, stops)]
+
+    def _exhaustive(self, query, codes, n_results, dead=None):
+        scores = packed_hamming_distance(query, codes)
+        if dead is not None:
+            # further than any live code can be
+            scores[dead] = self.code_size * 8 + 1
+        if n_results < len(scores):
+            indices = np.argpartition(scores, n_results)[:n_results]
+        else:
+            indices = np.arange(len(scores))
+        indices = indices[np.argsort(scores[indices], kind='mergesort')]
+        if dead is not None:
+            # only when there are fewer than n_results live codes
+            indices = indices[~dead[indices]]
+        return indices
+
+    def _live(self, rows, dead):
+        if dead is None:
+            return rows
+        return rows[~dead[rows]]
+
+    def search(self, query, codes, n_results, dead=None):
+        """
+        Find the `n_results` codes nearest to `query`
+
+        :param query: a one-dimensional array of packed `uint64` values
+
+        :param codes: the two-dimensional array of packed `uint64` codes that \
+        this index was built over.  Rows may have been appended since the \
+        index was last built, but existing rows must not have changed
+
+        :param dead: an optional boolean array with one entry per row of \
+        `codes`, marking rows that must never be returned, e.g. because \
+        they've been deleted
+
+        :return: row indices into `codes`, sorted by ascending hamming distance
+        """
+        n_codes = len(codes)
+        if n_results >= n_codes:
+            return self._exhaustive(query, codes, n_results, dead)
+
+        if self._sorted_keys is None or self._needs_rebuild(codes):
+            self.build(codes)
+
+        # codes appended since the tables were built are scored directly
+        tail_rows = self._live(np.arange(self._built_size, n_codes), dead)
+        tail_scores = packed_hamming_distance(query, codes[tail_rows])
+
+        query_keys = self.substrings(query[None, ...])[0]
+        candidate_rows = [tail_rows]
+        candidate_scores = [tail_scores]
+        bucket_size = max(1, self._built_size / (2 ** self.substring_bits))
+        max_candidates = self.max_candidate_ratio * self._built_size
+        n_candidates = 0
+
+        for radius in xrange(self.substring_bits + 1):
+            n_probes = \
+                _n_combinations(self.substring_bits, radius) * self.n_substrings
+
+            if n_candidates + (n_probes * bucket_size) > max_candidates:
+                # probing every neighbouring substring value would touch
+                # enough entries that simply scanning all the codes is cheaper
+                break
+
+            masks = self._flip_masks(radius)
+            found = np.concatenate([
+                self._probe(i, query_keys[i] ^ masks)
+                for i in xrange(self.n_substrings)])
+            n_candidates += len(found)
+            found = self._live(found, dead)
+            candidate_rows.append(found)
+            candidate_scores.append(
+                packed_hamming_distance(query, codes[found]))
+
+            # every code whose substrings all lie further than radius from the
+            # query's substrings is at least this far from the query overall,
+            # so all codes closer than this bound have been found.  A row may
+            # have been found via more than one substring, so duplicates are
+            # removed from this (typically very small) set before counting
+            bound = (radius + 1) * self.n_substrings
+            rows = np.concatenate(
+                [r[s < bound] for r, s in
+                 zip(candidate_rows, candidate_scores)])
+            scores = np.concatenate(
+                [s[s < bound] for s in candidate_scores])
+            rows, unique_indices = np.unique(rows, return_index=True)
+            if len(rows) >= n_results:
+                scores = scores[unique_indices]
+                order = np.argsort(scores, kind='mergesort')[:n_results]
+                return rows[order]
+
+        return self._exhaustive(query, codes, n_results, dead)
+
+    def range_search(self, query, codes, radius):
+        """
+        Find every code within hamming distance `radius` of `query`
+
+        :param query: a one-dimensional array of packed `uint64` values
+
+        :param codes: the two-dimensional array of packed `uint64` codes that \
+        this index was built over
+
+        :param radius: the maximum hamming distance, inclusive
+
+        :return: a tuple of row indices into `codes` and their distances from \
+        the query, sorted by ascending distance
+        """
+        if self._sorted_keys is None or self._needs_rebuild(codes):
+            self.build(codes)
+
+        # any code within radius must match the query within this distance
+        # in at least one of its substrings
+        substring_radius = min(radius // self.n_substrings, self.substring_bits)
+        n_probes = sum(
+            _n_combinations(self.substring_bits, r)
+            for r in xrange(substring_radius + 1)) * self.n_substrings
+        bucket_size = max(1, self._built_size / (2 ** self.substring_bits))
+
+        if n_probes * bucket_size > self.max_candidate_ratio * self._built_size:
+            rows = np.arange(len(codes))
+        else:
+            query_keys = self.substrings(query[None, ...])[0]
+            found = [np.arange(self._built_size, len(codes))]
+            for r in xrange(substring_radius + 1):
+                masks = self._flip_masks(r)
+                found.extend(
+                    self._probe(i, query_keys[i] ^ masks)
+                    for i in xrange(self.n_substrings))
+            rows = np.unique(np.concatenate(found))
+
+        scores = packed_hamming_distance(query, codes[rows])
+        within = scores <= radius
+        rows = rows[within]
+        scores = scores[within]
+        order = np.argsort(scores, kind='mergesort')
+        return rows[order], scores[order]
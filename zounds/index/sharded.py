@@ -0,0 +1,309 @@
+import glob
+import heapq
+import os
+import threading
+import zlib
+import numpy as np
+from itertools import islice
+from multiprocessing import Process, Pipe
+from hammingdb import HammingDb
+from index import HammingIndex
+
+
+def _serve_shard(path, map_size, n_substrings, connection):
+    """
+    Answer requests for a single shard until asked to stop.  The shard's
+    database is opened lazily, and in this process only, since lmdb
+    environments may not be shared across a fork
+    """
+    db = None
+    while True:
+        request = connection.recv()
+        if request is None:
+            break
+
+        method, args = request
+        try:
+            if db is None:
+                try:
+                    db = HammingDb(
+                        path,
+                        map_size=map_size,
+                        code_size=None,
+                        n_substrings=n_substrings)
+                except ValueError:
+                    # nothing has been written to this shard yet
+                    connection.send((None, None))
+                    continue
+            connection.send((None, getattr(db, method)(*args)))
+        except Exception as e:
+            connection.send((e, None))
+
+    if db is not None:
+        db.close()
+
+
+class ShardedHammingDb(object):
+    """
+    A :class:`HammingDb` partitioned into `n_shards` independent databases,
+    each of which is searched by its own worker process.
+
+    Searches are scattered to every worker and the per-shard results, which
+    arrive sorted by hamming distance, are merged, so a single query can use
+    as many cores as there are shards.  Writes happen in the calling process,
+    and every call to :meth:`append_many` lands in exactly one shard, chosen
+    by hashing its `key`
+    """
+
+    def __init__(
+            self,
+            path,
+            n_shards,
+            map_size=1000000000,
+            code_size=8,
+            writeonly=False,
+            n_substrings=None):
+
+        super(ShardedHammingDb, self).__init__()
+
+        self._lock = threading.Lock()
+        self._workers = []
+        self._connections = []
+        self.shards = []
+
+        if n_shards < 1:
+            raise ValueError('n_shards must be at least one')
+
+        existing = len(glob.glob(os.path.join(path, 'shard.*')))
+        if not existing and code_size is None:
+            raise ValueError(
+                'You must supply a code size for an uninitialized database')
+
+        if existing and existing != n_shards:
+            raise ValueError(
+                '{path} contains {existing} shards, but n_shards was '
+                '{n_shards}'.format(**locals()))
+
+        self.path = path
+        self.n_shards = n_shards
+        self.writeonly = writeonly
+        self.shard_paths = [
+            os.path.join(path, 'shard.{i:03d}'.format(i=i))
+            for i in xrange(n_shards)]
+
+        # start workers before this process opens any lmdb environment, so
+        # none are inherited by the children
+        if not self.writeonly:
+            for shard_path in self.shard_paths:
+                parent, child = Pipe()
+                worker = Process(
+                    target=_serve_shard,
+                    args=(shard_path, map_size, n_substrings, child))
+                worker.daemon = True
+                worker.start()
+                self._workers.append(worker)
+                self._connections.append(parent)
+
+        try:
+            self.shards = [
+                HammingDb(
+                    shard_path,
+                    map_size=map_size,
+                    code_size=code_size,
+                    writeonly=True)
+                for shard_path in self.shard_paths]
+        except:
+            self.close()
+            raise
+
+        self.code_size = self.shards[0].code_size
+
+    def close(self):
+        for connection in self._connections:
+            try:
+                connection.send(None)
+            except:
+                pass
+
+        for worker in self._workers:
+            worker.join()
+
+        for shard in self.shards:
+            shard.close()
+
+        self._workers = []
+        self._connections = []
+        self.shards = []
+
+    def __del__(self):
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards)
+
+    @property
+    def version(self):
+        return tuple(shard.version for shard in self.shards)
+
+    def get_metadata(self, key):
+        """
+        Return the greatest value stored under `key` in any shard, e.g., the
+        most recent timestamp written
+        """
+        values = filter(
+            lambda x: x is not None,
+            (shard.get_metadata(key) for shard in self.shards))
+        return max(values) if values else None
+
+    def set_metadata(self, key, value):
+        for shard in self.shards:
+            shard.set_metadata(key, value)
+
+    def shard(self, shard_key):
+        """
+        Return the shard that data for `shard_key` is written to
+        """
+        if isinstance(shard_key, unicode):
+            shard_key = shard_key.encode('utf-8')
+        index = (zlib.crc32(shard_key) & 0xffffffff) % self.n_shards
+        return self.shards[index]
+
+    def append(self, code, data):
+        self.append_many([code], [data])
+
+    def append_many(
+            self, codes, datas, metadata=None, vectors=None, key=None):
+
+        shard_key = datas[0] if key is None else key
+        self.shard(shard_key).append_many(
+            codes, datas, metadata=metadata, vectors=vectors, key=key)
+
+    def delete(self, key, metadata_keys=None):
+        return self.shard(key).delete(key, metadata_keys=metadata_keys)
+
+    def compact(self):
+        for shard in self.shards:
+            shard.compact()
+
+    def _scatter(self, method, *args):
+        if self.writeonly:
+            error_msg = 'searches may not be performed in writeonly mode'
+            raise RuntimeError(error_msg)
+
+        with self._lock:
+            for connection in self._connections:
+                connection.send((method, args))
+            responses = [
+                connection.recv() for connection in self._connections]
+
+        for error, _ in responses:
+            if error is not None:
+                raise error
+
+        return [result for _, result in responses]
+
+    def _merge(self, results, n_results):
+        merged = heapq.merge(*filter(None, results))
+        return [data for _, data in islice(merged, n_results)]
+
+    def random_search(self, n_results, multithreaded=False, sort=False):
+        sizes = np.array([len(shard) for shard in self.shards], dtype=np.float)
+        if not sizes.sum():
+            raise ValueError('cannot perform a random search on an empty db')
+        index = np.random.choice(self.n_shards, p=sizes / sizes.sum())
+
+        # only the chosen shard's worker needs to find a random code
+        with self._lock:
+            connection = self._connections[index]
+            connection.send(('_random_code', ()))
+            error, code = connection.recv()
+        if error is not None:
+            raise error
+
+        return code, self.search(code, n_results, multithreaded, sort=sort)
+
+    def search(self, code, n_results, multithreaded=False, sort=False):
+        return self._merge(
+            self._scatter('scored_search', code, n_results, multithreaded),
+            n_results)
+
+    def search_many(self, codes, n_results, sort=False):
+        codes = list(codes)
+        per_shard = [
+            results or [[]] * len(codes) for results in
+            self._scatter('scored_search_many', codes, n_results)]
+        return [
+            self._merge(query_results, n_results)
+            for query_results in zip(*per_shard)]
+
+    def range_search(self, code, radius, limit=None):
+        results = self._scatter('scored_range_search', code, radius, limit)
+        return self._merge(results, limit)
+
+    def weighted_search(
+            self,
+            projections,
+            n_results,
+            multithreaded=False,
+            sort=False,
+            weights=None):
+
+        results = self._scatter(
+            'scored_weighted_search',
+            projections,
+            n_results,
+            multithreaded,
+            weights)
+        return self._merge(results, n_results)
+
+    def rerank_search(
+            self,
+            code,
+            vector,
+            n_results,
+            n_candidates,
+            distance_metric='euclidean',
+            multithreaded=False):
+
+        # each shard re-ranks its own candidates, so exact distances from
+        # different shards can be merged directly
+        results = self._scatter(
+            'scored_rerank_search',
+            code,
+            vector,
+            n_results,
+            n_candidates,
+            distance_metric,
+            multithreaded)
+        return self._merge(results, n_results)
+
+
+class ShardedHammingIndex(HammingIndex):
+    """
+    A :class:`HammingIndex` whose codes are partitioned across `n_shards`
+    databases by document id, each searched in parallel by its own worker
+    process.  Search results are identical to those of an unsharded index
+
+    Args:
+        document: the document class whose features are indexed
+        feature: the binary feature to index
+        n_shards (int): the number of shards, and worker processes
+    """
+
+    def __init__(self, document, feature, n_shards=4, **kwargs):
+        self.n_shards = n_shards
+        super(ShardedHammingIndex, self).__init__(document, feature, **kwargs)
+
+    def _open_hamming_db(self, code_size):
+        return ShardedHammingDb(
+            self.hamming_db_path,
+            self.n_shards,
+            code_size=code_size,
+            writeonly=self.writeonly,
+            n_substrings=self.n_substrings)
@@ -0,0 +1,56 @@
+import unittest2
+import json
+import shutil
+import tempfile
+import os
+from benchmark import run, main
+
+
+class BenchmarkTests(unittest2.TestCase):
+    def setUp(self):
+        self._path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._path, ignore_errors=True)
+
+    def test_produces_one_result_per_combination(self):
+        results = run(
+            n_codes=(100, 200),
+            code_sizes=(64, 128),
+            threads=(1, 2),
+            sorts=(False, True),
+            batch_sizes=(4,),
+            n_queries=8,
+            path=self._path)
+        # two sizes, two code sizes, and (2 * 2) + 1 combinations for each
+        self.assertEqual(20, len(results))
+
+    def test_results_include_latency_and_throughput(self):
+        result = run(
+            n_codes=(100,),
+            code_sizes=(64,),
+            sorts=(True,),
+            n_queries=8,
+            path=self._path)[0]
+        for key in ('p50_ms', 'p99_ms', 'qps', 'startup_ms', 'rss_mb'):
+            self.assertIn(key, result)
+        self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+        self.assertGreater(result['qps'], 0)
+
+    def test_removes_databases_when_finished(self):
+        run(n_codes=(100,), code_sizes=(64,), n_queries=4, path=self._path)
+        self.assertEqual([], os.listdir(self._path))
+
+    def test_main_writes_json(self):
+        output = os.path.join(self._path, 'results.json')
+        main([
+            '--n-codes', '100',
+            '--code-sizes', '64',
+            '--n-queries', '4',
+            '--batch-sizes', '2',
+            '--path', self._path,
+            '--output', output])
+        with open(output) as f:
+            data = json.load(f)
+        self.assertIn('environment', data)
+        self.assertEqual(3, len(data['results']))
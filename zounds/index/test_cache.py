@@ -0,0 +1,51 @@
+import unittest2
+from cache import LRUCache
+
+
+class LRUCacheTests(unittest2.TestCase):
+    def test_raises_when_max_size_is_zero(self):
+        self.assertRaises(ValueError, lambda: LRUCache(0))
+
+    def test_returns_default_for_missing_key(self):
+        cache = LRUCache(10)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual('b', cache.get('a', 'b'))
+
+    def test_returns_stored_value(self):
+        cache = LRUCache(10)
+        cache.put('a', 1)
+        self.assertEqual(1, cache.get('a'))
+
+    def test_evicts_least_recently_used_entry(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertIn('c', cache)
+        self.assertEqual(2, len(cache))
+
+    def test_put_replaces_existing_value(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('a', 2)
+        self.assertEqual(2, cache.get('a'))
+        self.assertEqual(1, len(cache))
+
+    def test_counts_hits_and_misses(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.get('a')
+        cache.get('a')
+        cache.get('b')
+        self.assertEqual(2, cache.hits)
+        self.assertEqual(1, cache.misses)
+
+    def test_clear_removes_all_entries(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.clear()
+        self.assertEqual(0, len(cache))
+        self.assertIsNone(cache.get('a'))
@@ -1,9 +1,12 @@
 import unittest2
 from hammingdb import HammingDb
+from zounds.nputil import packed_hamming_distance
 from uuid import uuid4
 import shutil
 import numpy as np
 import os
+import binascii
+import threading
 
 
 class HammingDbTests(unittest2.TestCase):
@@ -33,6 +36,27 @@ class HammingDbTests(unittest2.TestCase):
         db2 = HammingDb(self._path, code_size=None)
         self.assertEqual(32, db2.code_size)
 
+    def test_thread_count_can_be_chosen(self):
+        db = HammingDb(self._path, code_size=8, n_threads=2)
+        self.addCleanup(db.close)
+        self.assertEqual(2, len(db._pool._pool))
+
+    def test_close_stops_worker_threads(self):
+        before = threading.active_count()
+        db = HammingDb(self._path, code_size=8, n_threads=3)
+        db.append_many([os.urandom(8) for _ in xrange(5)], list('abcde'))
+        list(db.search(os.urandom(8), 2, multithreaded=True))
+        self.assertGreater(threading.active_count(), before)
+        db.close()
+        self.assertEqual(before, threading.active_count())
+
+    def test_refresh_maps_codes_written_by_another_instance(self):
+        db = HammingDb(self._path, code_size=8)
+        db2 = HammingDb(self._path, code_size=8)
+        db.append_many([os.urandom(8) for _ in xrange(5)], list('abcde'))
+        db2.refresh()
+        self.assertEqual(5, db2._codes.logical_size)
+
     def test_raises_when_persisted_code_size_does_not_agree_with_init(self):
         HammingDb(self._path, code_size=32)
         self.assertRaises(
@@ -207,3 +231,797 @@ class HammingDbTests(unittest2.TestCase):
         results = list(db.search(self.extract_code_from_text(t1), 3))
         data = results[0]
         self.assertEqual(t1, data)
+
+    def test_can_search_with_multi_index_hashing(self):
+        db = HammingDb(self._path, code_size=8, n_substrings=4)
+        t1 = 'Mary had a little lamb'
+        t2 = 'Mary had a little dog'
+        t3 = 'Permanent Midnight'
+        t4 = 'Mary sad a little cog'
+        db.append(self.extract_code_from_text(t1), t1)
+        db.append(self.extract_code_from_text(t2), t2)
+        db.append(self.extract_code_from_text(t3), t3)
+        db.append(self.extract_code_from_text(t4), t4)
+        results = list(db.search(self.extract_code_from_text(t1), 3))
+        self.assertEqual(3, len(results))
+        self.assertEqual(t1, results[0])
+        self.assertEqual(t2, results[1])
+        self.assertEqual(t4, results[2])
+
+    def test_multi_index_search_agrees_with_brute_force_search(self):
+        db = HammingDb(self._path, code_size=8)
+        mih_db = HammingDb(self._path, code_size=8, n_substrings=4)
+        for i in xrange(5000):
+            code = os.urandom(8)
+            db.append(code, code)
+        query = os.urandom(8)
+
+        def distances(results):
+            return sorted(
+                bin(int(binascii.hexlify(r), 16)
+                    ^ int(binascii.hexlify(query), 16)).count('1')
+                for r in results)
+
+        expected = distances(db.search(query, 10, sort=True))
+        actual = distances(mih_db.search(query, 10))
+        self.assertEqual(expected, actual)
+
+    def test_multi_index_raises_for_incompatible_code_size(self):
+        self.assertRaises(
+            ValueError, lambda: HammingDb(self._path, code_size=8, n_substrings=3))
+
+    def test_search_many_returns_one_result_list_per_query(self):
+        db = HammingDb(self._path, code_size=16)
+        for i in xrange(100):
+            db.append(os.urandom(16), str(i))
+        results = db.search_many([os.urandom(16) for _ in xrange(7)], 10)
+        self.assertEqual(7, len(results))
+        self.assertTrue(all(len(r) == 10 for r in results))
+
+    def test_search_many_agrees_with_search(self):
+        db = HammingDb(self._path, code_size=8)
+        db._tile_bytes = 256
+        db._query_block_size = 3
+        for i in xrange(1000):
+            code = os.urandom(8)
+            db.append(code, code)
+        queries = [os.urandom(8) for _ in xrange(10)]
+
+        def distances(query, results):
+            return [
+                bin(int(binascii.hexlify(r), 16)
+                    ^ int(binascii.hexlify(query), 16)).count('1')
+                for r in results]
+
+        many = db.search_many(queries, 10, sort=True)
+        for query, results in zip(queries, many):
+            expected = list(db.search(query, 10, sort=True))
+            self.assertEqual(
+                distances(query, expected), distances(query, results))
+
+    def test_search_many_over_text_documents(self):
+        db = HammingDb(self._path, code_size=8)
+        t1 = 'Mary had a little lamb'
+        t2 = 'Mary had a little dog'
+        t3 = 'Permanent Midnight'
+        t4 = 'Mary sad a little cog'
+        for t in (t1, t2, t3, t4):
+            db.append(self.extract_code_from_text(t), t)
+        results = db.search_many(
+            [self.extract_code_from_text(t1), self.extract_code_from_text(t3)],
+            2,
+            sort=True)
+        self.assertEqual([t1, t2], results[0])
+        self.assertEqual(t3, results[1][0])
+
+    def test_search_many_returns_all_codes_when_n_results_exceeds_size(self):
+        db = HammingDb(self._path, code_size=8)
+        for i in xrange(5):
+            db.append(os.urandom(8), str(i))
+        results = db.search_many([os.urandom(8)], 10)
+        self.assertEqual(5, len(results[0]))
+
+    def test_search_many_with_no_queries_returns_empty_list(self):
+        db = HammingDb(self._path, code_size=8)
+        db.append(os.urandom(8), 'some data')
+        self.assertEqual([], db.search_many([], 10))
+
+    def test_search_many_raises_in_write_only_mode(self):
+        db = HammingDb(self._path, code_size=8, writeonly=True)
+        db.append(os.urandom(8), 'some data')
+        self.assertRaises(
+            RuntimeError, lambda: db.search_many([os.urandom(8)], 10))
+
+    def test_search_many_raises_for_wrong_code_size(self):
+        db = HammingDb(self._path, code_size=8)
+        db.append(os.urandom(8), 'some data')
+        self.assertRaises(
+            ValueError, lambda: db.search_many([os.urandom(7)], 10))
+
+    def test_codes_are_persisted_to_code_file(self):
+        db = HammingDb(self._path, code_size=8)
+        for i in xrange(10):
+            db.append(os.urandom(8), str(i))
+        self.assertEqual(10, len(db._code_file))
+
+    def test_codes_are_memory_mapped_when_reopened(self):
+        db = HammingDb(self._path, code_size=8)
+        for i in xrange(10):
+            db.append(os.urandom(8), str(i))
+        db2 = HammingDb(self._path, code_size=8)
+        self.assertIsInstance(db2._codes.logical_data, np.memmap)
+        self.assertEqual(10, db2._codes.logical_size)
+
+    def test_writeonly_instance_persists_codes_to_code_file(self):
+        db = HammingDb(self._path, code_size=8, writeonly=True)
+        for i in xrange(10):
+            db.append(os.urandom(8), str(i))
+        db2 = HammingDb(self._path, code_size=8)
+        self.assertEqual(10, db2._codes.logical_size)
+        results = list(db2.search(os.urandom(8), 5))
+        self.assertEqual(5, len(results))
+
+    def test_missing_code_file_is_rebuilt(self):
+        db = HammingDb(self._path, code_size=8)
+        t1 = 'Mary had a little lamb'
+        t2 = 'Mary had a little dog'
+        t3 = 'Permanent Midnight'
+        db.append(self.extract_code_from_text(t1), t1)
+        db.append(self.extract_code_from_text(t2), t2)
+        db.append(self.extract_code_from_text(t3), t3)
+        db.close()
+        os.remove(os.path.join(self._path, 'codes.dat'))
+        db2 = HammingDb(self._path, code_size=8)
+        self.assertEqual(3, len(db2._code_file))
+        results = list(db2.search(self.extract_code_from_text(t1), 1))
+        self.assertEqual(t1, results[0])
+
+    def test_code_file_with_uncommitted_records_is_rebuilt(self):
+        db = HammingDb(self._path, code_size=8)
+        for i in xrange(10):
+            db.append(os.urandom(8), str(i))
+        db._code_file.append(db._recarray(1))
+        db2 = HammingDb(self._path, code_size=8)
+        self.assertEqual(10, len(db2._code_file))
+
+    def test_uncommitted_records_are_not_searched(self):
+        db = HammingDb(self._path, code_size=8)
+        for i in xrange(10):
+            db.append(os.urandom(8), str(i))
+        db._code_file.append(db._recarray(1))
+        results = list(db.search(os.urandom(8), 9))
+        self.assertEqual(9, len(results))
+        self.assertTrue(all(r is not None for r in results))
+
+    def test_ids_are_monotonically_increasing(self):
+        db = HammingDb(self._path, code_size=8)
+        for i in xrange(20):
+            db.append(os.urandom(8), str(i))
+        db._check_for_external_modifications()
+        ids = list(db._codes.logical_data['id'])
+        self.assertEqual(sorted(ids), ids)
+        self.assertEqual(20, len(set(ids)))
+
+    def test_code_file_is_caught_up_incrementally(self):
+        db = HammingDb(self._path, code_size=8)
+        for i in xrange(20):
+            db.append(os.urandom(8), str(i))
+        expected = db._code_file.record(19)
+        db._code_file.truncate(15)
+        db._code_file.rewrite = None
+        db._catch_up_code_file()
+        self.assertEqual(20, len(db._code_file))
+        self.assertEqual(expected, db._code_file.record(19))
+
+    def test_code_file_is_caught_up_during_search(self):
+        db = HammingDb(self._path, code_size=8)
+        t1 = 'Mary had a little lamb'
+        t2 = 'Mary had a little dog'
+        t3 = 'Permanent Midnight'
+        db.append(self.extract_code_from_text(t2), t2)
+        db.append(self.extract_code_from_text(t3), t3)
+        db.append(self.extract_code_from_text(t1), t1)
+        db._code_file.truncate(2)
+        results = list(db.search(self.extract_code_from_text(t1), 1))
+        self.assertEqual(t1, results[0])
+        self.assertEqual(3, len(db._code_file))
+
+    def test_legacy_database_with_random_ids_is_rebuilt(self):
+        db = HammingDb(self._path, code_size=8)
+        with db.env.begin(write=True) as txn:
+            txn.delete('sequential', db=db.metadata)
+        db.append(os.urandom(8), 'some data')
+        db.close()
+        db = HammingDb(self._path, code_size=8)
+        self.assertFalse(db._sequential)
+        for i in xrange(10):
+            db.append(os.urandom(8), str(i))
+        db._code_file.truncate(5)
+        db._catch_up_code_file()
+        self.assertEqual(11, len(db._code_file))
+        code, results = db.random_search(5)
+        self.assertEqual(5, len(list(results)))
+
+    def test_can_append_many(self):
+        db = HammingDb(self._path, code_size=8)
+        db.append_many(
+            [os.urandom(8) for _ in xrange(10)], [str(i) for i in xrange(10)])
+        self.assertEqual(10, len(db))
+        self.assertEqual(10, len(db._code_file))
+
+    def test_can_search_codes_added_with_append_many(self):
+        db = HammingDb(self._path, code_size=16)
+        texts = [
+            'Mary had a little lamb',
+            'Mary had a little dog',
+            'Permanent Midnight',
+            'Mary sad a little cog'
+        ]
+        extract_code = lambda x: self.extract_code_from_text(x, n_chunks=2)
+        db.append_many([extract_code(t) for t in texts], texts)
+        results = list(db.search(extract_code(texts[0]), 3))
+        self.assertEqual(texts[0], results[0])
+
+    def test_append_many_sets_metadata(self):
+        db = HammingDb(self._path, code_size=8)
+        db.append_many(
+            [os.urandom(8)], ['some data'], metadata=dict(timestamp='1234'))
+        self.assertEqual('1234', db.get_metadata('timestamp'))
+
+    def test_append_many_raises_when_lengths_differ(self):
+        db = HammingDb(self._path, code_size=8)
+        self.assertRaises(
+            ValueError,
+            lambda: db.append_many([os.urandom(8)] * 2, ['some data']))
+
+    def test_append_many_writes_nothing_when_a_code_has_wrong_size(self):
+        db = HammingDb(self._path, code_size=8)
+        self.assertRaises(
+            ValueError,
+            lambda: db.append_many(
+                [os.urandom(8), os.urandom(7)], ['a', 'b']))
+        self.assertEqual(0, len(db))
+        self.assertEqual(0, len(db._code_file))
+
+    def test_append_many_with_single_word_codes_from_another_instance(self):
+        db = HammingDb(self._path, code_size=8)
+        db2 = HammingDb(self._path, code_size=8)
+        codes = [os.urandom(8) for _ in xrange(10)]
+        db.append_many(codes, [str(i) for i in xrange(10)])
+        results = list(db2.search(codes[3], 1))
+        self.assertEqual('3', results[0])
+
+    def test_rerank_search_orders_by_exact_distance(self):
+        db = HammingDb(self._path, code_size=8)
+        vectors = np.random.normal(0, 1, (100, 10))
+        # every code is identical, so only the vectors can distinguish them
+        db.append_many(
+            ['a' * 8] * 100, [str(i) for i in xrange(100)], vectors=vectors)
+        query = vectors[42] + 0.001
+        results = db.rerank_search('a' * 8, query, 3, 100)
+        distances = np.linalg.norm(vectors - query, axis=1)
+        expected = [str(i) for i in np.argsort(distances)[:3]]
+        self.assertEqual(expected, results)
+
+    def test_rerank_search_supports_cosine_distance(self):
+        db = HammingDb(self._path, code_size=8)
+        vectors = np.random.normal(0, 1, (20, 10))
+        db.append_many(
+            ['a' * 8] * 20, [str(i) for i in xrange(20)], vectors=vectors)
+        results = db.rerank_search(
+            'a' * 8, vectors[7] * 10, 1, 20, distance_metric='cosine')
+        self.assertEqual(['7'], results)
+
+    def test_scored_rerank_search_returns_exact_distances(self):
+        db = HammingDb(self._path, code_size=8)
+        vectors = np.random.normal(0, 1, (20, 10))
+        db.append_many(
+            ['a' * 8] * 20, [str(i) for i in xrange(20)], vectors=vectors)
+        results = db.scored_rerank_search('a' * 8, vectors[3], 5, 20)
+        distances = np.linalg.norm(vectors - vectors[3], axis=1)
+        expected = np.sort(distances)[:5]
+        np.testing.assert_allclose(
+            expected, [d for d, _ in results], rtol=1e-5, atol=1e-5)
+        self.assertEqual('3', results[0][1])
+
+    def test_rerank_search_raises_when_vectors_are_missing(self):
+        db = HammingDb(self._path, code_size=8)
+        db.append_many(['a' * 8] * 5, [str(i) for i in xrange(5)])
+        self.assertRaises(
+            ValueError, lambda: db.rerank_search('a' * 8, np.zeros(10), 1, 5))
+
+    def test_scored_search_returns_distances_in_ascending_order(self):
+        db = HammingDb(self._path, code_size=8)
+        codes = [os.urandom(8) for _ in xrange(100)]
+        db.append_many(codes, codes)
+        query = os.urandom(8)
+        results = db.scored_search(query, 10)
+        self.assertEqual(10, len(results))
+        q = np.unpackbits(np.fromstring(query, dtype=np.uint8))
+        for distance, data in results:
+            c = np.unpackbits(np.fromstring(data, dtype=np.uint8))
+            self.assertEqual((q != c).sum(), distance)
+        distances = [d for d, _ in results]
+        self.assertEqual(sorted(distances), distances)
+
+    def test_scored_search_many_agrees_with_scored_search(self):
+        db = HammingDb(self._path, code_size=16)
+        codes = [os.urandom(16) for _ in xrange(200)]
+        db.append_many(codes, codes)
+        queries = [os.urandom(16) for _ in xrange(5)]
+        many = db.scored_search_many(queries, 7)
+        for query, results in zip(queries, many):
+            expected = db.scored_search(query, 7)
+            self.assertEqual(
+                [d for d, _ in expected], [d for d, _ in results])
+
+    def _bit_distances(self, query, codes):
+        q = np.unpackbits(np.fromstring(query, dtype=np.uint8))
+        return [
+            (q != np.unpackbits(np.fromstring(c, dtype=np.uint8))).sum()
+            for c in codes]
+
+    def test_range_search_finds_every_code_within_radius(self):
+        db = HammingDb(self._path, code_size=16)
+        codes = [os.urandom(16) for _ in xrange(500)]
+        db.append_many(codes, codes)
+        query = codes[0]
+        distances = self._bit_distances(query, codes)
+        radius = sorted(distances)[20]
+        results = db.range_search(query, radius)
+        expected = set(c for c, d in zip(codes, distances) if d <= radius)
+        self.assertEqual(expected, set(results))
+        result_distances = self._bit_distances(query, results)
+        self.assertEqual(sorted(result_distances), result_distances)
+
+    def test_range_search_with_radius_zero_finds_exact_matches(self):
+        db = HammingDb(self._path, code_size=8)
+        db.append_many(['a' * 8, 'b' * 8, 'a' * 8], ['1', '2', '3'])
+        self.assertEqual(['1', '3'], db.range_search('a' * 8, 0))
+
+    def test_range_search_stops_at_limit(self):
+        db = HammingDb(self._path, code_size=8)
+        db._tile_bytes = 8 * 10
+        db.append_many(['a' * 8] * 100, [str(i) for i in xrange(100)])
+        results = db.range_search('a' * 8, 0, limit=15)
+        self.assertEqual([str(i) for i in xrange(15)], results)
+
+    def test_range_search_returns_nothing_when_no_codes_are_close(self):
+        db = HammingDb(self._path, code_size=16)
+        db.append('\x00' * 16, 'zeros')
+        self.assertEqual([], db.range_search('\xff' * 16, 10))
+
+    def test_range_search_with_multi_index_agrees_with_scan(self):
+        db = HammingDb(self._path, code_size=16, n_substrings=8)
+        codes = [os.urandom(16) for _ in xrange(2000)]
+        db.append_many(codes, codes)
+        # ensure some codes lie close to the query
+        query = codes[7]
+        near = [
+            query[:i] + chr(ord(query[i]) ^ 1) + query[i + 1:]
+            for i in xrange(16)]
+        db.append_many(near, near)
+        scan = HammingDb(self._path, code_size=16)
+        for radius in (0, 1, 8, 20):
+            self.assertEqual(
+                set(scan.range_search(query, radius)),
+                set(db.range_search(query, radius)))
+
+    def test_range_search_raises_in_write_only_mode(self):
+        db = HammingDb(self._path, code_size=8, writeonly=True)
+        db.append('a' * 8, 'a')
+        self.assertRaises(RuntimeError, lambda: db.range_search('a' * 8, 1))
+
+    def _weighted_distances(self, projections, codes):
+        bits = np.array([
+            np.unpackbits(np.fromstring(c, dtype=np.uint8)) for c in codes])
+        disagree = (projections > 0)[None, :] != bits.astype(np.bool)
+        return (disagree * np.abs(projections)[None, :]).sum(axis=1)
+
+    def _projections(self, code):
+        bits = np.unpackbits(np.fromstring(code, dtype=np.uint8))
+        magnitudes = np.random.uniform(0.1, 1, len(bits))
+        return np.where(bits, magnitudes, -magnitudes).astype(np.float32)
+
+    def test_weighted_search_finds_nearest_codes(self):
+        db = HammingDb(self._path, code_size=16)
+        codes = [os.urandom(16) for _ in xrange(1000)]
+        db.append_many(codes, codes)
+        projections = self._projections(os.urandom(16))
+        results = list(db.weighted_search(projections, 10, sort=True))
+        distances = self._weighted_distances(projections, codes)
+        expected = np.sort(distances)[:10]
+        np.testing.assert_allclose(
+            expected,
+            self._weighted_distances(projections, results),
+            rtol=1e-4)
+
+    def test_weighted_search_with_unit_weights_agrees_with_search(self):
+        db = HammingDb(self._path, code_size=16)
+        codes = [os.urandom(16) for _ in xrange(500)]
+        db.append_many(codes, codes)
+        query = os.urandom(16)
+        projections = np.sign(self._projections(query))
+        expected = list(db.search(query, 10, sort=True))
+        results = list(db.weighted_search(projections, 10, sort=True))
+        self.assertEqual(
+            self._bit_distances(query, expected),
+            self._bit_distances(query, results))
+
+    def test_weighted_search_prefers_disagreement_on_uncertain_bits(self):
+        db = HammingDb(self._path, code_size=8)
+        query = np.zeros(64, dtype=np.uint8)
+        certain = query.copy()
+        certain[0] = 1
+        uncertain = query.copy()
+        uncertain[63] = 1
+        db.append(np.packbits(certain).tostring(), 'certain')
+        db.append(np.packbits(uncertain).tostring(), 'uncertain')
+        projections = -np.ones(64, dtype=np.float32)
+        projections[63] = -0.01
+        self.assertEqual(
+            ['uncertain', 'certain'],
+            list(db.weighted_search(projections, 2, sort=True)))
+
+    def test_scored_weighted_search_returns_ascending_distances(self):
+        db = HammingDb(self._path, code_size=16)
+        codes = [os.urandom(16) for _ in xrange(200)]
+        db.append_many(codes, codes)
+        projections = self._projections(os.urandom(16))
+        results = db.scored_weighted_search(projections, 20)
+        distances = [d for d, _ in results]
+        self.assertEqual(sorted(distances), distances)
+        np.testing.assert_allclose(
+            distances,
+            self._weighted_distances(projections, [c for _, c in results]),
+            rtol=1e-4)
+
+    def test_multithreaded_weighted_search_agrees_with_single_threaded(self):
+        db, codes = self._multithreaded_db(1000)
+        projections = self._projections(os.urandom(16))
+        expected = db.scored_weighted_search(projections, 25)
+        results = db.scored_weighted_search(
+            projections, 25, multithreaded=True)
+        self.assertEqual(expected, results)
+
+    def test_weighted_search_excludes_deleted_codes(self):
+        db = HammingDb(self._path, code_size=8, compaction_ratio=1)
+        db.append_many(['a' * 8] * 5, ['a'] * 5, key='a')
+        db.append_many(['b' * 8] * 5, ['b'] * 5, key='b')
+        db.delete('a')
+        projections = self._projections('a' * 8)
+        self.assertEqual(
+            ['b'] * 5, list(db.weighted_search(projections, 10)))
+
+    def test_weighted_search_raises_when_projections_are_wrong_size(self):
+        db = HammingDb(self._path, code_size=16)
+        db.append('a' * 16, 'a')
+        self.assertRaises(
+            ValueError,
+            lambda: list(db.weighted_search(np.ones(64), 1)))
+
+    def test_weighted_search_raises_in_write_only_mode(self):
+        db = HammingDb(self._path, code_size=8, writeonly=True)
+        db.append('a' * 8, 'a')
+        self.assertRaises(
+            RuntimeError,
+            lambda: list(db.weighted_search(np.ones(64), 1)))
+
+    def test_delete_removes_codes_from_search_results(self):
+        db = HammingDb(self._path, code_size=8)
+        db.append_many(['a' * 8] * 3, ['a1', 'a2', 'a3'], key='a')
+        db.append_many(['b' * 8] * 2, ['b1', 'b2'], key='b')
+        self.assertEqual(3, db.delete('a'))
+        self.assertEqual(2, len(db))
+        self.assertEqual(['b1', 'b2'], sorted(db.search('a' * 8, 10)))
+
+    def test_delete_returns_zero_for_unknown_key(self):
+        db = HammingDb(self._path, code_size=8)
+        db.append_many(['a' * 8], ['a1'], key='a')
+        self.assertEqual(0, db.delete('z'))
+        self.assertEqual(1, len(db))
+
+    def test_delete_removes_metadata_keys_in_the_same_transaction(self):
+        db = HammingDb(self._path, code_size=8)
+        db.append_many(['a' * 8], ['a1'], metadata={'doc:a': 'a'}, key='a')
+        db.append_many(['b' * 8], ['b1'], metadata={'doc:b': 'b'}, key='b')
+        db.delete('a', metadata_keys=['doc:a'])
+        self.assertIsNone(db.get_metadata('doc:a'))
+        self.assertEqual('b', db.get_metadata('doc:b'))
+
+    def test_deleted_codes_are_excluded_from_nearest_slots(self):
+        db = HammingDb(self._path, code_size=8, compaction_ratio=1)
+        db.append_many(['a' * 8] * 10, ['a'] * 10, key='a')
+        db.append_many(['b' * 8] * 10, ['b'] * 10, key='b')
+        db.delete('a')
+        self.assertEqual(['b'] * 5, list(db.search('a' * 8, 5)))
+        self.assertEqual(['b'] * 5, list(db.search('a' * 8, 5, sort=True)))
+        self.assertEqual([['b'] * 5], db.search_many(['a' * 8], 5))
+        self.assertEqual([], db.range_search('a' * 8, 0))
+
+    def _db_with_deleted_codes(self, **kwargs):
+        db = HammingDb(
+            self._path, code_size=8, compaction_ratio=1, **kwargs)
+        dead = [os.urandom(8) for _ in xrange(3000)]
+        live = [os.urandom(8) for _ in xrange(2000)]
+        db.append_many(dead, ['dead'] * len(dead), key='dead')
+        db.append_many(live, live, key='live')
+        db.delete('dead')
+        return db, live
+
+    def _assert_nearest_live_codes(self, query, live, results):
+        expected = sorted(
+            packed_hamming_distance(
+                np.frombuffer(query, dtype=np.uint64),
+                np.frombuffer(''.join(live), dtype=np.uint64)[..., None]))
+        actual = sorted(
+            packed_hamming_distance(
+                np.frombuffer(query, dtype=np.uint64),
+                np.frombuffer(''.join(results), dtype=np.uint64)[..., None]))
+        self.assertEqual(expected[:len(actual)], actual)
+
+    def test_search_many_skips_deleted_codes(self):
+        db, live = self._db_with_deleted_codes()
+        queries = [os.urandom(8) for _ in xrange(5)]
+        for query, results in zip(queries, db.search_many(queries, 10)):
+            self.assertEqual(10, len(results))
+            self._assert_nearest_live_codes(query, live, results)
+
+    def test_multi_index_search_skips_deleted_codes(self):
+        db, live = self._db_with_deleted_codes(n_substrings=4)
+        for query in [os.urandom(8) for _ in xrange(5)]:
+            results = list(db.search(query, 10))
+            self.assertEqual(10, len(results))
+            self._assert_nearest_live_codes(query, live, results)
+            results = db.search_many([query], 10)[0]
+            self.assertEqual(10, len(results))
+            self._assert_nearest_live_codes(query, live, results)
+
+    def test_deletes_are_seen_by_another_instance(self):
+        db = HammingDb(self._path, code_size=8, compaction_ratio=1)
+        db.append_many(['a' * 8] * 3, ['a1', 'a2', 'a3'], key='a')
+        db.append_many(['b' * 8] * 2, ['b1', 'b2'], key='b')
+        reader = HammingDb(self._path, code_size=8)
+        self.assertEqual(5, len(list(reader.search('a' * 8, 10))))
+        db.delete('b')
+        self.assertEqual(
+            ['a1', 'a2', 'a3'], sorted(reader.search('a' * 8, 10)))
+
+    def test_append_with_existing_key_replaces_codes(self):
+        db = HammingDb(self._path, code_size=8, compaction_ratio=1)
+        db.append_many(['a' * 8] * 3, ['old'] * 3, key='doc')
+        db.append_many(['a' * 8] * 2, ['new'] * 2, key='doc')
+        self.assertEqual(2, len(db))
+        self.assertEqual(['new', 'new'], list(db.search('a' * 8, 10)))
+
+    def test_delete_removes_vectors(self):
+        db = HammingDb(self._path, code_size=8, compaction_ratio=1)
+        db.append_many(
+            ['a' * 8] * 2, ['a1', 'a2'], vectors=np.ones((2, 4)), key='a')
+        db.append_many(
+            ['a' * 8] * 2, ['b1', 'b2'], vectors=np.zeros((2, 4)), key='b')
+        db.delete('a')
+        self.assertEqual(
+            ['b1', 'b2'],
+            sorted(db.rerank_search('a' * 8, np.ones(4), 4, 4)))
+
+    def test_compact_removes_dead_records_from_code_file(self):
+        db = HammingDb(self._path, code_size=8, compaction_ratio=1)
+        db.append_many([os.urandom(8) for _ in xrange(10)], ['a'] * 10, key='a')
+        codes = [os.urandom(8) for _ in xrange(5)]
+        db.append_many(codes, codes, key='b')
+        db.delete('a')
+        self.assertEqual(15, len(db._code_file))
+        db.compact()
+        self.assertEqual(5, len(db._code_file))
+        for code in codes:
+            self.assertEqual(code, list(db.search(code, 1))[0])
+
+    def test_compaction_is_seen_by_another_instance(self):
+        db = HammingDb(self._path, code_size=8, compaction_ratio=1)
+        reader = HammingDb(self._path, code_size=8)
+        db.append_many(['a' * 8] * 10, ['a'] * 10, key='a')
+        db.append_many(['b' * 8] * 10, ['b'] * 10, key='b')
+        self.assertEqual(20, len(list(reader.search('b' * 8, 20))))
+        db.delete('b')
+        db.compact()
+        db.append_many(['c' * 8] * 15, ['c'] * 15, key='c')
+        results = list(reader.search('b' * 8, 30))
+        self.assertEqual(25, len(results))
+        self.assertEqual(set(['a', 'c']), set(results))
+        self.assertEqual(25, reader._codes.logical_size)
+
+    def test_compaction_with_multi_index_rebuilds_tables(self):
+        db = HammingDb(self._path, code_size=8, compaction_ratio=1)
+        reader = HammingDb(self._path, code_size=8, n_substrings=4)
+        codes = [os.urandom(8) for _ in xrange(2000)]
+        db.append_many(codes[:1000], codes[:1000], key='first')
+        db.append_many(codes[1000:], codes[1000:], key='second')
+        self.assertEqual(codes[1500], list(reader.search(codes[1500], 1))[0])
+        db.delete('first')
+        db.compact()
+        self.assertEqual(codes[1500], list(reader.search(codes[1500], 1))[0])
+        self.assertEqual(1000, len(reader._multi_index))
+
+    def test_compaction_runs_in_background_when_many_codes_are_dead(self):
+        db = HammingDb(self._path, code_size=8, compaction_ratio=0.5)
+        db.append_many(['a' * 8] * 10, ['a'] * 10, key='a')
+        db.append_many(['b' * 8] * 5, ['b'] * 5, key='b')
+        db.delete('b')
+        self.assertIsNone(db._compaction)
+        db.delete('a')
+        db._compaction.wait()
+        self.assertEqual(0, len(db._code_file))
+
+    def test_can_search_while_compaction_is_in_progress(self):
+        db = HammingDb(self._path, code_size=8, compaction_ratio=1)
+        dead = [os.urandom(8) for _ in xrange(20000)]
+        db.append_many(dead, ['dead'] * len(dead), key='dead')
+        live = [os.urandom(8) for _ in xrange(2000)]
+        db.append_many(live, live, key='live')
+        db.delete('dead')
+        live_set = set(live)
+
+        compaction = db._pool.apply_async(db.compact, (100,))
+        n_searches = 0
+        while not compaction.ready() or not n_searches:
+            query = live[n_searches % len(live)]
+            results = list(db.search(query, 10, sort=True))
+            self.assertEqual(10, len(results))
+            self.assertEqual(query, results[0])
+            self.assertTrue(live_set.issuperset(results))
+            self.assertIn(db._random_code(), live_set)
+            n_searches += 1
+
+        compaction.get()
+        self.assertEqual(len(live), len(db._code_file))
+        self.assertEqual(live[0], list(db.search(live[0], 1))[0])
+        self.assertEqual(len(live), db._codes.logical_size)
+
+    def _compact_before_mapping(self, reader, writer, n_appended):
+        # simulate a compaction (and, optionally, further appends) completing
+        # after the reader's transaction has begun, but before it maps the
+        # code file
+        map_codes = reader._codes.map
+
+        def racing_map(size):
+            reader._codes.map = map_codes
+            writer.compact()
+            if n_appended:
+                writer.append_many(
+                    ['c' * 8] * n_appended, ['c'] * n_appended, key='c')
+            return map_codes(size)
+
+        reader._codes.map = racing_map
+
+    def test_remaps_when_compaction_shrinks_file_before_mapping(self):
+        db = HammingDb(self._path, code_size=8, compaction_ratio=1)
+        reader = HammingDb(self._path, code_size=8)
+        db.append_many(['a' * 8] * 10, ['a'] * 10, key='a')
+        db.append_many(['b' * 8] * 10, ['b'] * 10, key='b')
+        db.delete('b')
+        self._compact_before_mapping(reader, db, 0)
+        self.assertEqual(['a'] * 10, list(reader.search('b' * 8, 30)))
+        self.assertEqual(10, reader._codes.logical_size)
+
+    def test_remaps_when_compacted_file_is_long_enough_to_map(self):
+        db = HammingDb(self._path, code_size=8, compaction_ratio=1)
+        reader = HammingDb(self._path, code_size=8)
+        db.append_many(['a' * 8] * 10, ['a'] * 10, key='a')
+        db.append_many(['b' * 8] * 10, ['b'] * 10, key='b')
+        db.delete('b')
+        self._compact_before_mapping(reader, db, 15)
+        results = list(reader.search('b' * 8, 30))
+        self.assertEqual(['a'] * 10 + ['c'] * 15, sorted(results))
+        self.assertEqual(25, reader._codes.logical_size)
+
+    def test_code_file_is_rebuilt_when_deleted_records_are_missing(self):
+        db = HammingDb(self._path, code_size=8, compaction_ratio=1)
+        db.append_many(['a' * 8] * 3, ['a'] * 3, key='a')
+        db.append_many(['b' * 8] * 3, ['b'] * 3, key='b')
+        db.delete('b')
+        os.remove(os.path.join(self._path, 'codes.dat'))
+        db2 = HammingDb(self._path, code_size=8)
+        self.assertEqual(3, len(db2._code_file))
+        self.assertEqual(['a'] * 3, list(db2.search('a' * 8, 10)))
+
+    def test_can_delete_with_unicode_key(self):
+        db = HammingDb(self._path, code_size=8)
+        db.append_many(['a' * 8] * 2, ['a1', 'a2'], key=u'doc')
+        self.assertEqual(2, db.delete(u'doc'))
+        self.assertEqual(0, len(db))
+
+    def test_random_code_is_one_of_the_stored_codes(self):
+        db = HammingDb(self._path, code_size=8)
+        codes = [os.urandom(8) for _ in xrange(20)]
+        db.append_many(codes, codes)
+        for _ in xrange(10):
+            self.assertIn(db._random_code(), codes)
+
+    def test_random_code_is_uniformly_distributed(self):
+        db = HammingDb(self._path, code_size=16)
+        codes = [chr(i) * 16 for i in xrange(4)]
+        db.append_many(codes, codes)
+        counts = dict((code, 0) for code in codes)
+        for _ in xrange(4000):
+            counts[db._random_code()] += 1
+        for count in counts.itervalues():
+            self.assertGreater(count, 800)
+
+    def test_random_code_never_selects_deleted_codes(self):
+        db = HammingDb(self._path, code_size=8, compaction_ratio=1)
+        db.append_many(['a' * 8] * 10, ['a'] * 10, key='a')
+        db.append_many(['b' * 8] * 2, ['b'] * 2, key='b')
+        db.delete('a')
+        for _ in xrange(20):
+            self.assertEqual('b' * 8, db._random_code())
+
+    def test_random_search_raises_for_empty_database(self):
+        db = HammingDb(self._path, code_size=8)
+        self.assertRaises(ValueError, lambda: db.random_search(10))
+
+    def test_random_search_raises_in_write_only_mode(self):
+        db = HammingDb(self._path, code_size=8, writeonly=True)
+        db.append('a' * 8, 'a')
+        self.assertRaises(RuntimeError, lambda: db.random_search(10))
+
+    def test_version_changes_when_codes_are_appended(self):
+        db = HammingDb(self._path, code_size=8)
+        version = db.version
+        self.assertEqual(version, db.version)
+        db.append('a' * 8, 'a')
+        self.assertNotEqual(version, db.version)
+
+    def test_version_changes_when_another_instance_writes(self):
+        db = HammingDb(self._path, code_size=8)
+        version = db.version
+        HammingDb(self._path, code_size=8).append('a' * 8, 'a')
+        self.assertNotEqual(version, db.version)
+
+    def _multithreaded_db(self, n_codes, code_size=16):
+        db = HammingDb(self._path, code_size=code_size, compaction_ratio=1)
+        db._thread_count = 3
+        # force several tiles per thread
+        db._tile_bytes = code_size * 50
+        codes = [os.urandom(code_size) for _ in xrange(n_codes)]
+        db.append_many(codes, codes)
+        return db, codes
+
+    def test_multithreaded_search_agrees_with_single_threaded_search(self):
+        db, codes = self._multithreaded_db(1000)
+        query = os.urandom(16)
+        expected = list(db.search(query, 25, sort=True))
+        results = list(db.search(query, 25, multithreaded=True, sort=True))
+        self.assertEqual(
+            self._bit_distances(query, expected),
+            self._bit_distances(query, results))
+
+    def test_multithreaded_unsorted_search_finds_nearest_codes(self):
+        db, codes = self._multithreaded_db(1000)
+        query = os.urandom(16)
+        expected = list(db.search(query, 10, sort=True))
+        results = list(db.search(query, 10, multithreaded=True))
+        self.assertEqual(
+            self._bit_distances(query, expected),
+            sorted(self._bit_distances(query, results)))
+
+    def test_multithreaded_search_returns_all_codes_when_n_results_is_large(
+            self):
+        db, codes = self._multithreaded_db(20)
+        results = list(db.search(codes[0], 50, multithreaded=True))
+        self.assertEqual(set(codes), set(results))
+
+    def test_multithreaded_search_excludes_deleted_codes(self):
+        db = HammingDb(self._path, code_size=8, compaction_ratio=1)
+        db._thread_count = 2
+        db._tile_bytes = 8 * 4
+        db.append_many(['a' * 8] * 20, ['a'] * 20, key='a')
+        db.append_many(['b' * 8] * 20, ['b'] * 20, key='b')
+        db.delete('a')
+        self.assertEqual(
+            ['b'] * 5, list(db.search('a' * 8, 5, multithreaded=True)))
+
+    def test_multithreaded_search_over_empty_database(self):
+        db = HammingDb(self._path, code_size=8)
+        self.assertEqual(
+            [], list(db.search('a' * 8, 5, multithreaded=True)))
@@ -1,5 +1,6 @@
 import unittest2
-from index import HammingIndex
+from index import HammingIndex, _doc_key
+from sharded import ShardedHammingIndex
 from featureflow import \
     PersistenceSettings, UuidProvider, StringDelimitedKeyBuilder, \
     InMemoryDatabase, InMemoryChannel, EventLog
@@ -115,6 +116,298 @@ class HammingIndexTests(unittest2.TestCase):
         results = index.search(encoded, 5)
         self.assertEqual(5, len(list(results)))
 
+    def test_can_search_with_multi_index_hashing(self):
+        Model = self._model(
+            slice_size=128,
+            settings=self._settings_with_event_log())
+
+        index = self._index(Model, Model.sliced, n_substrings=4)
+        signal = SineSynthesizer(SR11025()) \
+            .synthesize(Seconds(5), [220, 440, 880])
+        Model.process(meta=signal.encode())
+        index._synchronously_process_events()
+
+        results = index.random_search(n_results=5)
+        results = index.search(results.query, 5)
+        self.assertEqual(5, len(list(results)))
+
+    def test_can_search_many(self):
+        Model = self._model(
+            slice_size=128,
+            settings=self._settings_with_event_log())
+
+        index = self._index(Model, Model.sliced)
+        signal = SineSynthesizer(SR11025()) \
+            .synthesize(Seconds(5), [220, 440, 880])
+        _id = Model.process(meta=signal.encode())
+        index._synchronously_process_events()
+
+        queries = Model(_id).sliced[:3]
+        results = index.search_many(queries, 5)
+        self.assertEqual(3, len(results))
+        for result in results:
+            self.assertEqual(5, len(list(result)))
+
+    def test_can_range_search(self):
+        Model = self._model(
+            slice_size=128,
+            settings=self._settings_with_event_log())
+
+        index = self._index(Model, Model.sliced)
+        signal = SineSynthesizer(SR11025()) \
+            .synthesize(Seconds(5), [220, 440, 880])
+        _id = Model.process(meta=signal.encode())
+        index._synchronously_process_events()
+
+        query = Model(_id).sliced[0]
+        results = list(index.range_search(query, 0))
+        self.assertGreater(len(results), 0)
+        for result_id, ts in results:
+            self.assertEqual(_id, result_id)
+            np.testing.assert_array_equal(query, Model(_id).sliced[ts][0])
+
+        limited = list(index.range_search(query, 128, limit=3))
+        self.assertEqual(3, len(limited))
+
+    def test_can_weighted_search(self):
+        Model = self._model(
+            slice_size=128,
+            settings=self._settings_with_event_log())
+
+        index = self._index(Model, Model.sliced)
+        signal = SineSynthesizer(SR11025()) \
+            .synthesize(Seconds(5), [220, 440, 880])
+        _id = Model.process(meta=signal.encode())
+        index._synchronously_process_events()
+
+        query = np.asarray(Model(_id).sliced[0])
+        projections = np.where(query, 1., -1.)
+        results = index.weighted_search(projections, 5, sort=True)
+        self.assertEqual(index.encode_query(query), results.query)
+        results = list(results)
+        self.assertEqual(5, len(results))
+        result_id, ts = results[0]
+        np.testing.assert_array_equal(query, Model(_id).sliced[ts][0])
+
+    def test_can_remove_document(self):
+        Model = self._model(
+            slice_size=128,
+            settings=self._settings_with_event_log())
+
+        index = self._index(Model, Model.sliced)
+        signal = SineSynthesizer(SR11025()) \
+            .synthesize(Seconds(5), [220, 440, 880])
+        _id1 = Model.process(meta=signal.encode())
+        _id2 = Model.process(meta=signal.encode())
+        index._synchronously_process_events()
+        n_frames = len(index) // 2
+
+        self.assertEqual(n_frames, index.remove_document(_id1))
+        self.assertEqual(n_frames, len(index))
+        results = index.search(Model(_id2).sliced[0], n_frames * 2)
+        self.assertEqual(set([_id2]), set(r[0] for r in results))
+
+    def test_remove_document_deletes_its_interned_id(self):
+        Model = self._model(
+            slice_size=128,
+            settings=self._settings_with_event_log())
+
+        index = self._index(Model, Model.sliced, binary_records=True)
+        signal = SineSynthesizer(SR11025()) \
+            .synthesize(Seconds(5), [220, 440, 880])
+        _id1 = Model.process(meta=signal.encode())
+        _id2 = Model.process(meta=signal.encode())
+        index._synchronously_process_events()
+
+        index.remove_document(_id1)
+        db = index.hamming_db
+        self.assertIsNone(db.get_metadata(_doc_key(index._doc_ref(_id1))))
+        self.assertEqual(_id2, db.get_metadata(_doc_key(index._doc_ref(_id2))))
+        results = index.search(Model(_id2).sliced[0], len(index))
+        self.assertEqual(set([_id2]), set(r[0] for r in results))
+
+    def test_remove_document_returns_zero_before_anything_is_indexed(self):
+        Model = self._model(
+            slice_size=128,
+            settings=self._settings_with_event_log())
+
+        index = self._index(Model, Model.sliced)
+        self.assertEqual(0, index.remove_document('nothing'))
+
+    def test_reprocessed_document_replaces_its_codes(self):
+        Model = self._model(
+            slice_size=128,
+            settings=self._settings_with_event_log())
+
+        index = self._index(Model, Model.sliced)
+        signal = SineSynthesizer(SR11025()) \
+            .synthesize(Seconds(5), [220, 440, 880])
+        _id = Model.process(meta=signal.encode())
+        index._synchronously_process_events()
+        n_frames = len(index)
+        index.add(_id)
+        self.assertEqual(n_frames, len(index))
+
+    def test_encode_codes_agrees_with_encode_query(self):
+        Model = self._model(
+            slice_size=128,
+            settings=self._settings_with_event_log())
+        index = self._index(Model, Model.sliced)
+        bits = np.random.binomial(1, 0.5, (10, 128)).astype(np.bool)
+        packed = np.random.randint(0, 2 ** 62, (10, 2)).astype(np.uint64)
+        for frames in (bits, bits.astype(np.uint8), packed):
+            self.assertEqual(
+                [index.encode_query(frame) for frame in frames],
+                index._encode_codes(frames))
+
+    def test_repeated_search_is_served_from_cache(self):
+        Model = self._model(
+            slice_size=128,
+            settings=self._settings_with_event_log())
+
+        index = self._index(Model, Model.sliced, cache_size=10)
+        _ids = self._process_documents(Model, 1)
+        index.add_all()
+
+        query = Model(_ids[0]).sliced[0]
+        first = list(index.search(query, 5, sort=True))
+        second = list(index.search(query, 5, sort=True))
+        self.assertEqual(first, second)
+        self.assertEqual(1, index.cache.hits)
+        self.assertEqual(1, index.cache.misses)
+
+        index.search(query, 6, sort=True)
+        self.assertEqual(2, index.cache.misses)
+
+    def test_cache_is_invalidated_when_index_changes(self):
+        Model = self._model(
+            slice_size=128,
+            settings=self._settings_with_event_log())
+
+        index = self._index(Model, Model.sliced, cache_size=10)
+        _ids = self._process_documents(Model, 2)
+        index.add(_ids[0])
+
+        query = Model(_ids[0]).sliced[0]
+        n_results = 2 * len(index)
+        self.assertEqual(len(index), len(list(index.search(query, n_results))))
+        index.add(_ids[1])
+        self.assertEqual(len(index), len(list(index.search(query, n_results))))
+        self.assertEqual(0, index.cache.hits)
+
+    def _process_documents(self, Model, n_documents):
+        signal = SineSynthesizer(SR11025()) \
+            .synthesize(Seconds(2), [220, 440, 880])
+        for _ in xrange(n_documents):
+            Model.process(meta=signal.encode())
+        return [doc._id for doc in Model]
+
+    def test_add_all_indexes_every_document(self):
+        Model = self._model(
+            slice_size=128,
+            settings=self._settings_with_event_log())
+
+        _ids = self._process_documents(Model, 3)
+        index = self._index(Model, Model.sliced)
+        index.add_all()
+        n_frames = len(Model(_ids[0]).sliced)
+        self.assertEqual(3 * n_frames, len(index))
+        self.assertEqual('', index.hamming_db.get_metadata(
+            'addall.checkpoint'))
+
+    def test_add_all_with_multiple_processes_agrees_with_serial(self):
+        Model = self._model(
+            slice_size=128,
+            settings=self._settings_with_event_log())
+
+        _ids = self._process_documents(Model, 4)
+        index = self._index(Model, Model.sliced)
+        index.add_all()
+
+        path = self.hamming_db_path + '.parallel'
+        self.addCleanup(shutil.rmtree, path, ignore_errors=True)
+        parallel = HammingIndex(
+            Model,
+            Model.sliced,
+            path=path,
+            web_url=lambda doc, ts: doc._id)
+        parallel.add_all(multi_process=True, cores=2)
+
+        self.assertEqual(len(index), len(parallel))
+        query = Model(_ids[2]).sliced[3]
+        expected = sorted(
+            (r[0], r[1].start) for r in index.search(query, len(index)))
+        results = list(parallel.search(query, len(index)))
+        self.assertEqual(expected, sorted((r[0], r[1].start) for r in results))
+        self.assertTrue(all(r[0] == r[2]['web_url'] for r in results))
+
+    def test_add_all_resumes_after_checkpoint(self):
+        Model = self._model(
+            slice_size=128,
+            settings=self._settings_with_event_log())
+
+        _ids = self._process_documents(Model, 3)
+        index = self._index(Model, Model.sliced)
+        index.add(_ids[0])
+        index.hamming_db.set_metadata(
+            'addall.checkpoint', '{i:016x}:{_id}'.format(i=1, _id=_ids[1]))
+        index.add_all()
+
+        n_frames = len(Model(_ids[0]).sliced)
+        self.assertEqual(2 * n_frames, len(index))
+        found = set(r[0] for r in index.search(
+            Model(_ids[0]).sliced[0], len(index)))
+        self.assertEqual(set([_ids[0], _ids[2]]), found)
+
+    def test_add_all_can_ignore_checkpoint(self):
+        Model = self._model(
+            slice_size=128,
+            settings=self._settings_with_event_log())
+
+        _ids = self._process_documents(Model, 3)
+        index = self._index(Model, Model.sliced)
+        index.add(_ids[0])
+        index.hamming_db.set_metadata(
+            'addall.checkpoint', '{i:016x}:{_id}'.format(i=2, _id=_ids[2]))
+        index.add_all(resume=False)
+        n_frames = len(Model(_ids[0]).sliced)
+        self.assertEqual(3 * n_frames, len(index))
+
+    def test_sharded_index_search_agrees_with_unsharded_index(self):
+        Model = self._model(
+            slice_size=128,
+            settings=self._settings_with_event_log())
+
+        index = self._index(Model, Model.sliced)
+        path = self.hamming_db_path + '.sharded'
+        self.addCleanup(shutil.rmtree, path, ignore_errors=True)
+        sharded = ShardedHammingIndex(
+            Model,
+            Model.sliced,
+            n_shards=2,
+            path=path)
+        self.addCleanup(sharded.close)
+
+        signal = SineSynthesizer(SR11025()) \
+            .synthesize(Seconds(5), [220, 440, 880])
+        for _ in xrange(3):
+            _id = Model.process(meta=signal.encode())
+        index._synchronously_process_events()
+        sharded._synchronously_process_events()
+        self.assertEqual(len(index), len(sharded))
+
+        query = Model(_id).sliced[0]
+        expected = list(index.search(query, 5, sort=True))
+        results = list(sharded.search(query, 5))
+        self.assertEqual(5, len(results))
+
+        def distances(results):
+            return sorted(
+                (np.asarray(Model(r[0]).sliced[r[1]])[0] != query).sum()
+                for r in results)
+
+        self.assertEqual(distances(expected), distances(results))
+
     def test_can_add_additional_data_to_index(self):
         Model = self._model(
             slice_size=128,
@@ -160,6 +453,82 @@ class HammingIndexTests(unittest2.TestCase):
         self.assertEqual('https://example.com', extra_data['web_url'])
         self.assertAlmostEqual(5, extra_data['total_duration'], 1)
 
+    def test_binary_records_agree_with_json_records(self):
+        Model = self._model(
+            slice_size=128,
+            settings=self._settings_with_event_log())
+
+        index = self._index(Model, Model.sliced)
+        path = self.hamming_db_path + '.binary'
+        self.addCleanup(shutil.rmtree, path, ignore_errors=True)
+        binary = HammingIndex(
+            Model,
+            Model.sliced,
+            path=path,
+            binary_records=True)
+
+        signal = SineSynthesizer(SR11025()) \
+            .synthesize(Seconds(5), [220, 440, 880])
+        _id = Model.process(meta=signal.encode())
+        index._synchronously_process_events()
+        binary._synchronously_process_events()
+
+        code = list(index.random_search(n_results=1)).pop()
+        query = Model(_id).sliced[code[1]][0]
+        n_results = len(index)
+        expected = sorted(
+            (r[0], r[1].start, r[1].duration)
+            for r in index.search(query, n_results))
+        results = sorted(
+            (r[0], r[1].start, r[1].duration)
+            for r in binary.search(query, n_results))
+        self.assertEqual(expected, results)
+        self.assertEqual('binary', binary.hamming_db.get_metadata('recordformat'))
+
+    def test_binary_records_support_additional_data(self):
+        Model = self._model(
+            slice_size=128,
+            settings=self._settings_with_event_log())
+
+        index = self._index(
+            Model,
+            Model.sliced,
+            binary_records=True,
+            web_url=lambda doc, ts: doc.meta['web_url'])
+
+        signal = SineSynthesizer(SR11025()) \
+            .synthesize(Seconds(5), [220, 440, 880])
+        meta = AudioMetaData(uri=signal.encode(), web_url='https://example.com')
+        _id = Model.process(meta=meta)
+        index._synchronously_process_events()
+
+        results = list(index.random_search(n_results=5))
+        self.assertEqual(5, len(results))
+        result_id, ts, extra_data = results[0]
+        self.assertEqual(_id, result_id)
+        self.assertEqual('https://example.com', extra_data['web_url'])
+
+        results = index.search_many([Model(_id).sliced[0]], 3)
+        self.assertEqual(3, len(list(results[0])))
+
+    def test_existing_record_format_takes_precedence(self):
+        Model = self._model(
+            slice_size=128,
+            settings=self._settings_with_event_log())
+
+        index = self._index(Model, Model.sliced)
+        signal = SineSynthesizer(SR11025()) \
+            .synthesize(Seconds(5), [220, 440, 880])
+        Model.process(meta=signal.encode())
+        index._synchronously_process_events()
+
+        index2 = self._index(Model, Model.sliced, binary_records=True)
+        Model.process(meta=signal.encode())
+        index2._synchronously_process_events()
+        results = list(index2.random_search(n_results=len(index2)))
+        self.assertEqual(len(index2), len(results))
+        self.assertIsNone(index2.hamming_db.get_metadata('recordformat'))
+
     def correctly_infers_index_name(self):
         Model = self._model(
             slice_size=128,
@@ -185,6 +554,40 @@ class HammingIndexTests(unittest2.TestCase):
         index.add(_id)
         self.assertEqual(len(model.packed), len(index))
 
+    def test_add_records_timestamp(self):
+        Model = self._model(
+            slice_size=128,
+            settings=self._settings_with_no_event_log())
+
+        index = self._index(Model, Model.sliced)
+        signal = SineSynthesizer(SR11025()) \
+            .synthesize(Seconds(5), [220, 440, 880])
+        _id = Model.process(meta=signal.encode())
+        index.add(_id, timestamp='1234')
+        self.assertEqual('1234', index.hamming_db.get_metadata('timestamp'))
+        self.assertEqual(len(Model(_id).sliced), len(index))
+
+    def test_can_rerank_search_results_with_float_feature(self):
+        Model = self._model(
+            slice_size=128,
+            settings=self._settings_with_no_event_log())
+
+        index = self._index(Model, Model.sliced, rerank_feature=Model.fft)
+        index.rerank_factor = 1000
+        signal = SineSynthesizer(SR11025()) \
+            .synthesize(Seconds(5), [220, 440, 880])
+        _id = Model.process(meta=signal.encode())
+        index.add(_id)
+
+        doc = Model(_id)
+        results = list(index.search(
+            doc.sliced[10], n_results=5, query_vector=doc.fft[10]))
+        self.assertEqual(5, len(results))
+        result_id, ts = results[0]
+        self.assertEqual(_id, result_id)
+        frame = int(ts.start / doc.fft.dimensions[0].frequency)
+        np.testing.assert_allclose(doc.fft[10], doc.fft[frame])
+
     def _settings_with_no_event_log(self):
         class Settings(PersistenceSettings):
             id_provider = UuidProvider()
@@ -231,9 +634,22 @@ class HammingIndexTests(unittest2.TestCase):
 
         return Model
 
-    def _index(self, document, feature, **extra_data):
+    def _index(
+            self,
+            document,
+            feature,
+            n_substrings=None,
+            rerank_feature=None,
+            binary_records=False,
+            cache_size=0,
+            **extra_data):
+
         return HammingIndex(
             document,
             feature,
             path=self.hamming_db_path,
+            n_substrings=n_substrings,
+            rerank_feature=rerank_feature,
+            binary_records=binary_records,
+            cache_size=cache_size,
             **extra_data)
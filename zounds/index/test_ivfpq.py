@@ -0,0 +1,102 @@
+import unittest2
+import numpy as np
+import os
+from uuid import uuid4
+from ivfpq import IVFPQSearch
+from zounds.core import ArrayWithUnits, IdentityDimension
+from zounds.timeseries import TimeDimension, Seconds
+
+
+class IVFPQSearchTests(unittest2.TestCase):
+    def setUp(self):
+        self._path = '/tmp/{path}'.format(path=uuid4().hex)
+
+    def tearDown(self):
+        try:
+            os.remove(self._path)
+        except OSError:
+            pass
+
+    def _feature(self, n_frames, dim):
+        # features are drawn from a small number of well-separated clusters
+        centers = np.random.normal(0, 10, (8, dim))
+        data = centers[np.random.randint(0, len(centers), n_frames)] \
+               + np.random.normal(0, 0.1, (n_frames, dim))
+        return ArrayWithUnits(
+            data.astype(np.float32),
+            [TimeDimension(Seconds(1)), IdentityDimension()])
+
+    def _gen(self, n_docs=5, n_frames=200, dim=16):
+        return [
+            ('doc{i}'.format(i=i), self._feature(n_frames, dim))
+            for i in xrange(n_docs)]
+
+    def _index(self, gen, **kwargs):
+        defaults = dict(n_centroids=16, n_subquantizers=4, nprobe=4)
+        defaults.update(kwargs)
+        return IVFPQSearch(gen, **defaults)
+
+    def test_raises_when_n_bits_is_too_large(self):
+        self.assertRaises(ValueError, lambda: IVFPQSearch(n_bits=9))
+
+    def test_raises_for_unsupported_distance_metric(self):
+        self.assertRaises(
+            ValueError, lambda: IVFPQSearch(distance_metric='manhattan'))
+
+    def test_raises_when_subquantizers_do_not_divide_dimension(self):
+        self.assertRaises(
+            ValueError,
+            lambda: self._index(self._gen(dim=15), n_subquantizers=4))
+
+    def test_cannot_add_before_training(self):
+        index = IVFPQSearch()
+        self.assertRaises(RuntimeError, lambda: index.add(self._gen()))
+
+    def test_contains_every_frame(self):
+        index = self._index(self._gen(n_docs=3, n_frames=100))
+        self.assertEqual(300, len(index))
+
+    def test_search_returns_correct_number_of_results(self):
+        index = self._index(self._gen())
+        results = list(index.search(np.zeros(16), n_results=10))
+        self.assertEqual(10, len(results))
+
+    def test_search_results_are_ids_and_time_slices(self):
+        index = self._index(self._gen())
+        _id, ts = list(index.random_search(n_results=5))[0]
+        self.assertTrue(_id.startswith('doc'))
+        self.assertEqual(Seconds(1), ts.duration)
+
+    def test_finds_exact_match(self):
+        gen = [
+            ('doc{i}'.format(i=i), ArrayWithUnits(
+                np.random.normal(0, 1, (200, 16)).astype(np.float32),
+                [TimeDimension(Seconds(1)), IdentityDimension()]))
+            for i in xrange(5)]
+        index = self._index(gen, nprobe=16)
+        _id, feature = gen[2]
+        results = list(index.search(feature[17], n_results=10))
+        self.assertIn(
+            (_id, 17),
+            [(r[0], int(r[1].start / Seconds(1))) for r in results])
+
+    def test_can_search_with_cosine_distance(self):
+        index = self._index(self._gen(), distance_metric='cosine')
+        results = list(index.random_search(n_results=10))
+        self.assertEqual(10, len(results))
+
+    def test_larger_nprobe_returns_at_least_as_many_candidates(self):
+        index = self._index(self._gen(n_docs=2, n_frames=50), n_centroids=32)
+        few = list(index.search(np.zeros(16), n_results=100, nprobe=1))
+        many = list(index.search(np.zeros(16), n_results=100, nprobe=32))
+        self.assertEqual(100, len(many))
+        self.assertLessEqual(len(few), len(many))
+
+    def test_can_round_trip_to_disk(self):
+        index = self._index(self._gen())
+        query = np.random.normal(0, 10, 16)
+        expected = list(index.search(query, n_results=10))
+        index.save(self._path)
+        restored = IVFPQSearch.load(self._path)
+        self.assertEqual(len(index), len(restored))
+        self.assertEqual(expected, list(restored.search(query, n_results=10)))
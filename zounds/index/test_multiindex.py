@@ -0,0 +1,128 @@
+import unittest2
+import numpy as np
+from multiindex import MultiIndex
+from zounds.nputil import packed_hamming_distance
+
+
+class MultiIndexTests(unittest2.TestCase):
+    def _codes(self, n_codes, code_size):
+        raw = np.random.randint(0, 256, (n_codes, code_size)).astype(np.uint8)
+        return raw.view(np.uint64)
+
+    def _brute_force_scores(self, query, codes, n_results):
+        scores = packed_hamming_distance(query, codes)
+        return np.sort(scores)[:n_results]
+
+    def test_raises_when_code_size_not_divisible_by_n_substrings(self):
+        self.assertRaises(ValueError, lambda: MultiIndex(8, 3))
+
+    def test_raises_when_substrings_are_wider_than_64_bits(self):
+        self.assertRaises(ValueError, lambda: MultiIndex(32, 2))
+
+    def test_raises_when_n_substrings_is_zero(self):
+        self.assertRaises(ValueError, lambda: MultiIndex(8, 0))
+
+    def test_substrings_have_correct_shape(self):
+        index = MultiIndex(16, 4)
+        keys = index.substrings(self._codes(10, 16))
+        self.assertEqual((10, 4), keys.shape)
+
+    def test_substrings_preserve_hamming_distance(self):
+        index = MultiIndex(8, 4)
+        codes = self._codes(2, 8)
+        keys = index.substrings(codes)
+        expected = packed_hamming_distance(codes[0], codes[1:])[0]
+        xored = np.bitwise_xor(keys[0], keys[1])
+        actual = sum(bin(int(x)).count('1') for x in xored)
+        self.assertEqual(expected, actual)
+
+    def test_finds_exact_match(self):
+        index = MultiIndex(8, 4)
+        codes = self._codes(5000, 8)
+        indices = index.search(codes[1234], codes, 1)
+        self.assertEqual(1234, indices[0])
+
+    def test_results_agree_with_brute_force_search(self):
+        index = MultiIndex(8, 4)
+        codes = self._codes(5000, 8)
+        for i in xrange(10):
+            query = codes[np.random.randint(0, len(codes))] ^ np.uint64(0xff)
+            indices = index.search(query, codes, 20)
+            scores = packed_hamming_distance(query, codes[indices])
+            np.testing.assert_array_equal(
+                self._brute_force_scores(query, codes, 20), scores)
+
+    def test_results_are_sorted(self):
+        index = MultiIndex(16, 4)
+        codes = self._codes(5000, 16)
+        indices = index.search(codes[0], codes, 50)
+        scores = packed_hamming_distance(codes[0], codes[indices])
+        np.testing.assert_array_equal(np.sort(scores), scores)
+
+    def test_codes_appended_after_build_are_searchable(self):
+        index = MultiIndex(8, 4)
+        codes = self._codes(5000, 8)
+        index.build(codes[:4900])
+        indices = index.search(codes[4950], codes, 1)
+        self.assertEqual(4950, indices[0])
+        self.assertEqual(4900, len(index))
+
+    def test_rebuilds_when_many_codes_are_appended(self):
+        index = MultiIndex(8, 4)
+        codes = self._codes(5000, 8)
+        index.build(codes[:100])
+        index.search(codes[0], codes, 10)
+        self.assertEqual(5000, len(index))
+
+    def test_dead_rows_are_never_returned(self):
+        index = MultiIndex(8, 4)
+        codes = self._codes(5000, 8)
+        dead = np.zeros(len(codes), dtype=np.bool)
+        dead[::3] = True
+        live = codes[~dead]
+        for i in xrange(10):
+            query = codes[i] ^ np.uint64(0xff)
+            indices = index.search(query, codes, 20, dead=dead)
+            self.assertEqual(20, len(indices))
+            self.assertFalse(dead[indices].any())
+            scores = packed_hamming_distance(query, codes[indices])
+            np.testing.assert_array_equal(
+                self._brute_force_scores(query, live, 20), scores)
+
+    def test_dead_rows_are_excluded_when_n_results_exceeds_size(self):
+        index = MultiIndex(8, 4)
+        codes = self._codes(10, 8)
+        dead = np.zeros(len(codes), dtype=np.bool)
+        dead[:4] = True
+        indices = index.search(codes[0], codes, 20, dead=dead)
+        self.assertEqual([4, 5, 6, 7, 8, 9], sorted(indices))
+
+    def test_returns_all_codes_when_n_results_exceeds_size(self):
+        index = MultiIndex(8, 4)
+        codes = self._codes(10, 8)
+        indices = index.search(codes[0], codes, 20)
+        self.assertEqual(10, len(indices))
+
+    def test_range_search_agrees_with_brute_force_search(self):
+        index = MultiIndex(8, 4)
+        codes = self._codes(5000, 8)
+        query = codes[10] ^ np.uint64(0x3)
+        scores = packed_hamming_distance(query, codes)
+        for radius in (0, 2, 7, 20):
+            indices, distances = index.range_search(query, codes, radius)
+            np.testing.assert_array_equal(
+                np.sort(np.nonzero(scores <= radius)[0]), np.sort(indices))
+            np.testing.assert_array_equal(scores[indices], distances)
+
+    def test_range_search_results_are_sorted(self):
+        index = MultiIndex(16, 8)
+        codes = self._codes(5000, 16)
+        _, distances = index.range_search(codes[0], codes, 40)
+        np.testing.assert_array_equal(np.sort(distances), distances)
+
+    def test_range_search_includes_codes_appended_after_build(self):
+        index = MultiIndex(8, 4)
+        codes = self._codes(5000, 8)
+        index.build(codes[:4900])
+        indices, _ = index.range_search(codes[4950], codes, 0)
+        self.assertIn(4950, indices)
@@ -0,0 +1,175 @@
+import unittest2
+from sharded import ShardedHammingDb
+from hammingdb import HammingDb
+from uuid import uuid4
+import shutil
+import numpy as np
+import os
+
+
+class ShardedHammingDbTests(unittest2.TestCase):
+    def setUp(self):
+        self._path = '/tmp/{path}'.format(path=uuid4().hex)
+        self._unsharded_path = '/tmp/{path}'.format(path=uuid4().hex)
+        self._dbs = []
+
+    def tearDown(self):
+        for db in self._dbs:
+            db.close()
+        shutil.rmtree(self._path, ignore_errors=True)
+        shutil.rmtree(self._unsharded_path, ignore_errors=True)
+
+    def _db(self, n_shards=3, **kwargs):
+        db = ShardedHammingDb(self._path, n_shards, **kwargs)
+        self._dbs.append(db)
+        return db
+
+    def _distances(self, query, results):
+        q = np.unpackbits(np.fromstring(query, dtype=np.uint8))
+        return [
+            (q != np.unpackbits(np.fromstring(r, dtype=np.uint8))).sum()
+            for r in results]
+
+    def test_raises_when_code_size_is_none_for_uninitialized_database(self):
+        self.assertRaises(ValueError, lambda: self._db(code_size=None))
+
+    def test_raises_when_shard_count_changes(self):
+        self._db(n_shards=3, code_size=8).close()
+        self.assertRaises(
+            ValueError, lambda: self._db(n_shards=4, code_size=None))
+
+    def test_codes_are_distributed_across_shards(self):
+        db = self._db(n_shards=3, code_size=8)
+        for i in xrange(30):
+            db.append(os.urandom(8), 'doc{i}'.format(**locals()))
+        self.assertEqual(30, len(db))
+        self.assertTrue(all(len(shard) for shard in db.shards))
+
+    def test_append_many_writes_to_a_single_shard(self):
+        db = self._db(n_shards=3, code_size=8)
+        db.append_many(
+            [os.urandom(8) for _ in xrange(10)],
+            [str(i) for i in xrange(10)],
+            key='doc')
+        self.assertEqual(
+            [0, 0, 10], sorted(len(shard) for shard in db.shards))
+
+    def test_search_agrees_with_unsharded_search(self):
+        db = self._db(n_shards=4, code_size=16)
+        unsharded = HammingDb(self._unsharded_path, code_size=16)
+        for i in xrange(50):
+            codes = [os.urandom(16) for _ in xrange(10)]
+            db.append_many(codes, codes, key=str(i))
+            unsharded.append_many(codes, codes)
+
+        query = os.urandom(16)
+        results = db.search(query, 20)
+        expected = list(unsharded.search(query, 20, sort=True))
+        self.assertEqual(20, len(results))
+        self.assertEqual(
+            self._distances(query, expected), self._distances(query, results))
+
+    def test_search_many_agrees_with_search(self):
+        db = self._db(n_shards=2, code_size=8)
+        for i in xrange(20):
+            codes = [os.urandom(8) for _ in xrange(10)]
+            db.append_many(codes, codes, key=str(i))
+
+        queries = [os.urandom(8) for _ in xrange(4)]
+        many = db.search_many(queries, 5)
+        self.assertEqual(4, len(many))
+        for query, results in zip(queries, many):
+            self.assertEqual(
+                self._distances(query, db.search(query, 5)),
+                self._distances(query, results))
+
+    def test_search_ignores_empty_shards(self):
+        db = self._db(n_shards=4, code_size=8)
+        code = os.urandom(8)
+        db.append(code, code)
+        self.assertEqual([code], db.search(code, 10))
+
+    def test_sees_data_added_by_another_instance(self):
+        db = self._db(n_shards=2, code_size=8)
+        db.search(os.urandom(8), 10)
+        writer = self._db(n_shards=2, code_size=None, writeonly=True)
+        writer.append('a' * 8, 'a')
+        self.assertEqual(['a'], db.search('a' * 8, 10))
+
+    def test_can_get_random_entry(self):
+        db = self._db(n_shards=3, code_size=8)
+        for i in xrange(30):
+            db.append(os.urandom(8), str(i))
+        code, results = db.random_search(5)
+        self.assertEqual(8, len(code))
+        self.assertEqual(5, len(results))
+
+    def test_search_raises_in_write_only_mode(self):
+        db = self._db(code_size=8, writeonly=True)
+        db.append(os.urandom(8), 'a')
+        self.assertRaises(RuntimeError, lambda: db.search(os.urandom(8), 10))
+
+    def test_worker_errors_are_raised(self):
+        db = self._db(code_size=8)
+        db.append(os.urandom(8), 'a')
+        self.assertRaises(ValueError, lambda: db.search(os.urandom(16), 10))
+
+    def test_metadata_is_greatest_value_across_shards(self):
+        db = self._db(n_shards=2, code_size=8)
+        db.shards[0].set_metadata('timestamp', '2')
+        db.shards[1].set_metadata('timestamp', '1')
+        self.assertEqual('2', db.get_metadata('timestamp'))
+
+    def test_range_search_agrees_with_unsharded_range_search(self):
+        db = self._db(n_shards=3, code_size=8)
+        unsharded = HammingDb(self._unsharded_path, code_size=8)
+        for i in xrange(30):
+            codes = [os.urandom(8) for _ in xrange(10)]
+            db.append_many(codes, codes, key=str(i))
+            unsharded.append_many(codes, codes)
+
+        query = os.urandom(8)
+        expected = unsharded.range_search(query, 28)
+        results = db.range_search(query, 28)
+        self.assertEqual(set(expected), set(results))
+        self.assertEqual(
+            self._distances(query, expected), self._distances(query, results))
+
+    def test_weighted_search_agrees_with_unsharded_weighted_search(self):
+        db = self._db(n_shards=3, code_size=8)
+        unsharded = HammingDb(self._unsharded_path, code_size=8)
+        for i in xrange(30):
+            codes = [os.urandom(8) for _ in xrange(10)]
+            db.append_many(codes, codes, key=str(i))
+            unsharded.append_many(codes, codes)
+
+        projections = np.random.normal(0, 1, 64).astype(np.float32)
+        expected = list(unsharded.weighted_search(projections, 10, sort=True))
+        results = db.weighted_search(projections, 10)
+        self.assertEqual(expected, results)
+
+    def test_rerank_search_agrees_with_unsharded_rerank_search(self):
+        db = self._db(n_shards=3, code_size=8)
+        unsharded = HammingDb(self._unsharded_path, code_size=8)
+        for i in xrange(10):
+            codes = [os.urandom(8) for _ in xrange(10)]
+            vectors = np.random.normal(0, 1, (10, 4))
+            datas = ['{i}.{j}'.format(i=i, j=j) for j in xrange(10)]
+            db.append_many(codes, datas, vectors=vectors, key=str(i))
+            unsharded.append_many(codes, datas, vectors=vectors)
+
+        query = os.urandom(8)
+        vector = np.random.normal(0, 1, 4)
+        expected = unsharded.rerank_search(query, vector, 10, 100)
+        results = db.rerank_search(query, vector, 10, 100)
+        self.assertEqual(expected, results)
+
+    def test_delete_removes_codes_from_their_shard(self):
+        db = self._db(n_shards=3, code_size=8)
+        for i in xrange(10):
+            db.append_many(['a' * 8] * 2, [str(i)] * 2, key=str(i))
+        self.assertEqual(2, db.delete('3'))
+        self.assertEqual(18, len(db))
+        self.assertNotIn('3', db.search('a' * 8, 20))
+        db.compact()
+        self.assertEqual(18, len(db.search('a' * 8, 20)))
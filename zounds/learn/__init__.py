@@ -32,7 +32,8 @@ from util import simple_settings, object_store_pipeline_settings, model_hash, \
 
 from graph import learning_pipeline, infinite_streaming_learning_pipeline
 
-from functional import hyperplanes, simhash, example_wise_unit_norm
+from functional import \
+    hyperplanes, simhash, simhash_projections, example_wise_unit_norm
 
 from sinclayer import SincLayer
 
@@ -12,10 +12,14 @@ def hyperplanes(means, stds, n_planes):
     return plane_vectors
 
 
+def simhash_projections(plane_vectors, data):
+    flattened = data.reshape((len(data), -1))
+    return np.dot(plane_vectors, flattened.T).T
+
+
 def simhash(plane_vectors, data):
     output = np.zeros((len(data), len(plane_vectors)), dtype=np.uint8)
-    flattened = data.reshape((len(data), -1))
-    x = np.dot(plane_vectors, flattened.T).T
+    x = simhash_projections(plane_vectors, data)
     output[np.where(x > 0)] = 1
     return output
 
@@ -54,4 +54,157 @@ def count_packed_bits(np.ndarray[UINT64_DTYPE_t,ndim = 2] n):
         for j in range(ns2):
             z += __builtin_popcountl(n[i, j]);
         out[i] = z
-    return out
\ No newline at end of file
+    return out
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def packed_hamming_distance_into(
+        const UINT64_DTYPE_t[:] a,
+        const UINT64_DTYPE_t[:, :] b,
+        INT_DTYPE_t[:] out):
+    """
+    Compute the hamming distance between the packed code a and each row of b,
+    writing the results into out, without allocating a temporary array for
+    the xor-ed codes.  The GIL is released while the distances are computed,
+    so several threads can score disjoint blocks of rows concurrently.
+    """
+    cdef Py_ssize_t ns = b.shape[0]
+    cdef Py_ssize_t ns2 = b.shape[1]
+    cdef Py_ssize_t i = 0
+    cdef Py_ssize_t j = 0
+    cdef INT_DTYPE_t z = 0
+
+    if a.shape[0] != ns2:
+        raise ValueError('a and b must have the same number of words')
+
+    if out.shape[0] < ns:
+        raise ValueError('out must have at least as many elements as b has rows')
+
+    with nogil:
+        for i in range(ns):
+            z = 0
+            for j in range(ns2):
+                z += __builtin_popcountl(a[j] ^ b[i, j])
+            out[i] = z
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def packed_hamming_distance_block(
+        const UINT64_DTYPE_t[:, :] a,
+        const UINT64_DTYPE_t[:, :] b,
+        INT_DTYPE_t[:, :] out):
+    """
+    Compute the hamming distance between every row of a and every row of b,
+    writing the results into out, which must have shape (len(a), len(b)).
+    Each row of b is read once and compared against every row of a while it's
+    still in cache.  The GIL is released while the distances are computed.
+    """
+    cdef Py_ssize_t na = a.shape[0]
+    cdef Py_ssize_t ns = b.shape[0]
+    cdef Py_ssize_t ns2 = b.shape[1]
+    cdef Py_ssize_t i = 0
+    cdef Py_ssize_t j = 0
+    cdef Py_ssize_t k = 0
+    cdef INT_DTYPE_t z = 0
+
+    if a.shape[1] != ns2:
+        raise ValueError('a and b must have the same number of words')
+
+    if out.shape[0] < na or out.shape[1] < ns:
+        raise ValueError('out must have shape (len(a), len(b))')
+
+    with nogil:
+        for i in range(ns):
+            for k in range(na):
+                z = 0
+                for j in range(ns2):
+                    z += __builtin_popcountl(a[k, j] ^ b[i, j])
+                out[k, i] = z
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def packed_hamming_distance_within_into(
+        const UINT64_DTYPE_t[:] a,
+        const UINT64_DTYPE_t[:, :] b,
+        INT_DTYPE_t radius,
+        INT_DTYPE_t[:] rows,
+        INT_DTYPE_t[:] distances):
+    """
+    Find the rows of b within hamming distance radius of the packed code a,
+    writing their indices into rows and their distances into distances, and
+    returning the number found.  Each row is abandoned as soon as its partial
+    distance exceeds radius, so the remaining words are never compared.  The
+    GIL is released while the distances are computed.
+    """
+    cdef Py_ssize_t ns = b.shape[0]
+    cdef Py_ssize_t ns2 = b.shape[1]
+    cdef Py_ssize_t i = 0
+    cdef Py_ssize_t j = 0
+    cdef Py_ssize_t n_found = 0
+    cdef INT_DTYPE_t z = 0
+
+    if a.shape[0] != ns2:
+        raise ValueError('a and b must have the same number of words')
+
+    if rows.shape[0] < ns or distances.shape[0] < ns:
+        raise ValueError(
+            'rows and distances must have at least as many elements as b '
+            'has rows')
+
+    with nogil:
+        for i in range(ns):
+            z = 0
+            for j in range(ns2):
+                z += __builtin_popcountl(a[j] ^ b[i, j])
+                if z > radius:
+                    break
+            if z <= radius:
+                rows[n_found] = i
+                distances[n_found] = z
+                n_found += 1
+
+    return n_found
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def weighted_hamming_distance_into(
+        const FLOAT_DTYPE_t[:, :] tables,
+        const UINT64_DTYPE_t[:, :] b,
+        FLOAT_DTYPE_t[:] out):
+    """
+    Compute a weighted hamming distance between a query and each row of b,
+    writing the results into out.  tables has one row of 256 entries for each
+    byte of the packed codes, holding the summed weights of the bits in which
+    each possible byte value differs from the query, so each distance is the
+    sum of one table lookup per byte.  The GIL is released while the
+    distances are computed.
+    """
+    cdef Py_ssize_t ns = b.shape[0]
+    cdef Py_ssize_t ns2 = b.shape[1]
+    cdef Py_ssize_t i = 0
+    cdef Py_ssize_t j = 0
+    cdef Py_ssize_t k = 0
+    cdef UINT64_DTYPE_t word = 0
+    cdef FLOAT_DTYPE_t z = 0
+
+    if tables.shape[0] != ns2 * 8 or tables.shape[1] != 256:
+        raise ValueError(
+            'tables must have shape (8 * number of words in b, 256)')
+
+    if out.shape[0] < ns:
+        raise ValueError('out must have at least as many elements as b has rows')
+
+    with nogil:
+        for i in range(ns):
+            z = 0
+            for j in range(ns2):
+                word = b[i, j]
+                # bytes are stored little-endian, so the least significant
+                # byte of each word is the first byte of its packed bits
+                for k in range(8):
+                    z += tables[j * 8 + k, word & 0xff]
+                    word = word >> 8
+            out[i] = z
@@ -374,13 +374,111 @@ def hamming_distance(a, b):
     return count_bits(a ^ b)
 
 
-def packed_hamming_distance(a, b):
+def packed_hamming_distance(a, b, out=None):
     """
     Interpret a as a "packed" scalar, i.e. an n-bit number where n may not be
     a power of 2. E.g., a 250-bit number would be represented by 4 64-bit integers.
 
     Interpret b as an array of "packed" scalars. Its second dimension should be
     the same length as a.
+
+    The xor and bit count are fused, so no temporary array the size of b is
+    allocated, and results are written into out, if it's provided.
+    """
+    a = np.asarray(a)
+    b = np.asarray(b)
+
+    if a.ndim != 1 or b.ndim != 2 \
+            or a.dtype != np.uint64 or b.dtype != np.uint64:
+        xored = a ^ b
+        return count_packed_bits(xored)
+
+    if out is None:
+        out = np.empty(len(b), dtype=np.int)
+
+    packed_hamming_distance_into(a, b, out)
+    return out[:len(b)]
+
+
+def packed_hamming_distance_within(a, b, radius):
+    """
+    Interpret a as a "packed" scalar and b as an array of "packed" scalars,
+    and find the rows of b within hamming distance radius of a.  Each row is
+    abandoned as soon as its partial distance exceeds radius.
+
+    Returns a tuple of the matching row indices, in ascending order, and
+    their distances from a.
+    """
+    a = np.asarray(a, dtype=np.uint64)
+    b = np.asarray(b, dtype=np.uint64)
+    rows = np.empty(len(b), dtype=np.int)
+    distances = np.empty(len(b), dtype=np.int)
+    n_found = packed_hamming_distance_within_into(
+        a, b, radius, rows, distances)
+    return rows[:n_found], distances[:n_found]
+
+
+def weighted_hamming_tables(projections, weights=None):
+    """
+    Build the per-byte lookup tables used by weighted_hamming_distance.
+
+    projections are a query's real-valued projections, e.g. onto the
+    hyperplanes used by simhash, with one value per bit, in the order expected
+    by np.packbits.  The query's bits are the signs of its projections, and
+    each bit's weight is, by default, the magnitude of its projection, so
+    that disagreeing with a bit the query is unsure of costs little.
+
+    Returns an array of shape (n_bits // 8, 256), where entry [i, v] is the
+    summed weight of the bits in which byte value v differs from the query's
+    i-th byte.
     """
-    xored = a ^ b
-    return count_packed_bits(xored)
+    projections = np.asarray(projections, dtype=np.float32).reshape(-1)
+
+    if len(projections) % 64:
+        raise ValueError(
+            'the number of projections must be a multiple of 64, but was '
+            '{n}'.format(n=len(projections)))
+
+    if weights is None:
+        weights = np.abs(projections)
+    weights = np.asarray(weights, dtype=np.float32).reshape((-1, 8))
+    query_bits = (projections > 0).reshape((-1, 8))
+
+    # the bits of every possible byte value, most significant first, which
+    # agrees with the order used by np.packbits
+    byte_bits = np.unpackbits(
+        np.arange(256, dtype=np.uint8)[:, None], axis=1).astype(np.bool)
+    disagree = byte_bits[None, :, :] != query_bits[:, None, :]
+    return (disagree * weights[:, None, :]).sum(axis=-1).astype(np.float32)
+
+
+def weighted_hamming_distance(tables, b, out=None):
+    """
+    Interpret b as an array of "packed" scalars, and compute the weighted
+    hamming distance between each of them and the query described by tables,
+    as returned by weighted_hamming_tables.
+    """
+    tables = np.ascontiguousarray(tables, dtype=np.float32)
+    b = np.asarray(b, dtype=np.uint64)
+
+    if out is None:
+        out = np.empty(len(b), dtype=np.float32)
+
+    weighted_hamming_distance_into(tables, b, out)
+    return out[:len(b)]
+
+
+def packed_hamming_distance_matrix(a, b, out=None):
+    """
+    Interpret both a and b as arrays of "packed" scalars, and compute the
+    hamming distance between every row of a and every row of b, returning an
+    array of shape (len(a), len(b)).
+    """
+    a = np.asarray(a, dtype=np.uint64)
+    b = np.asarray(b, dtype=np.uint64)
+
+    if out is None:
+        out = np.empty((len(a), len(b)), dtype=np.int)
+
+    packed_hamming_distance_block(a, b, out)
+    return out[:len(a), :len(b)]
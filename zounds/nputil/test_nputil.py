@@ -1,6 +1,9 @@
 import unittest
 import numpy as np
-from npx import windowed, sliding_window, Growable
+from npx import \
+    windowed, sliding_window, Growable, packed_hamming_distance, \
+    packed_hamming_distance_matrix, packed_hamming_distance_within, \
+    count_packed_bits, weighted_hamming_tables, weighted_hamming_distance
 
 
 class GrowableTest(unittest.TestCase):
@@ -247,3 +250,135 @@ class WindowedTest(unittest.TestCase):
         l, w = windowed(samples, 8192, 4096)
         self.assertEqual(w.dtype, np.int64)
         self.assertEqual(8192, w.shape[1])
+
+
+class PackedHammingDistanceTest(unittest.TestCase):
+    def _codes(self, n_codes, n_words):
+        return np.random.randint(
+            0, 2 ** 62, (n_codes, n_words)).astype(np.uint64)
+
+    def _expected(self, a, b):
+        return count_packed_bits(a ^ b)
+
+    def test_agrees_with_unfused_computation(self):
+        b = self._codes(100, 4)
+        a = b[3]
+        np.testing.assert_array_equal(
+            self._expected(a, b), packed_hamming_distance(a, b))
+
+    def test_distance_to_self_is_zero(self):
+        b = self._codes(100, 2)
+        self.assertEqual(0, packed_hamming_distance(b[7], b)[7])
+
+    def test_writes_into_provided_output_array(self):
+        b = self._codes(100, 2)
+        out = np.zeros(100, dtype=np.int)
+        packed_hamming_distance(b[0], b, out=out)
+        np.testing.assert_array_equal(self._expected(b[0], b), out)
+
+    def test_accepts_non_contiguous_rows(self):
+        records = np.zeros(50, dtype=[('id', 'S32'), ('code', np.uint64, 2)])
+        records['code'] = self._codes(50, 2)
+        codes = records['code']
+        np.testing.assert_array_equal(
+            self._expected(codes[1], codes),
+            packed_hamming_distance(codes[1], codes))
+
+    def test_raises_when_number_of_words_differs(self):
+        b = self._codes(10, 2)
+        a = self._codes(1, 3)[0]
+        self.assertRaises(ValueError, lambda: packed_hamming_distance(a, b))
+
+    def test_matrix_has_correct_shape(self):
+        a = self._codes(3, 2)
+        b = self._codes(10, 2)
+        self.assertEqual((3, 10), packed_hamming_distance_matrix(a, b).shape)
+
+    def test_matrix_agrees_with_unfused_computation(self):
+        a = self._codes(3, 2)
+        b = self._codes(10, 2)
+        result = packed_hamming_distance_matrix(a, b)
+        for i, query in enumerate(a):
+            np.testing.assert_array_equal(self._expected(query, b), result[i])
+
+    def test_matrix_can_use_larger_output_array(self):
+        a = self._codes(3, 2)
+        b = self._codes(10, 2)
+        out = np.zeros((5, 20), dtype=np.int)
+        result = packed_hamming_distance_matrix(a, b, out=out)
+        self.assertEqual((3, 10), result.shape)
+        np.testing.assert_array_equal(self._expected(a[0], b), out[0, :10])
+
+    def test_within_agrees_with_unfused_computation(self):
+        b = self._codes(1000, 4)
+        expected = self._expected(b[0], b)
+        radius = np.sort(expected)[50]
+        rows, distances = packed_hamming_distance_within(b[0], b, radius)
+        np.testing.assert_array_equal(np.nonzero(expected <= radius)[0], rows)
+        np.testing.assert_array_equal(expected[rows], distances)
+
+    def test_within_finds_nothing_when_no_rows_are_close(self):
+        b = np.zeros((10, 2), dtype=np.uint64)
+        a = np.array([2 ** 64 - 1] * 2, dtype=np.uint64)
+        rows, distances = packed_hamming_distance_within(a, b, 10)
+        self.assertEqual(0, len(rows))
+        self.assertEqual(0, len(distances))
+
+
+class WeightedHammingDistanceTest(unittest.TestCase):
+    def _bits(self, n_codes, n_bits):
+        return np.random.randint(0, 2, (n_codes, n_bits)).astype(np.uint8)
+
+    def _pack(self, bits):
+        return np.packbits(bits, axis=-1).view(np.uint64)
+
+    def _expected(self, projections, bits, weights=None):
+        if weights is None:
+            weights = np.abs(projections)
+        disagree = (projections > 0)[None, :] != bits.astype(np.bool)
+        return (disagree * weights[None, :]).sum(axis=1)
+
+    def test_tables_have_one_row_per_byte(self):
+        projections = np.random.normal(0, 1, 128)
+        self.assertEqual((16, 256), weighted_hamming_tables(projections).shape)
+
+    def test_tables_raise_when_bits_are_not_a_multiple_of_64(self):
+        self.assertRaises(
+            ValueError, lambda: weighted_hamming_tables(np.ones(60)))
+
+    def test_agrees_with_bitwise_computation(self):
+        projections = np.random.normal(0, 1, 256).astype(np.float32)
+        bits = self._bits(100, 256)
+        tables = weighted_hamming_tables(projections)
+        result = weighted_hamming_distance(tables, self._pack(bits))
+        np.testing.assert_allclose(
+            self._expected(projections, bits), result, rtol=1e-4, atol=1e-4)
+
+    def test_agrees_with_bitwise_computation_with_explicit_weights(self):
+        projections = np.random.normal(0, 1, 64).astype(np.float32)
+        weights = np.random.uniform(0, 1, 64).astype(np.float32)
+        bits = self._bits(100, 64)
+        tables = weighted_hamming_tables(projections, weights)
+        result = weighted_hamming_distance(tables, self._pack(bits))
+        np.testing.assert_allclose(
+            self._expected(projections, bits, weights),
+            result,
+            rtol=1e-4,
+            atol=1e-4)
+
+    def test_unit_weights_give_hamming_distance(self):
+        bits = self._bits(50, 128)
+        codes = self._pack(bits)
+        projections = np.where(bits[0], 1, -1)
+        tables = weighted_hamming_tables(projections)
+        np.testing.assert_array_equal(
+            count_packed_bits(codes[0] ^ codes),
+            weighted_hamming_distance(tables, codes))
+
+    def test_can_use_larger_output_array(self):
+        projections = np.random.normal(0, 1, 64)
+        codes = self._pack(self._bits(10, 64))
+        out = np.zeros(20, dtype=np.float32)
+        result = weighted_hamming_distance(
+            weighted_hamming_tables(projections), codes, out=out)
+        self.assertEqual(10, len(result))
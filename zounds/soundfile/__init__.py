@@ -7,10 +7,16 @@ from audio_metadata import MetaData, AudioMetaData, AudioMetaDataEncoder
 
 from ogg_vorbis import \
     OggVorbis, OggVorbisDecoder, OggVorbisEncoder, OggVorbisFeature, \
-    OggVorbisWrapper
+    OggVorbisWrapper, OggVorbisIndex, OggVorbisIndexFeature
+
+from codec import \
+    AudioCodec, AudioCodecFeature, AudioCodecDecoder, SoundFileWrapper, \
+    Pcm16Wrapper
 
 from audiostream import AudioStream
 
+from bytestream import AudioByteStream, LocalFileChunk
+
 from resample import Resampler
 
 from chunksize import ChunkSizeBytes
@@ -1,8 +1,8 @@
-from io import BytesIO
-from os import SEEK_END
+from bisect import bisect_right
+from os import SEEK_SET, SEEK_CUR, SEEK_END
 from soundfile import SoundFile
 from zounds.timeseries import audio_sample_rate, AudioSamples
-from byte_depth import chunk_size_samples
+from byte_depth import chunk_size_samples, file_chunk_size_samples
 from featureflow import Node
 
 
@@ -17,7 +17,9 @@ class AudioStream(Node):
             :class:`~zounds.timeseries.AudioSamples` instance with a single
             channel
         needs (Feature): a processing node that produces a byte stream (e.g.
-            :class:`~featureflow.ByteStream`
+            :class:`~featureflow.ByteStream`, or
+            :class:`~zounds.soundfile.AudioByteStream`, in which case local
+            files are decoded directly)
 
     Here's how'd you typically see :class:`AudioStream` used in a processing
     graph.
@@ -70,38 +72,50 @@ class AudioStream(Node):
         self._buf = None
         self._sf = None
         self._chunk_size_samples = None
-        self._cache = ''
+        self._cache = []
 
     def _enqueue(self, data, pusher):
-        self._cache += data
+        # hold on to each chunk as-is, rather than concatenating them, so
+        # that no chunk is ever copied before it's decoded
+        self._cache.append(data)
 
     def _dequeue(self):
         v = self._cache
-        self._cache = ''
+        self._cache = []
         return v
 
-    def _get_samples(self):
-        raw_samples = self._sf.read(self._chunk_size_samples)
-        sr = audio_sample_rate(self._sf.samplerate)
-        samples = AudioSamples(raw_samples, sr)
-        if self._sum_to_mono:
-            return samples.mono
-        return samples
-
-    def _process(self, data):
-        b = data
+    def _write(self, data):
+        if hasattr(data, 'path'):
+            # the chunk stands in for a whole local file (see
+            # AudioByteStream), which can be decoded directly
+            self._sf = SoundFile(data.path)
+            self._chunk_size_samples = \
+                file_chunk_size_samples(self._sf, data.chunksize)
+            return
 
         # TODO: Use the _first_chunk() hook instead of the if statement
         if self._buf is None:
-            self._buf = MemoryBuffer(b.total_length)
+            self._buf = MemoryBuffer(data.total_length)
 
-        self._buf.write(b)
+        self._buf.write(data)
 
         if self._sf is None:
             self._sf = SoundFile(self._buf)
 
         if self._chunk_size_samples is None:
-            self._chunk_size_samples = chunk_size_samples(self._sf, b)
+            self._chunk_size_samples = chunk_size_samples(self._sf, data)
+
+    def _get_samples(self):
+        raw_samples = self._sf.read(self._chunk_size_samples)
+        sr = audio_sample_rate(self._sf.samplerate)
+        samples = AudioSamples(raw_samples, sr)
+        if self._sum_to_mono:
+            return samples.mono
+        return samples
+
+    def _process(self, data):
+        for chunk in data:
+            self._write(chunk)
 
         yield self._get_samples()
 
@@ -110,6 +124,7 @@ class AudioStream(Node):
         while samples.size:
             yield samples
             samples = self._get_samples()
+        self._sf.close()
 
 
 class MemoryBuffer(object):
@@ -117,60 +132,113 @@ class MemoryBuffer(object):
     This class is the implementation of the virtual io interface required by
     PySoundfile/libsndfile.
 
-    Some of the stateful/hacky things in this class (see KLUDGE note below)
-    could be avoided if this class had the following modifications:
-        - it maintains its own position
-        - it maintains the span of its buffer/BytesIO instance
-        -
+    Written data is kept as a list of segments, each of which is the object
+    passed to :meth:`write`, so writes never copy, and reads copy each byte
+    exactly once, straight from the segments into the caller's buffer.
+    Writes always append, while reads and seeks move a single position, so a
+    buffer can be filled by one party and drained by another.
+
+    Segments lying entirely more than `max_size` bytes behind the read
+    position are discarded, so memory use is bounded by `max_size` plus the
+    unread data, no matter how long the stream is.  Reads from positions that
+    have been discarded, or that haven't yet been written, return no data.
+
+    Args:
+        content_length (int): the total length of the stream, which is
+            reported as the position of its end, even before all of it has
+            been written
+        max_size (int): the number of already-read bytes to retain, so that
+            libsndfile can seek backward a little
     """
 
     def __init__(self, content_length, max_size=10 * 1024 * 1024):
         super(MemoryBuffer, self).__init__()
         self._content_length = content_length
-        self._buf = BytesIO()
         self._max_size = max_size
-        self.tell = self._tell
-
-        self._total_bytes_written = 0
-        self._total_bytes_read = 0
-
-    def read(self, count):
-        if count == -1:
-            return self._buf.read()
-        data = self._buf.read(count)
-        return data
+        self._segments = []
+        self._offsets = []
+        self._end = 0
+        self._pos = 0
+
+    def __len__(self):
+        """
+        The number of bytes currently held in memory
+        """
+        if not self._segments:
+            return 0
+        return self._end - self._offsets[0]
+
+    def _discard(self):
+        # the index of the first segment that ends within max_size bytes of
+        # the read position
+        keep_from = self._pos - self._max_size
+        n = bisect_right(self._offsets, keep_from) - 1
+        if n > 0:
+            del self._segments[:n]
+            del self._offsets[:n]
+
+    def _views(self, count):
+        """
+        Yield memoryviews over the next (at most) `count` bytes, advancing
+        the read position past them
+        """
+        if not self._segments:
+            return
+
+        stop = self._end if count < 0 else min(self._end, self._pos + count)
+        i = bisect_right(self._offsets, self._pos) - 1
+
+        if i < 0:
+            return
+
+        while self._pos < stop:
+            segment = self._segments[i]
+            offset = self._offsets[i]
+            start = self._pos - offset
+            end = min(len(segment), stop - offset)
+            self._pos += end - start
+            yield memoryview(segment)[start: end]
+            i += 1
+
+        self._discard()
+
+    def read(self, count=-1):
+        return ''.join(view.tobytes() for view in self._views(count))
 
     def readinto(self, buf):
-        data = self.read(len(buf))
-        ld = len(data)
-        buf[:ld] = data
-        return ld
+        n_read = 0
+        for view in self._views(len(buf)):
+            ld = len(view)
+            buf[n_read: n_read + ld] = view
+            n_read += ld
+        return n_read
 
     def write(self, data):
-        read_pos = self._buf.tell()
-        if read_pos > self._max_size:
-            new_buf = BytesIO()
-            new_buf.write(self._buf.read())
-            self._buf = new_buf
-            read_pos = 0
-        self._buf.seek(0, 2)
-        self._buf.write(data)
-        self._buf.seek(read_pos)
+        if not data:
+            return 0
+        self._segments.append(data)
+        self._offsets.append(self._end)
+        self._end += len(data)
         return len(data)
 
-    def _tell(self):
-        return self._buf.tell()
-
-    def _tell_end(self):
-        self.tell = self._tell
-        return self._content_length
-
-    def seek(self, offset, whence):
-        if whence == SEEK_END:
-            # KLUDGE: PySoundfile no longer supports __len__, which means that
-            # this stateful garbage is required.
-            self.tell = self._tell_end
-        self._buf.seek(offset, whence)
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=SEEK_SET):
+        if whence == SEEK_SET:
+            self._pos = offset
+        elif whence == SEEK_CUR:
+            self._pos += offset
+        elif whence == SEEK_END:
+            # PySoundfile no longer supports __len__, so libsndfile learns the
+            # stream's length by seeking to its end, which is reported as the
+            # total content length, even if it hasn't all arrived yet
+            length = self._end \
+                if self._content_length is None else self._content_length
+            self._pos = length + offset
+        else:
+            raise ValueError('invalid whence ({whence})'.format(**locals()))
+        return self._pos
 
     def flush(self):
-        self._buf.flush()
+        pass
@@ -16,6 +16,12 @@ _lookup = {
 }
 
 
+def _seconds(sf, n_bytes):
+    byte_depth = _lookup[sf.subtype]
+    bytes_per_second = byte_depth * sf.samplerate * sf.channels
+    return n_bytes / bytes_per_second
+
+
 def chunk_size_samples(sf, buf):
     """
     Black magic to account for the fact that libsndfile's behavior varies
@@ -25,9 +31,15 @@ def chunk_size_samples(sf, buf):
     at that moment, libsndfile will give you no more samples ever, even if
     more bytes arrive in the buffer later.
     """
-    byte_depth = _lookup[sf.subtype]
-    channels = sf.channels
-    bytes_per_second = byte_depth * sf.samplerate * channels
-    secs = len(buf) / bytes_per_second
-    secs = max(1, secs - 6)
+    secs = max(1, _seconds(sf, len(buf)) - 6)
     return int(secs * sf.samplerate)
+
+
+def file_chunk_size_samples(sf, chunksize):
+    """
+    The number of samples roughly equivalent to `chunksize` bytes of `sf`.
+    When `sf` was opened directly from a file, every sample is available up
+    front, so, unlike :func:`chunk_size_samples`, there's no need to hold any
+    back
+    """
+    return max(1, int(_seconds(sf, chunksize) * sf.samplerate))
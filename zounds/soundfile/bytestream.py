@@ -0,0 +1,49 @@
+import os
+from featureflow import ByteStream
+from featureflow.bytestream import StringWithTotalLength
+
+
+class LocalFileChunk(StringWithTotalLength):
+    """
+    An empty chunk that stands in for the entire contents of a local file, so
+    that nodes which understand it can open the file themselves, while it
+    still looks like any other chunk produced by :class:`featureflow.ByteStream`
+
+    Args:
+        path (str): the path to the local file
+        chunksize (int): the number of bytes the stream would otherwise have
+            produced at once, which consumers may use to size their own chunks
+    """
+
+    def __new__(cls, path, chunksize):
+        o = StringWithTotalLength.__new__(cls, '', os.path.getsize(path))
+        o.path = path
+        o.chunksize = chunksize
+        return o
+
+
+class AudioByteStream(ByteStream):
+    """
+    `AudioByteStream` behaves exactly like :class:`featureflow.ByteStream`,
+    except that local files aren't read at all.  Instead, a single
+    :class:`LocalFileChunk` is produced, and :class:`AudioStream` and
+    :class:`OggVorbis` decode the file directly, so that it's read once per
+    decoder, rather than being chunked into memory and then parsed again
+    through libsndfile's virtual io interface
+
+    Since no bytes are produced for local files, features that need this one
+    should be audio decoders that understand :class:`LocalFileChunk`, and it
+    shouldn't be stored
+
+    Args:
+        chunksize (int): the number of bytes to produce at once, for sources
+            other than local files
+        needs (Feature): a feature producing a uri, e.g.
+            :class:`~zounds.soundfile.MetaData`
+    """
+
+    def __init__(self, chunksize=4096, needs=None):
+        super(AudioByteStream, self).__init__(chunksize=chunksize, needs=needs)
+
+    def _handle_file(self, data):
+        yield LocalFileChunk(data, self._chunksize)
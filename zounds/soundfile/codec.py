@@ -0,0 +1,316 @@
+from __future__ import division
+from io import UnsupportedOperation
+from tempfile import TemporaryFile
+import numpy as np
+from featureflow import IdentityEncoder, Node, Decoder, Feature
+from audiostream import MemoryBuffer
+from zounds.timeseries import \
+    audio_sample_rate, TimeSlice, AudioSamples, wav_header
+from soundfile import *
+from byte_depth import chunk_size_samples, file_chunk_size_samples
+from zounds.timeseries import Picoseconds, Seconds
+
+
+class SoundFileWrapper(object):
+    """
+    Provides random access to the samples of a stored, encoded audio stream,
+    in any format libsndfile can read and seek within
+    """
+
+    def __init__(self, flo):
+        self._flo = flo
+        self._soundfile = None
+
+    @property
+    def _sf(self):
+        if self._soundfile is None:
+            self._soundfile = SoundFile(self._flo)
+        return self._soundfile
+
+    @property
+    def _stream_info(self):
+        return self._sf.samplerate, self._sf.channels
+
+    @property
+    def samplerate(self):
+        return self._stream_info[0]
+
+    @property
+    def channels(self):
+        return self._stream_info[1]
+
+    @property
+    def _freq(self):
+        return Picoseconds(int(1e12)) / self.samplerate
+
+    @property
+    def duration_seconds(self):
+        return len(self._sf) / self.samplerate
+
+    def _n_samples(self, duration):
+        if duration is None:
+            return -1
+        return int(duration / self._freq)
+
+    def _read(self, start_sample, n_samples):
+        self._sf.seek(start_sample)
+        return self._sf.read(n_samples)
+
+    def __getitem__(self, timeslice):
+        sr = audio_sample_rate(self.samplerate)
+
+        if timeslice == slice(None):
+            return AudioSamples(self._read(0, -1), sr)
+
+        start_sample = int(timeslice.start / self._freq)
+        n_samples = self._n_samples(timeslice.duration)
+        return AudioSamples(self._read(start_sample, n_samples), sr)
+
+    def iter_chunks(self):
+        chunksize = Seconds(1)
+        ts = TimeSlice(chunksize)
+        sl = self[ts]
+        yield sl
+        while len(sl) >= self._n_samples(chunksize):
+            ts += chunksize
+            sl = self[ts]
+            yield sl
+
+
+class Pcm16Wrapper(SoundFileWrapper):
+    """
+    Provides random access to a stored, 16-bit PCM WAV stream.  When the
+    stream is backed by a file, the samples are memory-mapped rather than
+    read, and, in all cases, only the slices requested are converted to
+    floating point, so reads cost no more than a copy
+    """
+
+    def __init__(self, flo):
+        super(Pcm16Wrapper, self).__init__(flo)
+        self._info = None
+        self._pcm = None
+
+    def _read_header(self):
+        header = wav_header(self._flo)
+        if header.dtype != np.dtype('<i2'):
+            raise ValueError(
+                'expected 16-bit samples, but found {bits}'
+                    .format(bits=header.bits_per_sample))
+        return \
+            header.samplerate, \
+            header.channels, \
+            header.data_offset, \
+            header.data_length
+
+    @property
+    def _stream_info(self):
+        if self._info is None:
+            self._info = self._read_header()
+        return self._info[:2]
+
+    def _map(self, offset, n_frames, channels):
+        shape = (n_frames, channels)
+        if n_frames:
+            try:
+                self._flo.fileno()
+                return np.memmap(
+                    self._flo, dtype='<i2', mode='r', offset=offset, shape=shape)
+            except (AttributeError, IOError, UnsupportedOperation):
+                # in-memory storage has no file to map
+                pass
+
+        self._flo.seek(offset)
+        raw = self._flo.read(n_frames * channels * 2)
+        return np.fromstring(raw, dtype='<i2').reshape(shape)
+
+    @property
+    def _samples(self):
+        if self._pcm is None:
+            samplerate, channels = self._stream_info
+            offset, length = self._info[2:]
+            n_frames = length // (channels * 2)
+            self._pcm = self._map(offset, n_frames, channels)
+        return self._pcm
+
+    @property
+    def duration_seconds(self):
+        return len(self._samples) / self.samplerate
+
+    def _read(self, start_sample, n_samples):
+        stop = None if n_samples < 0 else start_sample + n_samples
+        pcm = self._samples[start_sample: stop]
+        # the same scaling libsndfile uses when reading 16-bit samples
+        samples = pcm * (1 / 32768)
+        return samples[:, 0] if self.channels == 1 else samples
+
+
+class FlacEncoder(IdentityEncoder):
+    content_type = 'audio/flac'
+
+
+class Pcm16Encoder(IdentityEncoder):
+    content_type = 'audio/wav'
+
+
+# codec name -> (format, subtype, encoder, wrapper)
+_codecs = {
+    'flac': ('FLAC', 'PCM_16', FlacEncoder, SoundFileWrapper),
+    'pcm16': ('WAV', 'PCM_16', Pcm16Encoder, Pcm16Wrapper)
+}
+
+
+def _codec(name):
+    try:
+        return _codecs[name]
+    except KeyError:
+        raise ValueError(
+            'codec must be one of {codecs}, but was {name}'
+                .format(codecs=sorted(_codecs), name=name))
+
+
+class AudioCodecDecoder(Decoder):
+    def __init__(self, codec):
+        super(AudioCodecDecoder, self).__init__()
+        self._wrapper = _codec(codec)[3]
+
+    def __call__(self, flo):
+        return self._wrapper(flo)
+
+    def __iter__(self, flo):
+        yield self(flo)
+
+
+class AudioCodecFeature(Feature):
+    """
+    A stored, encoded audio stream, which decodes to a wrapper sharing the
+    interface of :class:`~zounds.soundfile.OggVorbisWrapper`, i.e., one that
+    supports `__getitem__` with a :class:`~zounds.timeseries.TimeSlice`, and
+    `iter_chunks()`.  The `codec` is passed on to the :class:`AudioCodec`
+    node, and is one of
+
+    - `flac`, which is lossless, and cheaper to decode than ogg vorbis
+    - `pcm16`, an uncompressed, 16-bit WAV file, whose samples are read via a
+      memory map when the database stores features as files (e.g.
+      :class:`featureflow.FileSystemDatabase`), so decoding costs nothing
+      beyond the conversion to floating point of the samples requested
+    """
+
+    def __init__(
+            self,
+            extractor,
+            codec='flac',
+            needs=None,
+            store=False,
+            key=None,
+            **extractor_args):
+        super(AudioCodecFeature, self).__init__(
+            extractor,
+            needs=needs,
+            store=store,
+            encoder=_codec(codec)[2],
+            decoder=AudioCodecDecoder(codec),
+            key=key,
+            codec=codec,
+            **extractor_args)
+
+
+class AudioCodec(Node):
+    """
+    `AudioCodec` expects to process a stream of raw bytes (e.g. one produced
+    by :class:`~zounds.soundfile.AudioByteStream`) and produces a new byte
+    stream, where the original audio samples are encoded as either `flac` or
+    16-bit PCM WAV (`pcm16`).
+
+    Both formats have headers that can only be completed once every sample has
+    been encoded, so the encoded stream is spooled to a temporary file, and
+    only produced once the incoming stream is exhausted
+
+    Args:
+        codec (str): either `flac` or `pcm16`
+        needs (Feature): a feature that produces a byte stream
+
+    Here's how you'd typically see :class:`AudioCodec` used in a processing
+    graph.
+
+    .. code:: python
+
+        import featureflow as ff
+        import zounds
+
+
+        @zounds.simple_in_memory_settings
+        class Document(ff.BaseModel):
+            raw = ff.ByteStreamFeature(
+                zounds.AudioByteStream,
+                chunksize=2 * 44100 * 30 * 2,
+                store=False)
+
+            audio = zounds.AudioCodecFeature(
+                zounds.AudioCodec,
+                codec='pcm16',
+                needs=raw,
+                store=True)
+
+
+        synth = zounds.NoiseSynthesizer(zounds.SR11025())
+        samples = synth.synthesize(zounds.Seconds(10))
+        _id = Document.process(raw=samples.encode())
+        doc = Document(_id)
+        # fetch a section of audio
+        ts = zounds.TimeSlice(zounds.Seconds(2))
+        print doc.audio[ts].shape  # 22050
+    """
+
+    def __init__(self, codec='flac', needs=None):
+        super(AudioCodec, self).__init__(needs=needs)
+        self._format, self._subtype = _codec(codec)[:2]
+        self._in_buf = None
+        self._in_sf = None
+        self._out = None
+        self._out_sf = None
+        self._chunk_size_samples = None
+        self._chunksize = None
+
+    def _enqueue(self, data, pusher):
+        if hasattr(data, 'path'):
+            # the chunk stands in for a whole local file (see
+            # AudioByteStream), which can be read directly
+            self._in_sf = SoundFile(data.path)
+            self._chunksize = data.chunksize
+            self._chunk_size_samples = \
+                file_chunk_size_samples(self._in_sf, data.chunksize)
+        elif self._in_buf is None:
+            self._in_buf = MemoryBuffer(data.total_length)
+            self._in_buf.write(data)
+            self._in_sf = SoundFile(self._in_buf)
+            self._chunksize = len(data)
+            self._chunk_size_samples = chunk_size_samples(self._in_sf, data)
+        else:
+            self._in_buf.write(data)
+
+        if self._out_sf is None:
+            self._out = TemporaryFile()
+            self._out_sf = SoundFile(
+                self._out,
+                format=self._format,
+                subtype=self._subtype,
+                mode='w',
+                samplerate=self._in_sf.samplerate,
+                channels=self._in_sf.channels)
+
+    def _dequeue(self):
+        samples = self._in_sf.read(self._chunk_size_samples)
+        while samples.size:
+            self._out_sf.write(samples)
+            samples = self._in_sf.read(self._chunk_size_samples)
+        return self._out
+
+    def _process(self, data):
+        if not self._finalized:
+            return
+
+        self._out_sf.close()
+        data.seek(0)
+        for chunk in iter(lambda: data.read(self._chunksize), ''):
+            yield chunk
+        data.close()
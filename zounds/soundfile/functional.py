@@ -3,9 +3,9 @@ from resample import Resampler
 import numpy as np
 
 
-def resample(samples, new_sample_rate):
+def resample(samples, new_sample_rate, engine='libsamplerate'):
     if new_sample_rate == samples.samplerate:
         return samples
-    rs = Resampler(new_sample_rate)
+    rs = Resampler(new_sample_rate, engine=engine)
     new_samples = np.concatenate(list(rs._process(samples)))
     return AudioSamples(new_samples, new_sample_rate)
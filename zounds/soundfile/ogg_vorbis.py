@@ -1,57 +1,152 @@
 from __future__ import division
+import struct
+import threading
+from Queue import Queue
+from collections import deque
+from io import BytesIO
+import numpy as np
 from featureflow import IdentityEncoder, Node, Decoder, Feature
 from audiostream import MemoryBuffer
-from zounds.timeseries import audio_sample_rate, TimeSlice, AudioSamples
+from codec import SoundFileWrapper
+from zounds.timeseries import audio_sample_rate, AudioSamples
 from soundfile import *
-from byte_depth import chunk_size_samples
-from zounds.timeseries import Picoseconds, Seconds
+from byte_depth import chunk_size_samples, file_chunk_size_samples
 
 
-class OggVorbisWrapper(object):
-    def __init__(self, flo):
-        self._flo = flo
-        self._sf = SoundFile(self._flo)
-        self._freq = Picoseconds(int(1e12)) / self._sf.samplerate
+_page_index_dtype = np.dtype([('offset', '<i8'), ('granule', '<i8')])
+
+
+class OggVorbisWrapper(SoundFileWrapper):
+    """
+    Provides random access to the samples of a stored ogg vorbis stream.
+
+    When `page_index` (as produced by :class:`OggVorbisIndex`) is available,
+    the stream's properties are read from its first page, and slices are
+    decoded by reading only the stream's header pages and the pages that span
+    the slice, so the cost of decoding a short slice doesn't depend on the
+    length of the stream
+    """
+
+    def __init__(self, flo, page_index=None):
+        super(OggVorbisWrapper, self).__init__(flo)
+        self._info = None
+        self.page_index = page_index
 
     @property
-    def samplerate(self):
-        return self._sf.samplerate
+    def _indexed(self):
+        return self.page_index is not None and len(self.page_index) > 1
+
+    def _read_identification_header(self):
+        """
+        Read the samplerate and channel count from the vorbis identification
+        header, which is alone on the stream's first page
+        """
+        position = self._flo.tell()
+        try:
+            page = self._read_bytes(0, self.page_index['offset'][1])
+        finally:
+            self._flo.seek(position)
+
+        packet = page[27 + ord(page[26]):]
+        if packet[:7] != '\x01vorbis':
+            return None
+
+        channels = ord(packet[11])
+        samplerate, = struct.unpack('<I', packet[12:16])
+        return samplerate, channels
 
     @property
-    def channels(self):
-        return self._sf.channels
+    def _stream_info(self):
+        if self._info is None and self._indexed:
+            self._info = self._read_identification_header()
+            if self._info is None:
+                # the page index only makes sense for vorbis streams
+                self.page_index = None
+
+        if self._info is None:
+            self._info = super(OggVorbisWrapper, self)._stream_info
+
+        return self._info
 
     @property
     def duration_seconds(self):
-        return len(self._sf) / self.samplerate
-
-    def _n_samples(self, duration):
-        if duration is None:
-            return -1
-        return int(duration / self._freq)
+        if self._indexed:
+            return self.page_index['granule'].max() / self.samplerate
+        return super(OggVorbisWrapper, self).duration_seconds
 
     def __getitem__(self, timeslice):
-        sr = audio_sample_rate(self.samplerate)
-
         if timeslice == slice(None):
-            self._sf.seek(0)
-            return AudioSamples(self._sf.read(len(self._sf)), sr)
-
-        start_sample = int(timeslice.start / self._freq)
-        n_samples = self._n_samples(timeslice.duration)
-
-        self._sf.seek(start_sample)
-        return AudioSamples(self._sf.read(n_samples), sr)
+            return super(OggVorbisWrapper, self).__getitem__(timeslice)
+
+        if self._indexed:
+            start_sample = int(timeslice.start / self._freq)
+            n_samples = self._n_samples(timeslice.duration)
+            samples = self._read_pages(start_sample, n_samples)
+            if samples is not None:
+                return AudioSamples(samples, audio_sample_rate(self.samplerate))
+
+        return super(OggVorbisWrapper, self).__getitem__(timeslice)
+
+    def _read_bytes(self, start, stop=None):
+        self._flo.seek(start)
+        return self._flo.read() if stop is None else self._flo.read(stop - start)
+
+    def _open_pages(self, first_audio_page, first, last):
+        offsets = self.page_index['offset']
+        stop = offsets[last + 1] if last + 1 < len(offsets) else None
+
+        position = self._flo.tell()
+        try:
+            encoded = \
+                self._read_bytes(0, offsets[first_audio_page]) + \
+                self._read_bytes(offsets[first], stop)
+        finally:
+            self._flo.seek(position)
+
+        return SoundFile(BytesIO(encoded))
+
+    def _read_pages(self, start_sample, n_samples):
+        """
+        Decode only the pages spanning the requested samples, by handing
+        libsndfile the stream's header pages, followed directly by those
+        pages.  The samples decodable from those pages end exactly at the
+        granule position of the last page included, which pins down the
+        position of every sample.
+
+        Returns None if the requested samples can't be found this way
+        """
+        # pages on which no packet ends have a granule position of -1
+        granules = np.maximum.accumulate(self.page_index['granule'])
+
+        audio_pages = np.nonzero(granules > 0)[0]
+        if not len(audio_pages):
+            return None
+        first_audio_page = audio_pages[0]
+
+        if n_samples < 0:
+            last = len(granules) - 1
+        else:
+            last = np.searchsorted(granules, start_sample + n_samples)
+            last = min(len(granules) - 1, last)
+
+        # the last page whose packets all end at or before the first sample
+        # requested
+        first = np.searchsorted(granules, start_sample, side='right') - 1
+
+        # the first packet decoded only primes the decoder, and may be the
+        # tail of a packet begun on an earlier page, so if the first page
+        # holds too few packets, back up another page
+        for page in (first, first - 1):
+            page = max(first_audio_page, page)
+            sf = self._open_pages(first_audio_page, page, last)
+            first_sample = granules[last] - len(sf)
+            if first_sample <= start_sample:
+                break
+        else:
+            return None
 
-    def iter_chunks(self):
-        chunksize = Seconds(1)
-        ts = TimeSlice(chunksize)
-        sl = self[ts]
-        yield sl
-        while len(sl) >= self._n_samples(chunksize):
-            ts += chunksize
-            sl = self[ts]
-            yield sl
+        sf.seek(start_sample - first_sample)
+        return sf.read(n_samples)
 
 
 class OggVorbisEncoder(IdentityEncoder):
@@ -70,6 +165,13 @@ class OggVorbisDecoder(Decoder):
 
 
 class OggVorbisFeature(Feature):
+    """
+    A stored ogg vorbis stream, which decodes to an
+    :class:`OggVorbisWrapper`.  If the same model has an
+    :class:`OggVorbisIndexFeature` that needs this one, its page index is
+    handed to the wrapper, so that short slices can be decoded quickly
+    """
+
     def __init__(
             self,
             extractor,
@@ -86,6 +188,240 @@ class OggVorbisFeature(Feature):
                 key=key,
                 **extractor_args)
 
+    def _index_feature(self, persistence):
+        for feature in getattr(persistence, 'features', {}).itervalues():
+            if isinstance(feature, OggVorbisIndexFeature) \
+                    and any(f is self for f in feature.dependencies):
+                return feature
+        return None
+
+    def __call__(self, _id=None, decoder=None, persistence=None):
+        decoded = super(OggVorbisFeature, self).__call__(
+            _id, decoder=decoder, persistence=persistence)
+
+        index_feature = self._index_feature(persistence)
+        if index_feature is None or not isinstance(decoded, OggVorbisWrapper):
+            return decoded
+
+        try:
+            raw = index_feature.reader(_id, index_feature.key, persistence)
+        except KeyError:
+            # documents processed before the index was added to the model
+            # have none, and computing it would mean reading the whole stream
+            return decoded
+
+        decoded.page_index = index_feature.decoder(raw)
+        return decoded
+
+
+class OggVorbisIndexEncoder(IdentityEncoder):
+    content_type = 'application/octet-stream'
+
+
+class OggVorbisIndexDecoder(Decoder):
+    def __init__(self):
+        super(OggVorbisIndexDecoder, self).__init__()
+
+    def __call__(self, flo):
+        return np.fromstring(flo.read(), dtype=_page_index_dtype)
+
+    def __iter__(self, flo):
+        yield self(flo)
+
+
+class OggVorbisIndexFeature(Feature):
+    def __init__(
+            self,
+            extractor,
+            needs=None,
+            store=False,
+            key=None,
+            **extractor_args):
+        super(OggVorbisIndexFeature, self).__init__(
+                extractor,
+                needs=needs,
+                store=store,
+                encoder=OggVorbisIndexEncoder,
+                decoder=OggVorbisIndexDecoder(),
+                key=key,
+                **extractor_args)
+
+
+class OggVorbisIndex(Node):
+    """
+    `OggVorbisIndex` expects to process the byte stream produced by
+    :class:`OggVorbis`, and produces a compact index of the byte offset and
+    granule position of every ogg page, as the pages are encoded.  Stored
+    alongside the ogg vorbis stream, the index allows
+    :class:`OggVorbisWrapper` to decode short slices from long recordings in
+    near-constant time.
+
+    Args:
+        needs (Feature): an :class:`OggVorbisFeature`
+
+    .. code:: python
+
+        ogg = zounds.OggVorbisFeature(
+            zounds.OggVorbis,
+            needs=raw,
+            store=True)
+
+        ogg_index = zounds.OggVorbisIndexFeature(
+            zounds.OggVorbisIndex,
+            needs=ogg,
+            store=True)
+    """
+
+    def __init__(self, needs=None):
+        super(OggVorbisIndex, self).__init__(needs=needs)
+        # bytes of an incomplete page, and the stream offset they begin at
+        self._pending = ''
+        self._offset = 0
+
+    def _pages(self):
+        pending = self._pending
+        pos = 0
+
+        while len(pending) - pos >= 27:
+            if pending[pos: pos + 4] != 'OggS':
+                raise ValueError(
+                    'expected an ogg page at byte {offset}'.format(
+                        offset=self._offset + pos))
+
+            n_segments = ord(pending[pos + 26])
+            header_size = 27 + n_segments
+            if len(pending) - pos < header_size:
+                break
+
+            segments = bytearray(pending[pos + 27: pos + header_size])
+            page_size = header_size + sum(segments)
+            if len(pending) - pos < page_size:
+                break
+
+            granule, = struct.unpack_from('<q', pending, pos + 6)
+            yield self._offset + pos, granule
+            pos += page_size
+
+        # the (at most one) incomplete page is all that's ever held back
+        self._pending = pending[pos:]
+        self._offset += pos
+
+    def _process(self, data):
+        self._pending += data
+        pages = list(self._pages())
+        if pages:
+            yield np.array(pages, dtype=_page_index_dtype).tostring()
+
+
+class OggVorbisWriter(object):
+    """
+    Encodes audio samples as ogg vorbis in memory, making the encoded bytes
+    available as soon as they're produced
+    """
+
+    def __init__(self, samplerate, channels, content_length):
+        super(OggVorbisWriter, self).__init__()
+        self.samplerate = samplerate
+        self._buf = MemoryBuffer(content_length)
+        self._sf = SoundFile(
+            self._buf,
+            format='OGG',
+            subtype='VORBIS',
+            mode='w',
+            samplerate=samplerate,
+            channels=channels)
+
+    def write(self, samples):
+        # KLUDGE: Trying to write too-large chunks to an ogg file seems to
+        # cause a segfault in libsndfile
+        step = self.samplerate * 20
+        for i in xrange(0, len(samples), step):
+            self._sf.write(samples[i: i + step])
+
+    def read(self):
+        """
+        Return all the encoded bytes produced since the last call
+        """
+        return self._buf.read(count=-1)
+
+    def close(self):
+        self._sf.close()
+
+
+class ThreadedOggVorbisWriter(OggVorbisWriter):
+    """
+    An :class:`OggVorbisWriter` that encodes in a dedicated worker thread, so
+    that the (expensive) encoding can overlap with other work.  libsndfile
+    releases the GIL while encoding.
+
+    Samples are handed to the worker via a queue holding at most `queue_size`
+    blocks, so `write` blocks whenever the worker falls that far behind.
+    `write_all` instead hands over an iterable of blocks, which the worker
+    consumes itself, so it never blocks.  Encoded bytes are only ever touched
+    by the worker until they've been handed back to the caller, so neither
+    buffer needs to be locked.
+    """
+
+    def __init__(self, samplerate, channels, content_length, queue_size=2):
+        super(ThreadedOggVorbisWriter, self).__init__(
+            samplerate, channels, content_length)
+        self._queue = Queue(maxsize=queue_size)
+        self._encoded = deque()
+        self._error = None
+        self._thread = threading.Thread(target=self._encode)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _blocks(self):
+        blocks = self._queue.get()
+        while blocks is not None:
+            yield blocks
+            blocks = self._queue.get()
+
+    def _encode(self):
+        blocks = self._blocks()
+        try:
+            for chunks in blocks:
+                for chunk in chunks:
+                    super(ThreadedOggVorbisWriter, self).write(chunk)
+                    self._encoded.append(
+                        super(ThreadedOggVorbisWriter, self).read())
+            super(ThreadedOggVorbisWriter, self).close()
+            self._encoded.append(super(ThreadedOggVorbisWriter, self).read())
+        except Exception as e:
+            self._error = e
+            # keep draining, so that callers never block on a full queue
+            for _ in blocks:
+                pass
+
+    def _raise_for_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def write(self, samples):
+        self._raise_for_error()
+        self._queue.put((samples,))
+
+    def write_all(self, blocks):
+        """
+        Encode every block of samples produced by the iterable `blocks`, which
+        is consumed by the worker, rather than the calling thread
+        """
+        self._raise_for_error()
+        self._queue.put(blocks)
+
+    def read(self):
+        self._raise_for_error()
+        encoded = []
+        while self._encoded:
+            encoded.append(self._encoded.popleft())
+        return ''.join(encoded)
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        self._raise_for_error()
+
 
 class OggVorbis(Node):
     """
@@ -94,8 +430,20 @@ class OggVorbis(Node):
     original audio samples are `ogg-vorbis <https://xiph.org/vorbis/>`_ encoded
 
     Args:
+        background (bool): when `True`, encoding happens in a dedicated
+            worker thread (see :class:`ThreadedOggVorbisWriter`), so that it
+            can overlap with the other nodes in the processing graph.
+            Encoded bytes are produced as the worker finishes them.  Local
+            files (see :class:`~zounds.soundfile.AudioByteStream`) are read
+            by the worker too, so that encoding them never holds up the
+            rest of the graph
+        queue_size (int): when encoding in the background, the number of
+            chunks of samples that may be waiting to be encoded before this
+            node blocks
         needs (Feature): a feature that produces a byte stream
-            (e.g. :class:`featureflow.Bytestream`)
+            (e.g. :class:`featureflow.Bytestream`, or
+            :class:`~zounds.soundfile.AudioByteStream`, in which case local
+            files are read directly)
 
     Here's how you'd typically see :class:`OggVorbis` used in a processing
     graph.
@@ -140,17 +488,26 @@ class OggVorbis(Node):
         ts = zounds.TimeSlice(zounds.Seconds(2))
         print doc.ogg[ts].shape  # 22050
     """
-    def __init__(self, needs=None):
+    def __init__(self, background=False, queue_size=2, needs=None):
         super(OggVorbis, self).__init__(needs=needs)
+        self._background = background
+        self._queue_size = queue_size
         self._in_buf = None
         self._in_sf = None
-        self._out_buf = None
-        self._out_sf = None
+        self._writer = None
+        self._handed_off = False
         self._already_ogg = None
         self._chunk_size_samples = None
 
     def _enqueue(self, data, pusher):
-        if self._in_buf is None:
+        if hasattr(data, 'path'):
+            # the chunk stands in for a whole local file (see
+            # AudioByteStream), which can be read directly
+            self._in_sf = SoundFile(data.path)
+            self._already_ogg = 'OGG' in self._in_sf.format
+            self._chunk_size_samples = \
+                file_chunk_size_samples(self._in_sf, data.chunksize)
+        elif self._in_buf is None:
             self._in_buf = MemoryBuffer(data.total_length)
             self._in_buf.write(data)
             self._in_sf = SoundFile(self._in_buf)
@@ -163,45 +520,63 @@ class OggVorbis(Node):
             super(OggVorbis, self)._enqueue(data, pusher)
             return
 
-        if self._out_buf is None:
-            self._out_buf = MemoryBuffer(data.total_length)
-            self._out_sf = SoundFile(
-                    self._out_buf,
-                    format='OGG',
-                    subtype='VORBIS',
-                    mode='w',
-                    samplerate=self._in_sf.samplerate,
-                    channels=self._in_sf.channels)
+        if self._writer is None:
+            self._writer = self._new_writer(data.total_length)
         else:
             self._in_buf.write(data)
 
+    def _new_writer(self, content_length):
+        if self._background:
+            return ThreadedOggVorbisWriter(
+                self._in_sf.samplerate,
+                self._in_sf.channels,
+                content_length,
+                queue_size=self._queue_size)
+        return OggVorbisWriter(
+            self._in_sf.samplerate, self._in_sf.channels, content_length)
+
+    def _iter_samples(self):
+        samples = self._in_sf.read(self._chunk_size_samples)
+        while samples.size:
+            yield samples
+            samples = self._in_sf.read(self._chunk_size_samples)
+
     def _dequeue(self):
 
         if self._already_ogg:
             return super(OggVorbis, self)._dequeue()
 
-        samples = self._in_sf.read(self._chunk_size_samples)
-        factor = 20
-        while samples.size:
-            # KLUDGE: Trying to write too-large chunks to an ogg file seems to
-            # cause a segfault in libsndfile
-            for i in xrange(0, len(samples), self._in_sf.samplerate * factor):
-                self._out_sf.write(
-                        samples[i: i + self._in_sf.samplerate * factor])
-            samples = self._in_sf.read(self._chunk_size_samples)
-        return self._out_buf
+        if self._background and self._in_buf is None:
+            # the whole of a local file is available up front, in a single
+            # chunk, so writing it here would hold up every sibling node until
+            # nearly all of it had been encoded.  The worker reads it instead
+            if not self._handed_off:
+                self._writer.write_all(self._iter_samples())
+                self._handed_off = True
+            return self._writer
+
+        for samples in self._iter_samples():
+            self._writer.write(samples)
+        return self._writer
 
     def _process_other(self, data):
         if self._finalized:
-            self._out_sf.close()
-        o = data.read(count=-1)
-        return o
+            data.close()
+        return data.read()
 
     def _process_ogg(self, data):
         return data
 
+    def _process_ogg_file(self, data):
+        with open(data.path, 'rb') as f:
+            for chunk in iter(lambda: f.read(data.chunksize), ''):
+                yield chunk
+
     def _process(self, data):
-        if self._already_ogg:
+        if self._already_ogg and hasattr(data, 'path'):
+            for chunk in self._process_ogg_file(data):
+                yield chunk
+        elif self._already_ogg:
             yield self._process_ogg(data)
         else:
             yield self._process_other(data)
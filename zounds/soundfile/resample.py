@@ -1,6 +1,7 @@
 from __future__ import division
 
 from ctypes import *
+from fractions import Fraction
 
 import numpy as np
 
@@ -121,6 +122,184 @@ class Resample(object):
         return outsamples
 
 
+# (zero crossings on either side of the filter's center, kaiser window beta)
+_qualities = {
+    'fast': (8, 5.0),
+    'medium': (16, 8.0),
+    'best': (32, 10.0)
+}
+
+# the largest number of filter phases we're willing to design and store
+_max_phases = 1024
+
+_taps_cache = {}
+
+
+def polyphase_taps(up, down, quality='medium'):
+    """
+    Design a windowed-sinc, low-pass filter suitable for resampling by a
+    factor of `up / down`, and return it decomposed into its `up` polyphase
+    components.
+
+    Filters are cached, so they're only computed once for each combination of
+    `(up, down, quality)`
+
+    Args:
+        up (int): the upsampling factor
+        down (int): the downsampling factor
+        quality (str): one of `fast`, `medium` or `best`.  Better quality
+            filters are longer, and have better stopband attenuation
+
+    Returns:
+        a read-only, `(up, n_taps)` array, where row `p` holds the taps that
+            produce output samples whose position falls `p / up` of the way
+            between two input samples
+    """
+    key = (up, down, quality)
+    try:
+        return _taps_cache[key]
+    except KeyError:
+        pass
+
+    try:
+        zero_crossings, beta = _qualities[quality]
+    except KeyError:
+        raise ValueError(
+            'quality must be one of {qualities}, but was {quality}'
+                .format(qualities=sorted(_qualities), quality=quality))
+
+    factor = max(up, down)
+    half_length = zero_crossings * factor
+    n = np.arange(-half_length, half_length + 1)
+    taps = np.sinc(n / factor) * np.kaiser(len(n), beta)
+    # each polyphase component should have unity gain at DC
+    taps *= up / taps.sum()
+
+    n_taps = -(-len(taps) // up)
+    padded = np.zeros(n_taps * up)
+    padded[:len(taps)] = taps
+    phases = padded.reshape((n_taps, up)).T.astype(np.float32)
+    phases.flags.writeable = False
+    _taps_cache[key] = phases
+    return phases
+
+
+class PolyphaseResample(object):
+    """
+    A pure-numpy polyphase FIR resampler that exposes the same interface as
+    :class:`Resample`, and is intended for one-time use in the same way.
+
+    Input is treated as silence before the first sample, and, once
+    `end_of_input` is signalled, after the last.  The filter's delay is
+    compensated for, so output sample `n` is always aligned with input time
+    `n * orig_sample_rate / new_sample_rate`, and exactly
+    `ceil(total_input * new_sample_rate / orig_sample_rate)` samples are
+    produced.  Output samples are only emitted once every input they depend
+    on has arrived, and each is computed identically no matter how the input
+    was chunked, so streaming output is bit-identical to processing the
+    whole signal at once.
+    """
+
+    def __init__(
+            self,
+            orig_sample_rate,
+            new_sample_rate,
+            nchannels=1,
+            quality='medium'):
+
+        """
+        orig_sample_rate - The sample rate of the incoming samples, in hz
+        new_sample_rate - The sample_rate of the outgoing samples, in hz
+        n_channels - Number of channels in the incoming and outgoing samples
+        quality - One of "fast", "medium" or "best"
+        """
+        super(PolyphaseResample, self).__init__()
+        ratio = Fraction(int(new_sample_rate), int(orig_sample_rate))
+        self.up = ratio.numerator
+        self.down = ratio.denominator
+        if max(self.up, self.down) > _max_phases:
+            raise ValueError(
+                '{new_sample_rate} / {orig_sample_rate} = {up} / {down} '
+                'requires too many filter phases'
+                    .format(up=self.up, down=self.down, **locals()))
+        self.nchannels = nchannels
+        self.quality = quality
+        self._taps = polyphase_taps(self.up, self.down, quality)
+        n_taps = self._taps.shape[1]
+        # the filter's group delay, in upsampled samples
+        self._delay = _qualities[quality][0] * max(self.up, self.down)
+        # the input history, pre-filled with the silence before the first
+        # sample
+        self._buf = np.zeros((n_taps - 1, nchannels), dtype=np.float32)
+        # the absolute input index of self._buf[0]
+        self._start = -(n_taps - 1)
+        self._n_in = 0
+        self._n_out = 0
+
+    def _prepare_input(self, insamples):
+        samples = np.asarray(insamples, dtype=np.float32)
+        return samples.reshape((len(samples), self.nchannels))
+
+    def _input_index(self, n):
+        return (n * self.down + self._delay) // self.up
+
+    def __call__(self, insamples, end_of_input=False):
+        self._buf = np.concatenate(
+            [self._buf, self._prepare_input(insamples)])
+        self._n_in += len(insamples)
+
+        if end_of_input:
+            stop = -(-self._n_in * self.up // self.down)
+            # everything after the final sample is silence
+            needed = self._input_index(stop - 1) - self._start + 1
+            if needed > len(self._buf):
+                self._buf = np.concatenate([
+                    self._buf,
+                    np.zeros(
+                        (needed - len(self._buf), self.nchannels),
+                        dtype=np.float32)])
+        else:
+            # only emit samples whose most recent input has arrived
+            stop = (self._n_in * self.up - 1 - self._delay) // self.down + 1
+
+        n_out = max(0, stop - self._n_out)
+        outsamples = np.empty((n_out, self.nchannels), dtype=np.float32)
+        # split the input into self.down interleaved components, so that
+        # every read below is from contiguous memory
+        components = [
+            np.ascontiguousarray(self._buf[c::self.down])
+            for c in xrange(self.down)]
+
+        for r in xrange(min(self.up, n_out)):
+            # consecutive outputs that share a filter phase are exactly
+            # self.down input samples apart
+            t = (self._n_out + r) * self.down + self._delay
+            base = t // self.up - self._start
+            acc = np.zeros(
+                (len(xrange(r, n_out, self.up)), self.nchannels),
+                dtype=np.float32)
+            product = np.empty_like(acc)
+            for q, tap in enumerate(self._taps[t % self.up]):
+                index = base - q
+                offset = index // self.down
+                np.multiply(
+                    components[index % self.down][offset: offset + len(acc)],
+                    tap,
+                    out=product)
+                acc += product
+            outsamples[r::self.up] = acc
+
+        self._n_out += n_out
+        # retain only the input history needed by the next output sample
+        keep = self._input_index(self._n_out) - (self._taps.shape[1] - 1)
+        cut = keep - self._start
+        if cut > 0:
+            self._buf = self._buf[cut:]
+            self._start = keep
+
+        return outsamples if self.nchannels > 1 else outsamples[:, 0]
+
+
 class Resampler(Node):
     """
     `Resampler` expects to process :class:`~zounds.timeseries.AudioSamples`
@@ -132,6 +311,13 @@ class Resampler(Node):
             provided, the default is :class:`~zounds.timeseries.SR44100`
         needs (Feature): a processing node that produces
             :class:`~zounds.timeseries.AudioSamples`
+        engine (str): either `libsamplerate` (the default), or `polyphase`,
+            which uses :class:`PolyphaseResample`, a pure-numpy polyphase
+            filter that is much faster for simple ratios such as
+            44100hz -> 11025hz, and whose output doesn't depend on how the
+            incoming samples are chunked
+        quality (str): the filter quality used by the `polyphase` engine. One
+            of `fast`, `medium` (the default) or `best`
 
 
     Here's how you'd typically see :class:`Resampler` used in a processing
@@ -182,25 +368,46 @@ class Resampler(Node):
         print doc.resampled.samplerate.__class__.__name__  # SR22050
     """
 
-    def __init__(self, samplerate=None, needs=None):
+    def __init__(
+            self,
+            samplerate=None,
+            engine='libsamplerate',
+            quality='medium',
+            needs=None):
+
         super(Resampler, self).__init__(needs=needs)
+        if engine not in ('libsamplerate', 'polyphase'):
+            raise ValueError(
+                'engine must be libsamplerate or polyphase, but was {engine}'
+                    .format(**locals()))
         self._samplerate = samplerate or SR44100()
+        self._engine = engine
+        self._quality = quality
         self._resample = None
 
     def _noop(self, data, finalized):
         return data
 
+    def _last_chunk(self):
+        if not isinstance(self._resample, PolyphaseResample):
+            return
+        # emit the samples that were held back waiting for more input
+        resampled = self._resample(np.zeros(0), end_of_input=True)
+        if len(resampled):
+            yield AudioSamples(resampled, self._samplerate)
+
     def _process(self, data):
         sr = data.samples_per_second
 
         if self._resample is None:
             target_sr = self._samplerate.samples_per_second
-            self._resample = Resample(
-                sr,
-                target_sr,
-                1 if len(data.shape) == 1 else data.shape[1])
+            nchannels = 1 if len(data.shape) == 1 else data.shape[1]
 
-            if target_sr != sr:
+            if target_sr != sr and self._engine == 'polyphase':
+                self._resample = self._rs = PolyphaseResample(
+                    sr, target_sr, nchannels, quality=self._quality)
+            elif target_sr != sr:
+                self._resample = Resample(sr, target_sr, nchannels)
                 self._rs = self._resample
                 # KLUDGE: The following line seems to solve a bug whereby 
                 # libsamplerate doesn't generate enough samples the first time
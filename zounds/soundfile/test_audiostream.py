@@ -0,0 +1,194 @@
+import unittest2
+import numpy as np
+import os
+import shutil
+from io import BytesIO
+from tempfile import mkdtemp
+from os import SEEK_END
+from soundfile import SoundFile
+from featureflow import BaseModel, ByteStream, ByteStreamFeature
+from featureflow.bytestream import StringWithTotalLength
+from audiostream import AudioStream, MemoryBuffer
+from bytestream import AudioByteStream
+from ogg_vorbis import OggVorbis, OggVorbisFeature
+from zounds.persistence import AudioSamplesFeature
+from zounds.timeseries import SR11025, Seconds, TimeSlice
+from zounds.synthesize import NoiseSynthesizer
+from zounds.util import simple_in_memory_settings
+
+
+class MemoryBufferTests(unittest2.TestCase):
+    def test_reads_span_segments(self):
+        buf = MemoryBuffer(10)
+        buf.write('abc')
+        buf.write('defg')
+        buf.write('hij')
+        self.assertEqual('abcde', buf.read(5))
+        self.assertEqual('fghij', buf.read(-1))
+        self.assertEqual('', buf.read(5))
+
+    def test_readinto_spans_segments(self):
+        buf = MemoryBuffer(10)
+        buf.write('abc')
+        buf.write('defg')
+        out = bytearray(5)
+        self.assertEqual(5, buf.readinto(out))
+        self.assertEqual('abcde', str(out))
+        self.assertEqual(2, buf.readinto(out))
+        self.assertEqual('fg', str(out[:2]))
+
+    def test_writes_append_without_moving_read_position(self):
+        buf = MemoryBuffer(10)
+        buf.write('abc')
+        self.assertEqual('ab', buf.read(2))
+        buf.write('def')
+        self.assertEqual(2, buf.tell())
+        self.assertEqual('cdef', buf.read(-1))
+
+    def test_seek_to_end_reports_content_length(self):
+        buf = MemoryBuffer(100)
+        buf.write('abc')
+        buf.seek(0, SEEK_END)
+        self.assertEqual(100, buf.tell())
+
+    def test_can_seek_backward_within_retained_data(self):
+        buf = MemoryBuffer(10, max_size=4)
+        buf.write('abc')
+        buf.write('def')
+        buf.read(5)
+        buf.seek(3)
+        self.assertEqual('def', buf.read(-1))
+
+    def test_discards_segments_far_behind_read_position(self):
+        buf = MemoryBuffer(1000, max_size=10)
+        for _ in xrange(100):
+            buf.write('a' * 10)
+            buf.read(10)
+        self.assertLessEqual(len(buf), 20)
+
+    def test_reads_from_discarded_positions_return_no_data(self):
+        buf = MemoryBuffer(30, max_size=5)
+        for _ in xrange(3):
+            buf.write('a' * 10)
+        buf.read(-1)
+        buf.seek(0)
+        self.assertEqual('', buf.read(5))
+
+    def test_does_not_copy_written_segments(self):
+        buf = MemoryBuffer(10)
+        data = 'abcdefghij'
+        buf.write(data)
+        self.assertIs(data, buf._segments[0])
+
+
+@simple_in_memory_settings
+class Document(BaseModel):
+    raw = ByteStreamFeature(
+        ByteStream,
+        chunksize=4096,
+        store=False)
+
+    pcm = AudioSamplesFeature(
+        AudioStream,
+        needs=raw,
+        sum_to_mono=False,
+        store=True)
+
+
+class AudioStreamTests(unittest2.TestCase):
+    def _encoded(self, seconds, fmt='WAV', subtype='PCM_16'):
+        samples = NoiseSynthesizer(SR11025()).synthesize(Seconds(seconds))
+        return samples.encode(fmt=fmt, subtype=subtype)
+
+    def _decoded(self, encoded):
+        encoded.seek(0)
+        return SoundFile(encoded).read()
+
+    def test_decodes_wav_streamed_in_small_chunks(self):
+        encoded = self._encoded(10)
+        _id = Document.process(raw=encoded)
+        np.testing.assert_allclose(
+            self._decoded(encoded), Document(_id).pcm, atol=1e-4)
+
+    def test_memory_is_bounded_for_long_streams(self):
+        encoded = self._encoded(60).read()
+        stream = AudioStream(sum_to_mono=False)
+        stream._buf = MemoryBuffer(len(encoded), max_size=8192)
+        chunksize = 4096
+        n_samples = 0
+        for i in xrange(0, len(encoded), chunksize):
+            chunk = StringWithTotalLength(
+                encoded[i: i + chunksize], len(encoded))
+            stream._enqueue(chunk, None)
+            for samples in stream._process(stream._dequeue()):
+                n_samples += len(samples)
+            self.assertLessEqual(len(stream._buf), 8192 + 2 * chunksize)
+        for samples in stream._last_chunk():
+            n_samples += len(samples)
+        self.assertEqual(len(SoundFile(BytesIO(encoded))), n_samples)
+
+
+@simple_in_memory_settings
+class DirectDocument(BaseModel):
+    raw = ByteStreamFeature(
+        AudioByteStream,
+        chunksize=4096,
+        store=False)
+
+    ogg = OggVorbisFeature(
+        OggVorbis,
+        needs=raw,
+        store=True)
+
+    pcm = AudioSamplesFeature(
+        AudioStream,
+        needs=raw,
+        sum_to_mono=False,
+        store=True)
+
+
+class AudioByteStreamTests(unittest2.TestCase):
+    def setUp(self):
+        self._dir = mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+    def _local_file(self, seconds, fmt='WAV', subtype='PCM_16'):
+        samples = NoiseSynthesizer(SR11025()).synthesize(Seconds(seconds))
+        path = os.path.join(self._dir, 'audio.{fmt}'.format(fmt=fmt.lower()))
+        with open(path, 'wb') as f:
+            f.write(samples.encode(fmt=fmt, subtype=subtype).read())
+        return path
+
+    def test_local_file_produces_a_single_empty_chunk(self):
+        path = self._local_file(1)
+        chunks = list(AudioByteStream(chunksize=100)._process(path))
+        self.assertEqual(1, len(chunks))
+        self.assertEqual('', chunks[0])
+        self.assertEqual(path, chunks[0].path)
+        self.assertEqual(os.path.getsize(path), chunks[0].total_length)
+
+    def test_file_like_objects_are_chunked_as_usual(self):
+        samples = NoiseSynthesizer(SR11025()).synthesize(Seconds(1))
+        encoded = samples.encode()
+        chunks = list(AudioByteStream(chunksize=100)._process(encoded))
+        self.assertEqual(100, len(chunks[0]))
+        self.assertFalse(hasattr(chunks[0], 'path'))
+
+    def test_decodes_local_wav_directly(self):
+        path = self._local_file(10)
+        _id = DirectDocument.process(raw=path)
+        doc = DirectDocument(_id)
+        np.testing.assert_allclose(SoundFile(path).read(), doc.pcm, atol=1e-4)
+        self.assertEqual(len(doc.pcm), len(doc.ogg[TimeSlice()]))
+
+    def test_decodes_local_ogg_directly(self):
+        path = self._local_file(10, fmt='OGG', subtype='VORBIS')
+        _id = DirectDocument.process(raw=path)
+        doc = DirectDocument(_id)
+        self.assertEqual(len(SoundFile(path)), len(doc.pcm))
+        flo = doc.ogg._flo
+        flo.seek(0)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), flo.read())
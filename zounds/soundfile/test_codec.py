@@ -0,0 +1,135 @@
+import unittest2
+import numpy as np
+import os
+import shutil
+from io import BytesIO
+from tempfile import mkdtemp
+from soundfile import SoundFile
+import featureflow as ff
+from featureflow import BaseModel, ByteStreamFeature
+from bytestream import AudioByteStream
+from codec import AudioCodec, AudioCodecFeature, Pcm16Wrapper, SoundFileWrapper
+from zounds.timeseries import TimeSlice, Seconds, Milliseconds, SR11025
+from zounds.synthesize import NoiseSynthesizer
+from zounds.util import simple_in_memory_settings
+
+
+def _model(codec):
+    class Document(BaseModel):
+        raw = ByteStreamFeature(
+            AudioByteStream,
+            chunksize=2 * 11025 * 4,
+            store=False)
+
+        audio = AudioCodecFeature(
+            AudioCodec,
+            codec=codec,
+            needs=raw,
+            store=True)
+
+    return Document
+
+
+class AudioCodecTests(unittest2.TestCase):
+    def setUp(self):
+        synth = NoiseSynthesizer(SR11025())
+        self.samples = synth.synthesize(Seconds(10)).stereo
+        encoded = self.samples.encode(fmt='WAV', subtype='PCM_16')
+        self.encoded = encoded.read()
+        self.expected = SoundFile(BytesIO(self.encoded)).read()
+
+    def _process(self, codec):
+        Document = simple_in_memory_settings(_model(codec))
+        _id = Document.process(raw=BytesIO(self.encoded))
+        return Document(_id).audio
+
+    def test_pcm16_decodes_to_pcm16_wrapper(self):
+        self.assertIsInstance(self._process('pcm16'), Pcm16Wrapper)
+
+    def test_flac_decodes_to_soundfile_wrapper(self):
+        self.assertIsInstance(self._process('flac'), SoundFileWrapper)
+
+    def test_pcm16_is_lossless(self):
+        audio = self._process('pcm16')
+        np.testing.assert_array_equal(self.expected, audio[TimeSlice()])
+
+    def test_flac_is_lossless(self):
+        audio = self._process('flac')
+        np.testing.assert_array_equal(self.expected, audio[TimeSlice()])
+
+    def test_pcm16_slices(self):
+        audio = self._process('pcm16')
+        ts = TimeSlice(start=Seconds(2), duration=Milliseconds(500))
+        slce = audio[ts]
+        self.assertEqual(SR11025(), slce.samplerate)
+        np.testing.assert_array_equal(
+            self.expected[2 * 11025: 2 * 11025 + 5512], slce)
+
+    def test_flac_slices(self):
+        audio = self._process('flac')
+        ts = TimeSlice(start=Seconds(2), duration=Milliseconds(500))
+        np.testing.assert_array_equal(
+            self.expected[2 * 11025: 2 * 11025 + 5512], audio[ts])
+
+    def test_pcm16_properties(self):
+        audio = self._process('pcm16')
+        self.assertEqual(11025, audio.samplerate)
+        self.assertEqual(2, audio.channels)
+        self.assertEqual(10, audio.duration_seconds)
+
+    def test_pcm16_mono_is_one_dimensional(self):
+        samples = NoiseSynthesizer(SR11025()).synthesize(Seconds(2))
+        Document = simple_in_memory_settings(_model('pcm16'))
+        _id = Document.process(raw=samples.encode())
+        self.assertEqual((2 * 11025,), Document(_id).audio[TimeSlice()].shape)
+
+    def test_iter_chunks(self):
+        audio = self._process('pcm16')
+        chunks = list(audio.iter_chunks())
+        self.assertEqual(len(self.expected), sum(len(c) for c in chunks))
+
+    def test_raises_for_unknown_codec(self):
+        self.assertRaises(ValueError, lambda: AudioCodec(codec='mp3'))
+
+
+class MemoryMappedTests(unittest2.TestCase):
+    def setUp(self):
+        self._dir = mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+    def _model(self, codec):
+        path = self._dir
+
+        class Settings(ff.PersistenceSettings):
+            id_provider = ff.UuidProvider()
+            key_builder = ff.StringDelimitedKeyBuilder()
+            database = ff.FileSystemDatabase(
+                path=path, key_builder=key_builder)
+
+        class Document(_model(codec), Settings):
+            pass
+
+        return Document
+
+    def test_pcm16_samples_are_memory_mapped(self):
+        samples = NoiseSynthesizer(SR11025()).synthesize(Seconds(5)).stereo
+        encoded = samples.encode(fmt='WAV', subtype='PCM_16')
+        Document = self._model('pcm16')
+        _id = Document.process(raw=encoded)
+        audio = Document(_id).audio
+        self.assertIsInstance(audio._samples, np.memmap)
+        encoded.seek(0)
+        np.testing.assert_array_equal(
+            SoundFile(encoded).read(), audio[TimeSlice()])
+
+    def test_local_file_is_encoded(self):
+        samples = NoiseSynthesizer(SR11025()).synthesize(Seconds(5))
+        path = os.path.join(self._dir, 'audio.wav')
+        with open(path, 'wb') as f:
+            f.write(samples.encode(fmt='WAV', subtype='PCM_16').read())
+        Document = self._model('flac')
+        _id = Document.process(raw=path)
+        np.testing.assert_array_equal(
+            SoundFile(path).read(), Document(_id).audio[TimeSlice()])
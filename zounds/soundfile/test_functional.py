@@ -33,4 +33,12 @@ class ResampleTests(unittest2.TestCase):
         synth = SilenceSynthesizer(samplerate)
         samples = synth.synthesize(Seconds(1))
         resampled = resample(samples, SR11025())
-        self.assertEqual(0, resampled.max())
\ No newline at end of file
+        self.assertEqual(0, resampled.max())
+
+    def test_can_resample_with_polyphase_engine(self):
+        samplerate = SR44100()
+        synth = SineSynthesizer(samplerate)
+        samples = synth.synthesize(Seconds(1), [440, 880, 1760]).stereo
+        resampled = resample(samples, SR11025(), engine='polyphase')
+        self.assertIsInstance(resampled, AudioSamples)
+        self.assertEqual((int(SR11025()), 2), resampled.shape)
@@ -1,7 +1,20 @@
 import unittest2
-from ogg_vorbis import OggVorbisWrapper
-from zounds.timeseries import TimeSlice, Seconds, SR11025
-from zounds.synthesize import SineSynthesizer
+import numpy as np
+import os
+import shutil
+import threading
+from io import BytesIO
+from tempfile import mkdtemp
+from soundfile import SoundFile
+from featureflow import BaseModel, ByteStream, ByteStreamFeature
+from ogg_vorbis import \
+    OggVorbisWrapper, OggVorbis, OggVorbisFeature, OggVorbisIndex, \
+    OggVorbisIndexFeature, OggVorbisIndexDecoder, OggVorbisWriter, \
+    ThreadedOggVorbisWriter
+from bytestream import AudioByteStream, LocalFileChunk
+from zounds.timeseries import TimeSlice, Seconds, Milliseconds, SR11025
+from zounds.synthesize import SineSynthesizer, NoiseSynthesizer
+from zounds.util import simple_in_memory_settings
 
 
 class TestOggVorbisWrapper(unittest2.TestCase):
@@ -24,3 +37,250 @@ class TestOggVorbisWrapper(unittest2.TestCase):
         expected = Seconds(9) / Seconds(1)
         actual = samples.end / Seconds(1)
         self.assertAlmostEqual(expected, actual, places=6)
+
+
+def _page_index(encoded):
+    node = OggVorbisIndex()
+    return OggVorbisIndexDecoder()(BytesIO(''.join(node._process(encoded))))
+
+
+@simple_in_memory_settings
+class Document(BaseModel):
+    raw = ByteStreamFeature(
+        ByteStream,
+        chunksize=2 * 11025 * 30 * 2,
+        store=False)
+
+    ogg = OggVorbisFeature(
+        OggVorbis,
+        needs=raw,
+        store=True)
+
+    ogg_index = OggVorbisIndexFeature(
+        OggVorbisIndex,
+        needs=ogg,
+        store=True)
+
+
+class TestOggVorbisIndex(unittest2.TestCase):
+    def setUp(self):
+        synth = NoiseSynthesizer(SR11025())
+        samples = synth.synthesize(Seconds(60))
+        self.encoded = samples.encode(fmt='OGG', subtype='VORBIS').read()
+        self.decoded = SoundFile(BytesIO(self.encoded)).read()
+
+    def _wrapper(self, page_index=True):
+        return OggVorbisWrapper(
+            BytesIO(self.encoded),
+            page_index=_page_index(self.encoded) if page_index else None)
+
+    def test_index_has_an_entry_for_every_page(self):
+        index = _page_index(self.encoded)
+        self.assertEqual(self.encoded.count('OggS'), len(index))
+        for offset in index['offset']:
+            self.assertEqual('OggS', self.encoded[offset: offset + 4])
+
+    def test_index_granules_end_at_the_last_sample(self):
+        index = _page_index(self.encoded)
+        self.assertEqual(len(self.decoded), index['granule'][-1])
+
+    def test_index_does_not_depend_on_chunk_boundaries(self):
+        node = OggVorbisIndex()
+        chunks = []
+        for i in xrange(0, len(self.encoded), 1000):
+            chunks.extend(node._process(self.encoded[i: i + 1000]))
+        index = OggVorbisIndexDecoder()(BytesIO(''.join(chunks)))
+        np.testing.assert_array_equal(_page_index(self.encoded), index)
+
+    def test_raises_when_stream_is_not_ogg(self):
+        node = OggVorbisIndex()
+        self.assertRaises(
+            ValueError, lambda: list(node._process('x' * 100)))
+
+    def test_indexed_properties_agree_with_soundfile(self):
+        indexed = self._wrapper()
+        plain = self._wrapper(page_index=False)
+        self.assertEqual(plain.samplerate, indexed.samplerate)
+        self.assertEqual(plain.channels, indexed.channels)
+        self.assertAlmostEqual(
+            plain.duration_seconds, indexed.duration_seconds, places=6)
+
+    def test_indexed_slices_are_exact(self):
+        wrapper = self._wrapper()
+        for start_ms in (0, 10, 1500, 30000, 59000, 59990):
+            for duration_ms in (None, 50, 2000):
+                ts = TimeSlice(
+                    start=Milliseconds(start_ms),
+                    duration=None if duration_ms is None
+                    else Milliseconds(duration_ms))
+                start = int(start_ms * 11.025)
+                stop = None if duration_ms is None \
+                    else start + int(duration_ms * 11.025)
+                np.testing.assert_array_equal(
+                    self.decoded[start: stop], wrapper[ts])
+
+    def test_indexed_slices_do_not_move_the_stream_position(self):
+        flo = BytesIO(self.encoded)
+        wrapper = OggVorbisWrapper(flo, page_index=_page_index(self.encoded))
+        flo.seek(100)
+        wrapper[TimeSlice(start=Seconds(10), duration=Seconds(1))]
+        self.assertEqual(100, flo.tell())
+
+    def test_feature_attaches_stored_index_to_wrapper(self):
+        signal = SineSynthesizer(SR11025()).synthesize(Seconds(10))
+        _id = Document.process(raw=signal.encode())
+        doc = Document(_id)
+        self.assertIsNotNone(doc.ogg.page_index)
+        np.testing.assert_array_equal(doc.ogg_index, doc.ogg.page_index)
+        ts = TimeSlice(start=Seconds(2), duration=Seconds(1))
+        self.assertEqual(11025, len(doc.ogg[ts]))
+
+    def test_feature_without_index_sibling_has_no_index(self):
+        @simple_in_memory_settings
+        class Unindexed(BaseModel):
+            raw = ByteStreamFeature(
+                ByteStream, chunksize=2 * 11025 * 30 * 2, store=False)
+            ogg = OggVorbisFeature(OggVorbis, needs=raw, store=True)
+
+        signal = SineSynthesizer(SR11025()).synthesize(Seconds(2))
+        _id = Unindexed.process(raw=signal.encode())
+        self.assertIsNone(Unindexed(_id).ogg.page_index)
+
+
+@simple_in_memory_settings
+class BackgroundDocument(BaseModel):
+    raw = ByteStreamFeature(
+        ByteStream,
+        chunksize=2 * 11025 * 30 * 2,
+        store=False)
+
+    ogg = OggVorbisFeature(
+        OggVorbis,
+        background=True,
+        queue_size=1,
+        needs=raw,
+        store=True)
+
+    ogg_index = OggVorbisIndexFeature(
+        OggVorbisIndex,
+        needs=ogg,
+        store=True)
+
+
+def _local_file_model(background):
+    @simple_in_memory_settings
+    class LocalFileDocument(BaseModel):
+        raw = ByteStreamFeature(
+            AudioByteStream,
+            chunksize=2 * 11025 * 30 * 2,
+            store=False)
+
+        ogg = OggVorbisFeature(
+            OggVorbis,
+            background=background,
+            needs=raw,
+            store=True)
+
+    return LocalFileDocument
+
+
+class TestBackgroundEncoding(unittest2.TestCase):
+    def setUp(self):
+        synth = NoiseSynthesizer(SR11025())
+        self.samples = synth.synthesize(Seconds(30))
+        self._dir = mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+    def _local_file(self):
+        path = os.path.join(self._dir, 'audio.wav')
+        with open(path, 'wb') as f:
+            f.write(self.samples.encode().read())
+        return path
+
+    def _encode(self, writer):
+        encoded = []
+        for i in xrange(0, len(self.samples), 11025 * 7):
+            writer.write(self.samples[i: i + 11025 * 7])
+            encoded.append(writer.read())
+        writer.close()
+        encoded.append(writer.read())
+        return ''.join(encoded)
+
+    def _decode(self, encoded):
+        return SoundFile(BytesIO(encoded)).read()
+
+    def test_threaded_writer_output_is_identical(self):
+        # ogg stream serial numbers are random, so compare the decoded audio
+        expected = self._encode(OggVorbisWriter(11025, 1, 10 ** 7))
+        actual = self._encode(ThreadedOggVorbisWriter(11025, 1, 10 ** 7))
+        np.testing.assert_array_equal(
+            self._decode(expected), self._decode(actual))
+
+    def test_threaded_writer_queue_is_bounded(self):
+        writer = ThreadedOggVorbisWriter(11025, 1, 10 ** 7, queue_size=3)
+        self.assertEqual(3, writer._queue.maxsize)
+        writer.close()
+
+    def test_threaded_writer_consumes_iterables_in_worker(self):
+        writer = ThreadedOggVorbisWriter(11025, 1, 10 ** 7)
+        ready = threading.Event()
+
+        def blocks():
+            # blocks until the caller has moved on, which it can only do if
+            # it isn't consuming this generator itself
+            ready.wait()
+            for i in xrange(0, len(self.samples), 11025 * 7):
+                yield self.samples[i: i + 11025 * 7]
+
+        writer.write_all(blocks())
+        ready.set()
+        writer.close()
+        expected = self._encode(OggVorbisWriter(11025, 1, 10 ** 7))
+        np.testing.assert_array_equal(
+            self._decode(expected), self._decode(writer.read()))
+
+    def test_threaded_writer_raises_encoding_errors(self):
+        writer = ThreadedOggVorbisWriter(11025, 1, 10 ** 7)
+        writer.write('not audio')
+        self.assertRaises(Exception, writer.close)
+
+    def test_background_encoding_matches_foreground_encoding(self):
+        synth = NoiseSynthesizer(SR11025())
+        encoded = synth.synthesize(Seconds(150)).encode()
+        _id = Document.process(raw=encoded)
+        encoded.seek(0)
+        background_id = BackgroundDocument.process(raw=encoded)
+        expected = Document(_id).ogg._flo.read()
+        actual = BackgroundDocument(background_id).ogg._flo.read()
+        np.testing.assert_array_equal(
+            self._decode(expected), self._decode(actual))
+        np.testing.assert_array_equal(
+            Document(_id).ogg_index, BackgroundDocument(background_id).ogg_index)
+
+    def test_local_file_is_read_by_worker(self):
+        node = OggVorbis(background=True)
+        threads = []
+        iter_samples = node._iter_samples
+
+        def recording_iter_samples():
+            for samples in iter_samples():
+                threads.append(threading.current_thread())
+                yield samples
+
+        node._iter_samples = recording_iter_samples
+        node._enqueue(LocalFileChunk(self._local_file(), 11025 * 2), None)
+        writer = node._dequeue()
+        writer.close()
+        self.assertEqual(30, len(threads))
+        self.assertNotIn(threading.current_thread(), threads)
+
+    def test_background_encoding_of_local_file_matches_foreground(self):
+        path = self._local_file()
+        Foreground = _local_file_model(background=False)
+        Background = _local_file_model(background=True)
+        expected = Foreground(Foreground.process(raw=path)).ogg._flo.read()
+        actual = Background(Background.process(raw=path)).ogg._flo.read()
+        np.testing.assert_array_equal(
+            self._decode(expected), self._decode(actual))
@@ -1,8 +1,13 @@
-from resample import Resample
+from resample import Resample, PolyphaseResample, Resampler, polyphase_taps
 from zounds.timeseries import SR44100, SR11025, Seconds
-from zounds.synthesize import SilenceSynthesizer
+from zounds.synthesize import SilenceSynthesizer, NoiseSynthesizer
+from zounds.persistence import AudioSamplesFeature
+from zounds.util import simple_in_memory_settings
+from featureflow import BaseModel, ByteStream, ByteStreamFeature
+from audiostream import AudioStream
 from multiprocessing.pool import ThreadPool
 import unittest2
+import numpy as np
 
 
 class ResampleTests(unittest2.TestCase):
@@ -24,4 +29,110 @@ class ResampleTests(unittest2.TestCase):
         samples = synth.synthesize(Seconds(1)).stereo
         rs = Resample(int(samples.samplerate), int(SR11025()), nchannels=2)
         resampled = rs(samples, end_of_input=True)
-        self.assertEqual((11025, 2), resampled.shape)
\ No newline at end of file
+        self.assertEqual((11025, 2), resampled.shape)
+
+
+class PolyphaseResampleTests(unittest2.TestCase):
+    def _noise(self, samplerate, seconds=2, channels=2):
+        np.random.seed(0)
+        return np.random.normal(
+            0, 0.3, (int(samplerate) * seconds + 17, channels))
+
+    def _chunked(self, rs, samples, sizes):
+        chunks = []
+        i = 0
+        while i < len(samples):
+            size = sizes[len(chunks) % len(sizes)]
+            chunks.append(
+                rs(samples[i: i + size], end_of_input=i + size >= len(samples)))
+            i += size
+        return np.concatenate(chunks)
+
+    def _assert_chunked_output_is_identical(self, orig_sr, new_sr):
+        samples = self._noise(orig_sr)
+        whole = PolyphaseResample(orig_sr, new_sr, nchannels=2)(
+            samples, end_of_input=True)
+        chunked = self._chunked(
+            PolyphaseResample(orig_sr, new_sr, nchannels=2),
+            samples,
+            [1, 7, 1000, 3, 4410])
+        np.testing.assert_array_equal(whole, chunked)
+
+    def test_chunked_downsampling_is_bit_identical(self):
+        self._assert_chunked_output_is_identical(44100, 11025)
+
+    def test_chunked_rational_downsampling_is_bit_identical(self):
+        self._assert_chunked_output_is_identical(22050, 16000)
+
+    def test_chunked_upsampling_is_bit_identical(self):
+        self._assert_chunked_output_is_identical(44100, 48000)
+
+    def test_produces_expected_number_of_samples(self):
+        samples = self._noise(48000, channels=1)[:, 0]
+        rs = PolyphaseResample(48000, 16000)
+        resampled = rs(samples, end_of_input=True)
+        self.assertEqual((-(-len(samples) // 3),), resampled.shape)
+
+    def test_compensates_for_filter_delay(self):
+        t = np.arange(44100 * 2) / 44100.
+        sine = np.sin(2 * np.pi * 440 * t)
+        resampled = PolyphaseResample(44100, 11025)(sine, end_of_input=True)
+        expected = np.sin(
+            2 * np.pi * 440 * np.arange(len(resampled)) / 11025.)
+        np.testing.assert_allclose(
+            expected[500:-500], resampled[500:-500], atol=1e-3)
+
+    def test_attenuates_frequencies_above_new_nyquist(self):
+        t = np.arange(44100 * 2) / 44100.
+        sine = np.sin(2 * np.pi * 8000 * t)
+        resampled = PolyphaseResample(44100, 11025)(sine, end_of_input=True)
+        self.assertLess(np.abs(resampled[500:-500]).max(), 1e-3)
+
+    def test_withholds_output_until_inputs_arrive(self):
+        rs = PolyphaseResample(44100, 11025)
+        self.assertEqual(0, len(rs(np.zeros(10))))
+
+    def test_taps_are_cached(self):
+        self.assertIs(polyphase_taps(1, 4), polyphase_taps(1, 4))
+
+    def test_raises_for_unknown_quality(self):
+        self.assertRaises(
+            ValueError, lambda: PolyphaseResample(44100, 11025, quality='x'))
+
+    def test_raises_for_ratio_with_too_many_phases(self):
+        self.assertRaises(ValueError, lambda: PolyphaseResample(44100, 44101))
+
+
+@simple_in_memory_settings
+class Document(BaseModel):
+    raw = ByteStreamFeature(
+        ByteStream,
+        chunksize=4096,
+        store=False)
+
+    pcm = AudioSamplesFeature(
+        AudioStream,
+        needs=raw,
+        sum_to_mono=False,
+        store=True)
+
+    resampled = AudioSamplesFeature(
+        Resampler,
+        samplerate=SR11025(),
+        engine='polyphase',
+        needs=pcm,
+        store=True)
+
+
+class ResamplerTests(unittest2.TestCase):
+    def test_polyphase_engine_matches_whole_file_output(self):
+        samples = NoiseSynthesizer(SR44100()).synthesize(Seconds(5)).stereo
+        _id = Document.process(raw=samples.encode())
+        doc = Document(_id)
+        self.assertEqual(SR11025(), doc.resampled.samplerate)
+        expected = PolyphaseResample(44100, 11025, nchannels=2)(
+            doc.pcm, end_of_input=True)
+        np.testing.assert_array_equal(expected, doc.resampled)
+
+    def test_raises_for_unknown_engine(self):
+        self.assertRaises(ValueError, lambda: Resampler(engine='sox'))
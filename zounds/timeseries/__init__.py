@@ -7,7 +7,7 @@ from duration import \
     Hours, Minutes, Seconds, Milliseconds, Microseconds, Picoseconds, \
     Nanoseconds
 
-from audiosamples import AudioSamples
+from audiosamples import AudioSamples, wav_header
 
 from samplerate import \
     SR11025, SR16000, SR22050, SR44100, SR48000, SR96000, HalfLapped, \
@@ -1,6 +1,9 @@
 from samplerate import AudioSampleRate, audio_sample_rate
 from soundfile import SoundFile
-from io import BytesIO
+from io import BytesIO, UnsupportedOperation
+from collections import namedtuple
+import os
+import struct
 from zounds.core import IdentityDimension, ArrayWithUnits
 from timeseries import TimeDimension, TimeSlice
 from duration import Picoseconds, Seconds
@@ -8,6 +11,77 @@ from samplerate import SampleRate
 import numpy as np
 
 
+_WAVE_FORMAT_PCM = 0x0001
+_WAVE_FORMAT_IEEE_FLOAT = 0x0003
+_WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# (format tag, bits per sample) -> the dtype of the stored samples
+_wav_dtypes = {
+    (_WAVE_FORMAT_PCM, 8): np.dtype('u1'),
+    (_WAVE_FORMAT_PCM, 16): np.dtype('<i2'),
+    (_WAVE_FORMAT_PCM, 32): np.dtype('<i4'),
+    (_WAVE_FORMAT_IEEE_FLOAT, 32): np.dtype('<f4'),
+    (_WAVE_FORMAT_IEEE_FLOAT, 64): np.dtype('<f8')
+}
+
+WavHeader = namedtuple('WavHeader', [
+    'samplerate',
+    'channels',
+    'bits_per_sample',
+    'dtype',
+    'data_offset',
+    'data_length'])
+
+
+def wav_header(flo):
+    """
+    Walk the chunks of a RIFF/WAVE stream, stopping at the start of its
+    sample data
+
+    Args:
+        flo (file-like object): a seekable WAV stream
+
+    Returns:
+        WavHeader: a named tuple whose `data_offset` and `data_length` are in
+            bytes, and whose `dtype` is the numpy dtype of the stored samples,
+            or `None` if they can't be represented directly (e.g. 24-bit
+            samples)
+
+    Raises:
+        ValueError: if the stream isn't a WAV file, or has no sample data
+    """
+    flo.seek(0)
+    riff = flo.read(12)
+    if len(riff) < 12 or riff[:4] != 'RIFF' or riff[8:] != 'WAVE':
+        raise ValueError('stream is not a RIFF/WAVE file')
+
+    fmt = None
+    while True:
+        header = flo.read(8)
+        if len(header) < 8:
+            raise ValueError('WAV file has no data chunk')
+
+        chunk_id, size = struct.unpack('<4sI', header)
+        if chunk_id == 'data':
+            if fmt is None:
+                raise ValueError('WAV file has no fmt chunk')
+            tag, channels, samplerate, _, _, bits = \
+                struct.unpack('<HHIIHH', fmt[:16])
+            if tag == _WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+                # the actual format is the first field of the sub-format guid
+                tag, = struct.unpack('<H', fmt[24:26])
+            dtype = _wav_dtypes.get((tag, bits))
+            return WavHeader(
+                samplerate, channels, bits, dtype, flo.tell(), size)
+
+        if chunk_id == 'fmt ':
+            fmt = flo.read(size)
+            size -= len(fmt)
+
+        # chunks are padded to an even number of bytes
+        flo.seek(size + (size & 1), os.SEEK_CUR)
+
+
 class AudioSamples(ArrayWithUnits):
     """
     `AudioSamples` represents constant-rate samples of a continuous audio signal
@@ -77,11 +151,76 @@ class AudioSamples(ArrayWithUnits):
             return result
 
     @classmethod
-    def from_file(cls, file_like_object):
+    def from_file(cls, file_like_object, mmap=False):
+        """
+        Read audio samples from a file
+
+        Args:
+            file_like_object (str or file-like object): a path, or file-like
+                object in any format libsndfile can read
+            mmap (bool): when `True`, and the file is a 32-bit float WAV file
+                on disk, its samples are returned as a view of a memory
+                mapping rather than decoded by libsndfile, so loading is
+                instant, and only the parts of the file that are actually used
+                are read into memory.  Integer PCM, and anything else that
+                can't be used as-is, is read as usual
+
+        Returns:
+            AudioSamples: the samples, as 32-bit floats in the range [-1, 1)
+        """
+        if mmap:
+            samples = cls._memory_mapped(file_like_object)
+            if samples is not None:
+                return samples
+
         with SoundFile(file_like_object, mode='r') as f:
             samples = f.read(dtype=np.float32)
             return AudioSamples(samples, audio_sample_rate(f.samplerate))
 
+    @classmethod
+    def _memory_mapped(cls, file_like_object):
+        try:
+            f = open(file_like_object, 'rb') \
+                if isinstance(file_like_object, basestring) \
+                else file_like_object
+            fileno = f.fileno()
+        except (AttributeError, IOError, UnsupportedOperation):
+            # there's no file on disk to map
+            return None
+
+        position = f.tell()
+        try:
+            header = wav_header(f)
+            if header.dtype != np.float32:
+                # anything else would have to be converted, and so copied
+                return None
+
+            frame_size = header.dtype.itemsize * header.channels
+            available = os.fstat(fileno).st_size - header.data_offset
+            n_frames = min(header.data_length, available) // frame_size
+            if not n_frames:
+                return None
+
+            # the mapping outlives the file handle
+            data = np.memmap(
+                f,
+                dtype=header.dtype,
+                mode='r',
+                offset=header.data_offset,
+                shape=(n_frames, header.channels))
+        except ValueError:
+            return None
+        finally:
+            if f is file_like_object:
+                f.seek(position)
+            else:
+                f.close()
+
+        if header.channels == 1:
+            data = data[:, 0]
+
+        return AudioSamples(data, audio_sample_rate(header.samplerate))
+
     @classmethod
     def silence(cls, samplerate, duration, dtype=np.float32, channels=1):
         shape = (int(duration / samplerate.frequency), channels)
@@ -1,10 +1,17 @@
 import unittest2
 import numpy as np
+import os
+import mmap
+import shutil
+from io import BytesIO
+from tempfile import mkdtemp
 from duration import Seconds
 from samplerate import SR44100, SR11025, SampleRate, Stride
 from zounds.timeseries import TimeDimension, TimeSlice
 from zounds.core import IdentityDimension
-from audiosamples import AudioSamples
+from audiosamples import AudioSamples, wav_header
+from zounds.synthesize import NoiseSynthesizer
+from zounds.soundfile import resample
 from zounds.synthesize import SineSynthesizer, SilenceSynthesizer
 
 
@@ -197,3 +204,140 @@ class AudioSamplesTest(unittest2.TestCase):
         # prior to this test, the line above caused a segfault, so the assertion
         # below is fairly worthless, and mostly a formality
         self.assertIsNotNone(raw)
+
+
+
+class WavHeaderTests(unittest2.TestCase):
+    def test_finds_sample_data(self):
+        samples = NoiseSynthesizer(SR11025()).synthesize(Seconds(1)).stereo
+        encoded = samples.encode(fmt='WAV', subtype='PCM_16')
+        header = wav_header(encoded)
+        self.assertEqual(11025, header.samplerate)
+        self.assertEqual(2, header.channels)
+        self.assertEqual(np.dtype('<i2'), header.dtype)
+        self.assertEqual(
+            len(encoded.getvalue()), header.data_offset + header.data_length)
+
+    def test_float_samples(self):
+        samples = NoiseSynthesizer(SR11025()).synthesize(Seconds(1))
+        encoded = samples.encode(fmt='WAV', subtype='FLOAT')
+        self.assertEqual(np.dtype('<f4'), wav_header(encoded).dtype)
+
+    def test_unsupported_samples_have_no_dtype(self):
+        samples = NoiseSynthesizer(SR11025()).synthesize(Seconds(1))
+        encoded = samples.encode(fmt='WAV', subtype='PCM_24')
+        self.assertIsNone(wav_header(encoded).dtype)
+
+    def test_raises_for_other_formats(self):
+        samples = NoiseSynthesizer(SR11025()).synthesize(Seconds(1))
+        encoded = samples.encode(fmt='FLAC', subtype='PCM_16')
+        self.assertRaises(ValueError, lambda: wav_header(encoded))
+
+
+class MemoryMappedAudioSamplesTests(unittest2.TestCase):
+    def setUp(self):
+        self._dir = mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+    def _file(self, subtype='PCM_16', fmt='WAV', stereo=False, samples=None):
+        if samples is None:
+            samples = NoiseSynthesizer(SR11025()).synthesize(Seconds(3))
+        if stereo:
+            samples = samples.stereo
+        path = os.path.join(self._dir, 'audio')
+        samples.save(path, fmt=fmt, subtype=subtype)
+        return path
+
+    def _full_scale_file(self):
+        samples = SineSynthesizer(SR11025()).synthesize(Seconds(3), [440])
+        samples /= np.abs(samples).max()
+        return self._file(stereo=True, samples=samples)
+
+    def _is_memory_mapped(self, samples):
+        base = samples
+        while isinstance(base, np.ndarray):
+            base = base.base
+        return isinstance(base, mmap.mmap)
+
+    def _assert_matches_read(self, path):
+        expected = AudioSamples.from_file(path)
+        mapped = AudioSamples.from_file(path, mmap=True)
+        self.assertIsInstance(mapped, AudioSamples)
+        self.assertEqual(np.float32, mapped.dtype)
+        self.assertEqual(expected.samplerate, mapped.samplerate)
+        self.assertEqual(expected.shape, mapped.shape)
+        np.testing.assert_array_equal(expected, mapped)
+        return mapped
+
+    def test_pcm16_is_read_rather_than_converted_from_mapping(self):
+        mapped = self._assert_matches_read(self._file())
+        self.assertFalse(self._is_memory_mapped(mapped))
+
+    def test_stereo_pcm16(self):
+        mapped = self._assert_matches_read(self._file(stereo=True))
+        self.assertEqual(2, mapped.channels)
+
+    def test_pcm32(self):
+        self._assert_matches_read(self._file(subtype='PCM_32'))
+
+    def test_unsigned_pcm8(self):
+        self._assert_matches_read(self._file(subtype='PCM_U8'))
+
+    def test_double_is_read_rather_than_converted_from_mapping(self):
+        mapped = self._assert_matches_read(self._file(subtype='DOUBLE'))
+        self.assertFalse(self._is_memory_mapped(mapped))
+
+    def test_float_is_memory_mapped_without_conversion(self):
+        mapped = self._assert_matches_read(self._file(subtype='FLOAT'))
+        self.assertTrue(self._is_memory_mapped(mapped))
+        sliced = mapped[TimeSlice(Seconds(1), start=Seconds(1))]
+        self.assertIsInstance(sliced, AudioSamples)
+        self.assertEqual(11025, len(sliced))
+
+    def test_pcm16_is_in_range(self):
+        path = self._full_scale_file()
+        mapped = AudioSamples.from_file(path, mmap=True)
+        self.assertLessEqual(np.abs(mapped).max(), 1)
+        self.assertAlmostEqual(1, mapped.max(), places=3)
+
+    def test_pcm16_mono_matches_read(self):
+        path = self._full_scale_file()
+        expected = AudioSamples.from_file(path).mono
+        mapped = AudioSamples.from_file(path, mmap=True).mono
+        self.assertEqual(np.float32, mapped.dtype)
+        np.testing.assert_array_equal(expected, mapped)
+
+    def test_pcm16_resample_matches_read(self):
+        path = self._full_scale_file()
+        for engine in ('libsamplerate', 'polyphase'):
+            expected = resample(
+                AudioSamples.from_file(path), SR44100(), engine=engine)
+            mapped = resample(
+                AudioSamples.from_file(path, mmap=True),
+                SR44100(),
+                engine=engine)
+            np.testing.assert_array_equal(expected, mapped)
+            self.assertLess(np.abs(mapped).max(), 1.1)
+
+    def test_can_map_open_file(self):
+        path = self._file(subtype='FLOAT')
+        with open(path, 'rb') as f:
+            f.seek(10)
+            mapped = AudioSamples.from_file(f, mmap=True)
+            self.assertEqual(10, f.tell())
+        self.assertTrue(self._is_memory_mapped(mapped))
+
+    def test_falls_back_to_reading_other_formats(self):
+        path = self._file(fmt='FLAC')
+        samples = AudioSamples.from_file(path, mmap=True)
+        self.assertFalse(self._is_memory_mapped(samples))
+        np.testing.assert_array_equal(AudioSamples.from_file(path), samples)
+
+    def test_falls_back_to_reading_in_memory_files(self):
+        samples = NoiseSynthesizer(SR11025()).synthesize(Seconds(1))
+        encoded = BytesIO(samples.encode().read())
+        samples = AudioSamples.from_file(encoded, mmap=True)
+        self.assertEqual(np.float32, samples.dtype)
+        self.assertEqual(11025, len(samples))
@@ -63,6 +63,8 @@ class BaseZoundsApp(object):
             ConstantRateTimeSeriesSerializer(),
             DefaultSerializer('application/json'),
             DefaultSerializer('audio/ogg'),
+            DefaultSerializer('audio/flac'),
+            DefaultSerializer('audio/wav'),
             NumpySerializer(),
             OnsetsSerializer(
                 self.visualization_feature,
@@ -3,7 +3,7 @@ from zounds.persistence import ArrayWithUnitsFeature
 from zounds.timeseries import Seconds, Picoseconds, TimeSlice, AudioSamples
 from zounds.segment import TimeSliceFeature
 from zounds.index import SearchResults
-from zounds.soundfile import OggVorbisFeature
+from zounds.soundfile import OggVorbisFeature, AudioCodecFeature
 from soundfile import SoundFile
 from contentrange import ContentRange
 import numpy as np
@@ -95,7 +95,9 @@ class AudioSamplesSerializer(object):
 
 class OggVorbisSerializer(object):
     """
-    Serializer capable of handling range requests against ogg vorbis files
+    Serializer capable of handling range requests against stored audio (ogg
+    vorbis files, or any other codec supported by :class:`AudioCodecFeature`),
+    which is served as ogg vorbis
     """
 
     def __init__(self):
@@ -104,8 +106,9 @@ class OggVorbisSerializer(object):
     def matches(self, context):
         if context.feature is None:
             return False
+        audio_features = (OggVorbisFeature, AudioCodecFeature)
         return \
-            isinstance(context.feature, OggVorbisFeature) \
+            isinstance(context.feature, audio_features) \
             and isinstance(context.slce, TimeSlice)
 
     @property